@@ -114,7 +114,406 @@ def test_delete_favorite(client, db):
     assert get_response.status_code == 404
     logger.info("Delete favorite test passed")
 
+def test_create_fully_specified_favorite(client, db):
+    logger.info("Testing create favorite endpoint without a task")
+    folder_id = client.post("/api/folders/", json={"name": "Reading"}).json()["id"]
+    response = client.post(
+        "/api/favorites/",
+        json={"url": "https://example.org", "title": "Example", "summary": "An example website",
+              "tags": ["Example", "Test"], "folder_id": folder_id}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert "task_id" not in data
+    assert data["folder_id"] == folder_id
+    assert sorted(tag["name"] for tag in data["tags"]) == ["Example", "Test"]
+    logger.info("Fully specified favorite test passed")
+
+def test_create_favorite_without_title(client, isolated_db, isolated_vector_store):
+    logger.info("Testing create favorite endpoint without a title")
+    collection = isolated_vector_store.collection
+    folder_id = client.post("/api/folders/", json={"name": "Untitled"}).json()["id"]
+    response = client.post(
+        "/api/favorites/",
+        json={"url": "https://untitled.example.com", "title": None, "summary": "A page without a title",
+              "tags": ["Untitled"], "folder_id": folder_id}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["title"] is None
+    stored = collection.get(ids=[str(data["id"])])
+    assert stored["metadatas"][0]["title"] == ""
+    logger.info("Favorite without a title test passed")
+
+def test_bulk_create_requires_fully_specified_favorites(client, db):
+    logger.info("Testing bulk create validation")
+    response = client.post(
+        "/api/favorites/bulk",
+        json=[{"url": "https://example.com", "title": "Example", "summary": "An example website"}]
+    )
+    assert response.status_code == 400
+    logger.info("Bulk create validation test passed")
+
+def test_stream_import_rejects_invalid_lines(client, db):
+    logger.info("Testing streaming import validation")
+    response = client.post(
+        "/api/favorites/import/stream",
+        content=b'{"title": "No URL"}\n{broken\n'
+    )
+    assert response.status_code == 400
+    detail = response.json()["detail"]
+    assert detail["accepted"] == 0
+    assert detail["rejected"] == 2
+    logger.info("Streaming import validation test passed")
+
+def test_import_pipeline_retries_failed_write(client, isolated_db, isolated_vector_store, monkeypatch):
+    logger.info("Testing an import whose write fails once")
+    import asyncio
+    import models
+    import import_checkpoints
+    from database import SessionLocal
+    from import_pipeline import ImportPipeline
+
+    class Extractor:
+        async def fetch_page(self, url):
+            return None
+
+        def extract_page(self, url, page):
+            return None, ("meta", "content")
+
+    class NLP:
+        content_extractor = Extractor()
+
+        async def enrich(self, db, url, content, metadata, fetch_failed=False, meta_info=None):
+            return {"summary": f"About {url}", "tags": ["Pipeline"], "folder_id": None}
+
+    write_items = ImportPipeline._write_items
+    failures = []
+
+    def write_items_once(self, items):
+        if not failures:
+            failures.append(len(items))
+            raise RuntimeError("database is locked")
+        write_items(self, items)
+
+    monkeypatch.setattr(ImportPipeline, "_write_items", write_items_once)
+    monkeypatch.setattr(import_checkpoints, "RETRY_BASE_SECONDS", 0)
+    urls = [f"https://pipeline{i}.example.com/" for i in range(3)]
+    with SessionLocal() as session:
+        session.add_all(models.FavoriteToProcess(url=url, title=url, metainfo="") for url in urls)
+        session.commit()
+
+    pipeline = ImportPipeline(NLP(), "test-import")
+    report = asyncio.run(asyncio.wait_for(pipeline.run(len(urls)), timeout=30))
+    assert failures
+    assert report["succeeded"] == len(urls)
+    assert report["retried"] == failures[0]
+    with SessionLocal() as session:
+        rows = session.query(models.FavoriteToProcess).filter(models.FavoriteToProcess.url.in_(urls)).all()
+        assert all(row.processed and row.outcome == models.STAGING_DONE for row in rows)
+        assert session.query(models.Favorite).filter(models.Favorite.url.in_(urls)).count() == len(urls)
+    logger.info("Failed write test passed")
+
+def test_import_pipeline_writes_a_batch_at_once(isolated_db, isolated_vector_store, monkeypatch):
+    logger.info("Testing the batched write stage of an import")
+    from sqlalchemy import event
+    import models
+    from database import SessionLocal
+    from import_pipeline import ImportItem, ImportPipeline
+
+    with SessionLocal() as session:
+        pending = models.Favorite(url="https://pending.example.com/", enrichment_state=models.ENRICHMENT_PENDING)
+        saved = models.Favorite(url="https://saved.example.com/", title="Saved")
+        session.add_all([pending, saved])
+        session.flush()
+        rows = [
+            models.FavoriteToProcess(url="https://new.example.com/", title="New"),
+            models.FavoriteToProcess(url="https://pending.example.com/", title="Pending", favorite_id=pending.id),
+            models.FavoriteToProcess(url="https://SAVED.example.com", title="Saved"),
+            models.FavoriteToProcess(url="https://broken.example.com/", title="Broken"),
+        ]
+        session.add_all(rows)
+        session.commit()
+        items = [
+            ImportItem(staging_id=row.id, url=row.url, title=row.title, metadata=None, favorite_id=row.favorite_id,
+                       summary=f"About {row.title}", tags=["Batch", row.title], enriched=True)
+            for row in rows
+        ]
+        pending_id, saved_id = pending.id, saved.id
+    items[3].error = RuntimeError("unusable response")
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(isolated_db, "before_cursor_execute", count)
+    try:
+        ImportPipeline(object(), "test-import")._write_items(items)
+    finally:
+        event.remove(isolated_db, "before_cursor_execute", count)
+
+    assert [item.favorite_id for item in items[:3]] == [items[0].favorite_id, pending_id, saved_id]
+    assert items[3].retry_scheduled
+    # The tag links of all three favorites go in one executemany
+    assert sum(statement.startswith("INSERT INTO favorite_tags") for statement in statements) == 1
+    with SessionLocal() as session:
+        for item in items[:3]:
+            favorite = session.get(models.Favorite, item.favorite_id)
+            assert favorite.summary == f"About {item.title}"
+            assert favorite.enrichment_state == models.ENRICHMENT_DONE
+            assert sorted(tag.name for tag in favorite.tags) == sorted(["Batch", item.title])
+        outcomes = {row.url: (row.processed, row.outcome) for row in session.query(models.FavoriteToProcess)}
+        assert outcomes["https://broken.example.com/"] == (False, None)
+        assert all(outcome == (True, models.STAGING_DONE) for url, outcome in outcomes.items() if "broken" not in url)
+    assert isolated_vector_store.collection.count() == 3
+    logger.info("Batched write stage test passed")
+
+def test_create_pending_favorite_twice(isolated_db, isolated_vector_store):
+    logger.info("Testing a pending favorite saved twice")
+    from sqlalchemy import event
+    import models
+    import schemas
+    from database import SessionLocal
+
+    first = favorite_service.create_pending_favorite(schemas.FavoriteCreate(url="https://twice.example.com/page"))
+    again = favorite_service.create_pending_favorite(
+        schemas.FavoriteCreate(url="https://Twice.example.com/page/?utm_source=feed")
+    )
+    assert again == first
+
+    # Another request saves the URL between the lookup and the insert
+    raced = []
+
+    def save_meanwhile(session):
+        if not raced:
+            raced.append(True)
+            with SessionLocal() as other:
+                other.add(models.Favorite(url="https://raced.example.com/", enrichment_state=models.ENRICHMENT_PENDING))
+                other.commit()
+
+    event.listen(SessionLocal, "before_commit", save_meanwhile)
+    try:
+        second = favorite_service.create_pending_favorite(schemas.FavoriteCreate(url="https://raced.example.com"))
+    finally:
+        event.remove(SessionLocal, "before_commit", save_meanwhile)
+    with SessionLocal() as session:
+        rows = session.query(models.Favorite).filter(models.Favorite.canonical_url.like("%raced.example.com%")).all()
+        assert [row.id for row in rows] == [second]
+    logger.info("Pending favorite saved twice test passed")
+
+def test_lazy_staging_links_pending_favorites(isolated_db, isolated_vector_store, monkeypatch):
+    logger.info("Testing lazy staging of an import")
+    import models
+    import schemas
+    import services
+    from database import SessionLocal
+
+    monkeypatch.setattr(services, "LAZY_ENRICHMENT", True)
+    monkeypatch.setattr(services, "STAGING_CHUNK_SIZE", 2)
+    with SessionLocal() as session:
+        session.add(models.Favorite(url="https://saved.example.com/", enrichment_state=models.ENRICHMENT_DONE))
+        session.commit()
+    urls = ["https://saved.example.com", "https://one.example.com/", "https://two.example.com/",
+            "https://ONE.example.com", "https://three.example.com/"]
+    staged = favorite_service._stage_favorites([schemas.FavoriteImport(url=url, title=url) for url in urls])
+    assert staged == 3
+    with SessionLocal() as session:
+        rows = session.query(models.FavoriteToProcess).all()
+        assert sorted(row.url for row in rows) == sorted(urls[i] for i in (1, 2, 4))
+        for row in rows:
+            favorite = session.get(models.Favorite, row.favorite_id)
+            assert favorite.url == row.url
+            assert favorite.enrichment_state == models.ENRICHMENT_PENDING
+    logger.info("Lazy staging test passed")
+
+def test_import_queues_refinement(monkeypatch):
+    logger.info("Testing the refinement queued after an import")
+    import services
+
+    queued = []
+    monkeypatch.setattr(services.task_queue, "add_task", lambda func, name, *args, **kwargs: queued.append(func))
+    monkeypatch.setattr(services.task_queue, "has_unfinished", lambda funcs: bool(queued))
+    assert services.REFINE_AFTER_IMPORT
+    favorite_service.refine_after_import({"needs_refinement": 0})
+    assert queued == []
+    favorite_service.refine_after_import({"needs_refinement": 2})
+    favorite_service.refine_after_import({"needs_refinement": 3})
+    assert queued == [favorite_service.refine_favorites_task]
+    logger.info("Refinement after import test passed")
+
+def test_refine_uses_import_metadata(isolated_db, isolated_vector_store, monkeypatch):
+    logger.info("Testing the metadata a refinement is given")
+    import asyncio
+    import models
+    import services
+    from database import SessionLocal
+
+    prompts = []
+
+    async def summarize_content(url, metadata):
+        prompts.append(("summary", url, metadata))
+        return f"Refined {url}"
+
+    async def suggest_tags(summary, metadata):
+        prompts.append(("tags", summary, metadata))
+        return ["Refined"]
+
+    monkeypatch.setattr(services.nlp_service, "summarize_content", summarize_content)
+    monkeypatch.setattr(services.nlp_service, "suggest_tags", suggest_tags)
+    monkeypatch.setattr(services.task_queue, "update_progress", lambda task_id, progress: None)
+    with SessionLocal() as session:
+        session.add_all([
+            models.Favorite(url="https://imported.example.com/", title="Imported", needs_refinement=True),
+            models.Favorite(url="https://saved.example.com/", title="Saved", needs_refinement=True),
+            models.FavoriteToProcess(url="https://imported.example.com", title="Imported",
+                                     metainfo="Bookmarked in: Reading list", processed=True),
+        ])
+        session.commit()
+
+    assert asyncio.run(favorite_service.refine_favorites_task("refine")) == "Refined 2 out of 2 favorites"
+    assert prompts == [
+        ("summary", "https://imported.example.com/", "Bookmarked in: Reading list"),
+        ("tags", "Refined https://imported.example.com/", "Bookmarked in: Reading list"),
+        ("summary", "https://saved.example.com/", "Title: Saved\n"),
+        ("tags", "Refined https://saved.example.com/", "Title: Saved\n"),
+    ]
+    logger.info("Refinement metadata test passed")
+
+def test_fetch_error_is_not_retried(monkeypatch):
+    logger.info("Testing a fetch that fails without a response")
+    import asyncio
+    import services
+    from http_client import FetchError
+
+    calls = []
+
+    class Client:
+        async def get(self, url, **kwargs):
+            calls.append(url)
+            raise FetchError("ClientConnectorError: connection refused")
+
+    monkeypatch.setattr(services, "http_client", Client())
+    with pytest.raises(FetchError):
+        asyncio.run(services.nlp_service.fetch_with_retries("https://refused.example.com/"))
+    assert calls == ["https://refused.example.com/"]
+    logger.info("Fetch error test passed")
+
+PAGE = (b"<html><head><title>Async scraping in Python</title>"
+        b"<meta name=\"description\" content=\"Build fast scrapers with aiohttp.\"></head>"
+        b"<body><p>Lorem ipsum</p></body></html>")
+
+def enrich_fetched_page(monkeypatch, db, url):
+    """Enrich url from a successfully fetched PAGE, recording the texts the folder shortlist and tag kNN get."""
+    import asyncio
+    import metadata_gate
+    import services
+    from folder_index import FolderShortlist
+    from http_client import FetchResponse
+
+    calls = {"shortlist": [], "tags": []}
+
+    async def fetch(url, **kwargs):
+        return FetchResponse(url, 200, {"Content-Type": "text/html; charset=utf-8"}, PAGE)
+
+    class Index:
+        def shortlist(self, db, text):
+            calls["shortlist"].append(text)
+            return FolderShortlist([(42, 0.99)], "", skip_similarity=0.9)
+
+    class Suggester:
+        def suggest(self, text, exclude_id=None):
+            calls["tags"].append(text)
+            return ["Python", "Scraping"]
+
+    class LLM:
+        async def agenerate(self, prompt, use_cache=True):
+            return '{"summary": "A tutorial on async scraping."}'
+
+        def invalidate(self, prompt):
+            pass
+
+    extractor = services.nlp_service.content_extractor
+    monkeypatch.setattr(extractor, "fetch", fetch)
+    monkeypatch.setattr(extractor, "cache", None)
+    monkeypatch.setattr(metadata_gate, "ENABLED", False)
+    monkeypatch.setattr(services, "folder_index", Index())
+    monkeypatch.setattr(services, "tag_suggester", Suggester())
+    monkeypatch.setattr(services, "llm_service", LLM())
+    monkeypatch.setattr(services, "domain_affinity", None)
+    enrichment = asyncio.run(services.nlp_service.enrich_url(db, url, "metadata"))
+    return enrichment, calls
+
+def test_enrich_uses_folder_shortlist_for_fetched_page(client, db, monkeypatch):
+    logger.info("Testing the folder shortlist for a fetched page")
+    enrichment, calls = enrich_fetched_page(monkeypatch, db, "https://scraping.example.com/")
+    assert len(calls["shortlist"]) == 1
+    assert isinstance(calls["shortlist"][0], str)
+    assert "Async scraping in Python" in calls["shortlist"][0]
+    assert enrichment["folder_id"] == 42
+    logger.info("Folder shortlist test passed")
+
+def test_enrich_suggests_tags_from_fetched_page(client, db, monkeypatch):
+    logger.info("Testing nearest neighbour tags for a fetched page")
+    enrichment, calls = enrich_fetched_page(monkeypatch, db, "https://tags.example.com/")
+    assert len(calls["tags"]) == 1
+    assert isinstance(calls["tags"][0], str)
+    assert "Build fast scrapers with aiohttp." in calls["tags"][0]
+    assert enrichment["tags"] == ["Python", "Scraping"]
+    logger.info("Nearest neighbour tags test passed")
+
 # Test folder endpoints
+def test_folder_index_updates_only_new_folders(isolated_db, monkeypatch):
+    logger.info("Testing the folder index after a folder is added")
+    import folder_index
+    import models
+    from database import SessionLocal
+    from folder_tree import folder_tree_cache
+
+    class Store:
+        def __init__(self):
+            self.embedded = []
+            self.looked_up = []
+
+        def embed(self, texts):
+            self.embedded.extend(texts)
+            return [[1.0, float(len(text))] for text in texts]
+
+        def get_embeddings(self, ids):
+            self.looked_up.append(sorted(ids))
+            return {id: [0.0, 1.0] for id in ids}
+
+    store = Store()
+    index = folder_index.FolderIndex(store=store)
+    with SessionLocal() as session:
+        root = models.Folder(name="Root")
+        session.add(root)
+        session.flush()
+        python = models.Folder(name="Python", parent_id=root.id)
+        session.add(python)
+        session.flush()
+        session.add_all(models.Favorite(url=f"https://python{i}.example.com/", folder_id=python.id) for i in range(3))
+        session.commit()
+
+        assert index.shortlist(session, "asyncio").best[0] == python.id
+        assert store.looked_up == [[1, 2, 3]]
+
+        session.add(models.Folder(name="Rust", parent_id=root.id))
+        session.commit()
+        folder_tree_cache.invalidate()
+        store.embedded.clear()
+        shortlist = index.shortlist(session, "tokio")
+        assert {folder_id for folder_id, _ in shortlist.candidates} == {python.id, python.id + 1}
+        # Only the new folder is embedded and looked up, besides the query
+        assert store.embedded == ["Rust", "tokio"]
+        assert store.looked_up == [[1, 2, 3], []]
+
+        monkeypatch.setattr(folder_index, "REFRESH_INTERVAL", 0)
+        index.shortlist(session, "tokio")
+        assert store.looked_up[-1] == [1, 2, 3]
+        assert not index._refreshing
+    logger.info("Folder index update test passed")
+
 def test_create_folder(client, db):
     logger.info("Testing create folder endpoint")
     response = client.post(
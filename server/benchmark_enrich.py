@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import json
+import re
+import statistics
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models
+import services
+from database import Base
+from llm import LLMProvider, LLMService, llm_service
+from loop_local import aclose_loop_values
+
+# Compares the end-to-end enrichment time per favorite of the combined prompt
+# (NLPService.enrich) with the three separate summary, tags and folder prompts
+# (NLPService.enrich_stepwise). Usage:
+#   python benchmark_enrich.py --favorites 20
+#   python benchmark_enrich.py --favorites 5 --live   # the configured provider, cache bypassed
+# The simulated provider models a hosted API: a fixed round trip plus time per
+# prompt token and per generated token.
+
+FOLDERS = {
+    "Development": ["Python", "JavaScript", "React", "DevOps"],
+    "Technology": ["Artificial Intelligence", "Hardware"],
+    "Reading": ["News", "Blogs"],
+}
+
+SUMMARY = ("This article is a hands-on tutorial on building asynchronous web scrapers in Python. "
+           "It walks through aiohttp sessions, connection pooling and retry strategies with complete code examples.")
+TAGS = ["Python", "Asyncio", "Web scraping", "Aiohttp"]
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class SimulatedProvider(LLMProvider):
+    model = "simulated"
+
+    def __init__(self, round_trip, per_prompt_token, per_output_token):
+        self.round_trip = round_trip
+        self.per_prompt_token = per_prompt_token
+        self.per_output_token = per_output_token
+        self.calls = 0
+        self.prompt_tokens = 0
+
+    def generate(self, prompt: str) -> str:
+        folder_ids = [int(folder_id) for folder_id in re.findall(r"\(ID: (\d+)\)", prompt)]
+        folder = {"name": "Development", "id": folder_ids[0] if folder_ids else 1,
+                  "children": [{"name": "Python", "id": folder_ids[-1] if folder_ids else 1}]}
+        if "choose the folder it belongs in" in prompt:
+            response = json.dumps({"summary": SUMMARY, "tags": TAGS, "folder": folder}, indent=4)
+        elif "suggesting the most appropriate folder" in prompt:
+            response = json.dumps(folder, indent=4)
+        elif "suggesting 3-5 relevant tags" in prompt:
+            response = ", ".join(TAGS)
+        else:
+            response = SUMMARY
+
+        prompt_tokens = estimate_tokens(prompt)
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        time.sleep(self.round_trip + prompt_tokens * self.per_prompt_token
+                   + estimate_tokens(response) * self.per_output_token)
+        return response
+
+    def generate_stream(self, prompt: str):
+        yield self.generate(prompt)
+
+
+class CountingProvider(LLMProvider):
+    def __init__(self, provider):
+        self.provider = provider
+        self.model = getattr(provider, "model", "")
+        self.calls = 0
+        self.prompt_tokens = 0
+
+    def generate(self, prompt: str) -> str:
+        self.calls += 1
+        self.prompt_tokens += estimate_tokens(prompt)
+        return self.provider.generate(prompt)
+
+    def generate_stream(self, prompt: str):
+        return self.provider.generate_stream(prompt)
+
+    async def agenerate(self, prompt: str) -> str:
+        self.calls += 1
+        self.prompt_tokens += estimate_tokens(prompt)
+        return await self.provider.agenerate(prompt)
+
+
+def create_session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    root = models.Folder(name="Favorites")
+    db.add(root)
+    db.flush()
+    for parent_name, children in FOLDERS.items():
+        parent = models.Folder(name=parent_name, parent_id=root.id)
+        db.add(parent)
+        db.flush()
+        db.add_all(models.Folder(name=name, parent_id=parent.id) for name in children)
+    db.commit()
+    return db
+
+
+def sample_favorite(index):
+    metadata = json.dumps({
+        "title": f"Async scraping in Python, part {index}",
+        "description": "Build fast asynchronous scrapers with aiohttp and asyncio.",
+        "keywords": "python, asyncio, aiohttp, scraping",
+    })
+    content = ("Title: Async scraping in Python\n"
+               "Description: Build fast asynchronous scrapers with aiohttp and asyncio.\n"
+               "Keywords: python, asyncio, aiohttp, scraping\n")
+    return f"https://example.com/async-scraping-{index}", content, metadata
+
+
+async def run(enrich, db, favorites):
+    durations = []
+    for index in range(favorites):
+        url, content, metadata = sample_favorite(index)
+        started = time.perf_counter()
+        await enrich(db, url, content, metadata)
+        durations.append(time.perf_counter() - started)
+    await aclose_loop_values()
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark combined vs separate enrichment prompts")
+    parser.add_argument("--favorites", type=int, default=10)
+    parser.add_argument("--live", action="store_true", help="Use the configured LLM provider")
+    parser.add_argument("--round-trip", type=float, default=0.4, help="Simulated seconds per call")
+    parser.add_argument("--per-prompt-token", type=float, default=0.0001, help="Simulated seconds per prompt token")
+    parser.add_argument("--per-output-token", type=float, default=0.015, help="Simulated seconds per output token")
+    args = parser.parse_args()
+
+    nlp_service = services.nlp_service
+    modes = {"combined": nlp_service.enrich, "separate": nlp_service.enrich_stepwise}
+
+    print(f"{args.favorites} favorites, {'live provider' if args.live else 'simulated provider'}\n")
+    print(f"{'mode':<10}{'s/favorite':>12}{'p95 s':>8}{'calls':>8}{'prompt tokens':>15}")
+    for mode, enrich in modes.items():
+        if args.live:
+            provider = CountingProvider(llm_service.provider)
+        else:
+            provider = SimulatedProvider(args.round_trip, args.per_prompt_token, args.per_output_token)
+        # Without a cache, a cached answer would make the second mode look free
+        services.llm_service = LLMService(provider)
+        db = create_session()
+        try:
+            durations = asyncio.run(run(enrich, db, args.favorites))
+        finally:
+            db.close()
+        p95 = sorted(durations)[max(0, int(len(durations) * 0.95) - 1)]
+        print(f"{mode:<10}{statistics.mean(durations):>12.2f}{p95:>8.2f}"
+              f"{provider.calls / args.favorites:>8.1f}{provider.prompt_tokens // args.favorites:>15}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import statistics
+import multiprocessing
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from http_client import AsyncHttpClient
+
+# Compares the old requests.Session + asyncio.to_thread fetch path with the
+# async http_client (aiohttp pool, or httpx with FETCH_HTTP2=true) against a local stand-in server. Usage:
+#   python benchmark_fetch.py --requests 1000 --latency 0.02
+
+PAGE = (
+    "<html><head><title>Benchmark page</title>"
+    "<meta name=\"description\" content=\"A page served by the local benchmark server\">"
+    "</head><body>" + "<p>Lorem ipsum dolor sit amet.</p>" * 500 + "</body></html>"
+).encode("utf-8")
+
+
+RESPONSE = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/html; charset=utf-8\r\n"
+    b"Content-Length: " + str(len(PAGE)).encode() + b"\r\n"
+    b"\r\n" + PAGE
+)
+
+
+async def handle_connection(reader, writer, latency):
+    # Minimal keep-alive HTTP/1.1 server, GET requests without bodies only
+    try:
+        while True:
+            request = await reader.readuntil(b"\r\n\r\n")
+            if not request:
+                break
+            if latency:
+                await asyncio.sleep(latency)
+            writer.write(RESPONSE)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def serve(latency, port_queue):
+    async def run():
+        server = await asyncio.start_server(
+            lambda reader, writer: handle_connection(reader, writer, latency),
+            "127.0.0.1", 0, backlog=1024,
+        )
+        port_queue.put(server.sockets[0].getsockname()[1])
+        await server.serve_forever()
+
+    asyncio.run(run())
+
+
+def start_server(latency):
+    # Separate process, so the server does not compete with the clients for the GIL.
+    # It is asyncio based, so it is not the bottleneck at 200 open connections.
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(latency, port_queue), daemon=True)
+    process.start()
+    return process, f"http://127.0.0.1:{port_queue.get()}/"
+
+
+def make_requests_session(pool_size):
+    session = requests.Session()
+    retries = Retry(
+        total=5, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504], raise_on_status=False
+    )
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    return session
+
+
+async def run_requests(url, total, concurrency):
+    session = make_requests_session(concurrency)
+
+    async def fetch():
+        response = await asyncio.to_thread(session.get, url, timeout=15)
+        response.raise_for_status()
+        return len(response.content)
+
+    return await run_load(fetch, total, concurrency)
+
+
+async def run_async_client(url, total, concurrency):
+    client = AsyncHttpClient(max_connections=concurrency)
+
+    async def fetch():
+        response = await client.get(url)
+        response.raise_for_status()
+        return len(response.content)
+
+    try:
+        return await run_load(fetch, total, concurrency)
+    finally:
+        await client.aclose()
+
+
+async def run_load(fetch, total, concurrency):
+    latencies = []
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            started = time.perf_counter()
+            await fetch()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests_per_second": total / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark content fetching clients")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per run")
+    parser.add_argument("--latency", type=float, default=0.02, help="Server side delay per request in seconds")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200])
+    args = parser.parse_args()
+
+    process, url = start_server(args.latency)
+    try:
+        print(f"{'client':<20}{'concurrency':>12}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for concurrency in args.concurrency:
+            for name, runner in (("requests+to_thread", run_requests), ("async http_client", run_async_client)):
+                result = asyncio.run(runner(url, args.requests, concurrency))
+                print(
+                    f"{name:<20}{concurrency:>12}{result['requests_per_second']:>10.1f}"
+                    f"{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+                )
+    finally:
+        process.terminate()
+
+
+if __name__ == "__main__":
+    main()
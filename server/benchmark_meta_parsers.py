@@ -0,0 +1,98 @@
+import argparse
+import glob
+import os
+import random
+import time
+import tracemalloc
+
+from meta_parsers import PARSERS
+
+# Compares the meta parser backends on a corpus of saved HTML pages. Usage:
+#   python benchmark_meta_parsers.py --corpus path/to/saved_pages --rounds 5
+# Without --corpus a synthetic corpus of typical pages is generated.
+
+
+def load_corpus(path):
+    pages = []
+    for file_path in sorted(glob.glob(os.path.join(path, "**", "*.htm*"), recursive=True)):
+        with open(file_path, "rb") as f:
+            pages.append(f.read().decode("utf-8", errors="replace"))
+    return pages
+
+
+def synthetic_corpus(count, seed=42):
+    rng = random.Random(seed)
+    words = "python react async cache vector search favorites browser extension summary folder tag".split()
+    pages = []
+    for i in range(count):
+        sentence = " ".join(rng.choice(words) for _ in range(rng.randint(8, 30)))
+        head = [
+            f"<title>Page {i} &amp; {rng.choice(words)}</title>",
+            '<meta charset="utf-8">',
+            '<meta name="viewport" content="width=device-width, initial-scale=1">',
+            f'<meta name="description" content="{sentence}">',
+            f'<meta name="keywords" content="{", ".join(rng.sample(words, 4))}">',
+            f'<meta property="og:title" content="Page {i}">',
+            f'<meta property="og:description" content="{sentence}">',
+            f'<meta property="og:url" content="https://example.com/{i}">',
+            '<meta property="og:type" content="article">',
+        ]
+        head += [f'<link rel="stylesheet" href="/static/{n}.css">' for n in range(rng.randint(2, 10))]
+        head += [f"<script>var config{n} = {{\"a\": {n}}};</script>" for n in range(rng.randint(1, 5))]
+        body = "".join(
+            f"<div class=\"c{n}\"><p>{sentence}</p><a href=\"/l/{n}\">{rng.choice(words)}</a></div>"
+            for n in range(rng.randint(20, 400))
+        )
+        pages.append(f"<!DOCTYPE html><html><head>{''.join(head)}</head><body>{body}</body></html>")
+    return pages
+
+
+def head_only(page):
+    end = page.lower().find("</head")
+    return page if end == -1 else page[:end + len("</head>")]
+
+
+def run(parser, pages, rounds):
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for page in pages:
+            parser.parse(page)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(pages) * rounds / elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark meta tag extraction backends")
+    parser.add_argument("--corpus", help="Directory with saved .html pages")
+    parser.add_argument("--pages", type=int, default=200, help="Size of the synthetic corpus")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--head-only", action="store_true",
+                        help="Cut pages after </head> like the default head-only fetch does")
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.pages)
+    if args.head_only:
+        pages = [head_only(page) for page in pages]
+    if not pages:
+        raise SystemExit(f"No HTML pages found in {args.corpus}")
+    total_bytes = sum(len(page) for page in pages)
+    print(f"{len(pages)} pages, {total_bytes / 1024 / 1024:.1f} MiB, {args.rounds} rounds\n")
+
+    parsers = {name: cls() for name, cls in PARSERS.items()}
+    mismatches = sum(
+        1 for page in pages
+        if len({repr(p.parse(page)) for p in parsers.values()}) > 1
+    )
+
+    print(f"{'backend':<12}{'pages/s':>10}{'peak MiB':>10}")
+    for name, meta_parser in parsers.items():
+        pages_per_second, peak = run(meta_parser, pages, args.rounds)
+        print(f"{name:<12}{pages_per_second:>10.1f}{peak / 1024 / 1024:>10.2f}")
+    print(f"\nPages where the backends disagree: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+
+import http_client
+import llm_limiter
+from lanes import LANE_BULK, LANE_INTERACTIVE, LaneLimiter, current_lane
+from llm import LLMProvider, LLMService
+from llm_limiter import LLMRateLimiter
+
+# Measures how long saving a favorite takes while imports keep the fetch and LLM
+# limits busy, with the lanes' reserved capacity against one shared lane. Usage:
+#   python benchmark_save_latency.py --saves 100
+#   python benchmark_save_latency.py --imports 4 --import-concurrency 64
+# A save, like an imported favorite, is one fetch and one LLM call. Imports run
+# in threads with their own event loops, the way the task queue runs them.
+
+PROMPT = "Summarize the page, suggest tags and choose the folder it belongs in. " * 20
+
+
+class SimulatedProvider(LLMProvider):
+    model = "simulated"
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate(self, prompt: str) -> str:
+        time.sleep(self.latency)
+        return "{}"
+
+    def generate_stream(self, prompt: str):
+        yield self.generate(prompt)
+
+    async def agenerate(self, prompt: str) -> str:
+        await asyncio.sleep(self.latency)
+        return "{}"
+
+
+async def save(fetch_limiter, llm, fetch_latency):
+    async with fetch_limiter.slot():
+        await asyncio.sleep(fetch_latency)
+    await llm.agenerate(PROMPT, use_cache=False)
+
+
+def run_import(lane, fetch_limiter, llm, args, stop, counts):
+    async def worker():
+        while not stop.is_set():
+            await save(fetch_limiter, llm, args.fetch_latency)
+            counts.append(1)
+
+    async def run():
+        current_lane.set(lane)
+        await asyncio.gather(*(worker() for _ in range(args.import_concurrency)))
+
+    asyncio.run(run())
+
+
+def run_saves(lane, fetch_limiter, llm, args):
+    async def timed():
+        started = time.perf_counter()
+        await save(fetch_limiter, llm, args.fetch_latency)
+        return time.perf_counter() - started
+
+    async def run():
+        current_lane.set(lane)
+        saves = []
+        for _ in range(args.saves):
+            saves.append(asyncio.create_task(timed()))
+            await asyncio.sleep(args.interval)
+        return await asyncio.gather(*saves)
+
+    return asyncio.run(run())
+
+
+def percentile(durations, fraction):
+    ordered = sorted(durations)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark save latency during imports, with and without lanes")
+    parser.add_argument("--saves", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.1, help="Seconds between saves")
+    parser.add_argument("--imports", type=int, default=2, help="Concurrent import tasks")
+    parser.add_argument("--import-concurrency", type=int, default=32, help="Favorites in flight per import")
+    parser.add_argument("--fetch-latency", type=float, default=0.2, help="Simulated seconds per fetch")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="Simulated seconds per LLM call")
+    parser.add_argument("--fetch-concurrency", type=int, default=http_client.MAX_CONCURRENCY)
+    parser.add_argument("--llm-concurrency", type=int, default=llm_limiter.MAX_CONCURRENCY)
+    args = parser.parse_args()
+
+    # Without lanes everything shares the bulk lane and nothing is reserved
+    modes = {
+        "shared": (LANE_BULK, {}, {}),
+        "lanes": (LANE_INTERACTIVE, http_client.RESERVED_SLOTS, llm_limiter.RESERVED_SLOTS),
+    }
+
+    print(f"{args.saves} saves during {args.imports} imports of {args.import_concurrency} favorites in flight, "
+          f"fetch limit {args.fetch_concurrency}, LLM limit {args.llm_concurrency}\n")
+    print(f"{'mode':<8}{'p50 s':>8}{'p99 s':>8}{'mean s':>8}{'imported/s':>12}")
+    for mode, (save_lane, fetch_reserved, llm_reserved) in modes.items():
+        fetch_limiter = LaneLimiter("fetch", args.fetch_concurrency, fetch_reserved)
+        # Rate budgets off and a fixed concurrency, so only the slots are contended
+        limiter = LLMRateLimiter(requests_per_minute=0, tokens_per_minute=0,
+                                 initial_concurrency=args.llm_concurrency,
+                                 max_concurrency=args.llm_concurrency, reserved=llm_reserved)
+        llm = LLMService(SimulatedProvider(args.llm_latency), limiter=limiter)
+
+        stop = threading.Event()
+        counts = []
+        imports = [
+            threading.Thread(target=run_import, args=(LANE_BULK, fetch_limiter, llm, args, stop, counts))
+            for _ in range(args.imports)
+        ]
+        for thread in imports:
+            thread.start()
+        # Let the imports fill the limits before the first save
+        time.sleep(args.fetch_latency + args.llm_latency)
+        started = time.perf_counter()
+        imported = len(counts)
+        try:
+            durations = run_saves(save_lane, fetch_limiter, llm, args)
+        finally:
+            stop.set()
+        elapsed = time.perf_counter() - started
+        imported = len(counts) - imported
+        for thread in imports:
+            thread.join()
+
+        print(f"{mode:<8}{percentile(durations, 0.5):>8.2f}{percentile(durations, 0.99):>8.2f}"
+              f"{statistics.mean(durations):>8.2f}{imported / elapsed:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
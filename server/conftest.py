@@ -0,0 +1,61 @@
+import uuid
+
+import chromadb
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import database
+from folder_tree import folder_tree_cache
+from tag_resolver import tag_resolver
+from vector_store import vector_store
+
+
+@pytest.fixture
+def isolated_db(tmp_path):
+    """Point the app's SessionLocal at an empty database of its own.
+
+    Rebinding the session factory keeps the listeners registered on it and
+    reaches every module that imported it. The caches filled from the other
+    database are dropped on the way in and out.
+    """
+    engine = create_engine(f"sqlite:///{tmp_path}/favorites.db", connect_args={"check_same_thread": False})
+    database.Base.metadata.create_all(bind=engine)
+    database.SessionLocal.configure(bind=engine)
+    tag_resolver.invalidate()
+    folder_tree_cache.invalidate()
+    try:
+        yield engine
+    finally:
+        database.SessionLocal.configure(bind=database.engine)
+        tag_resolver.invalidate()
+        folder_tree_cache.invalidate()
+        engine.dispose()
+
+
+class FakeEmbedding:
+    """Embeds a text by its length, so no model has to be downloaded."""
+
+    def __call__(self, input):
+        return [[float(len(text)), 1.0] for text in input]
+
+
+@pytest.fixture
+def isolated_vector_store(tmp_path, monkeypatch):
+    """Point the vector store at an in-memory collection and a full-text index of its own."""
+    client = chromadb.EphemeralClient()
+    name = f"test_favorites_{uuid.uuid4().hex}"
+    embedding_function = FakeEmbedding()
+    collection = client.create_collection(name, embedding_function=embedding_function)
+    engine = create_engine(f"sqlite:///{tmp_path}/chroma.sqlite3")
+    monkeypatch.setattr(vector_store, "collection", collection)
+    monkeypatch.setattr(vector_store, "embedding_function", embedding_function)
+    monkeypatch.setattr(vector_store, "engine", engine)
+    monkeypatch.setattr(vector_store, "Session", sessionmaker(bind=engine))
+    vector_store._create_fts_index()
+    try:
+        yield vector_store
+    finally:
+        # Ephemeral clients share one in-memory system per process
+        client.delete_collection(name)
+        engine.dispose()
@@ -1,28 +1,85 @@
-from urllib.parse import urlparse
-from bs4 import BeautifulSoup
+from urllib.parse import urlparse, unquote
+import asyncio
+import os
+from meta_parsers import get_meta_parser
+from fetch_cache import CachedPage
+
+# Only read pages up to the end of <head>, that is where the title and meta tags live
+HEAD_ONLY = os.environ.get('FETCH_HEAD_ONLY', 'true').lower() in ('1', 'true', 'yes')
+# Never read more than this many bytes of a page
+MAX_BYTES = int(os.environ.get('FETCH_MAX_BYTES', str(512 * 1024)))
+# 'streaming' (event based, falls back to bs4 on errors) or 'bs4'
+META_PARSER = os.environ.get('META_PARSER', 'streaming')
 
 class ContentExtractor:
-    def __init__(self, fetch_function):
+    def __init__(self, fetch_function, head_only=None, max_bytes=None, meta_parser=None, cache=None):
         self.fetch = fetch_function
+        self.cache = cache
+        self.meta_parser = get_meta_parser(meta_parser or META_PARSER)
+        self.head_only = HEAD_ONLY if head_only is None else head_only
+        self.max_bytes = MAX_BYTES if max_bytes is None else max_bytes
 
     async def extract_content(self, url):
+        page = await self.fetch_page(url)
+        return self.extract_from_page(url, page)
+
+    async def extract(self, url):
+        page = await self.fetch_page(url)
+        return self.extract_page(url, page)
+
+    async def fetch_page(self, url):
+        # YouTube channels are described from the URL alone, nothing to fetch
+        if self.is_youtube_channel(urlparse(url)):
+            return None
+
+        cached = await asyncio.to_thread(self.cache.lookup, url) if self.cache else None
+        if cached and cached.is_fresh:
+            self.cache.record("hit")
+            return cached
+
+        response = await self.fetch(
+            url, head_only=self.head_only, max_bytes=self.max_bytes,
+            extra_headers=cached.conditional_headers() if cached else None
+        )
+        if cached and response.status_code == 304:
+            await asyncio.to_thread(self.cache.refresh, cached)
+            self.cache.record("revalidated")
+            return cached
+        if self.cache:
+            self.cache.record("miss")
+        return response
+
+    def extract_from_page(self, url, response):
+        return self.extract_page(url, response)[1]
+
+    def extract_page(self, url, response):
+        """Meta information and (meta_text, content) of a fetched page.
+
+        The meta information is None for YouTube channels, which are described from the URL.
+        """
         parsed_url = urlparse(url)
         
         # Special handling for YouTube channels
-        if self.is_youtube_channel(parsed_url):
-            return self.extract_youtube_channel_info(parsed_url)
-        
+        if response is None:
+            return None, self.extract_youtube_channel_info(parsed_url)
+
+        if isinstance(response, CachedPage):
+            meta_info = response.meta_info
+        # PDFs, images and other binaries have no markup worth parsing
+        elif not response.is_html:
+            meta_info = self.describe_non_html(parsed_url, response.content_type)
         # For all other URLs, including YouTube videos and playlists
-        response = await self.fetch(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        meta_info = self.extract_meta_information(soup)
+        else:
+            meta_info = self.extract_meta_information(response.text)
+
+        if self.cache and not isinstance(response, CachedPage):
+            self.cache.put(url, meta_info, response)
         
         if 'youtube.com' in parsed_url.netloc or 'youtu.be' in parsed_url.netloc:
             url_type = self.classify_youtube_url(parsed_url)
-            return self.format_youtube_content(url_type, meta_info)
+            return meta_info, self.format_youtube_content(url_type, meta_info)
         else:
-            return self.format_generic_content(meta_info)
+            return meta_info, self.format_generic_content(meta_info)
 
     def is_youtube_channel(self, parsed_url):
         return ('youtube.com' in parsed_url.netloc and 
@@ -49,29 +106,15 @@ class ContentExtractor:
         else:
             return 'unknown'
 
-    def extract_meta_information(self, soup):
-        meta_info = {}
-
-        # Extracting title
-        if soup.title:
-            meta_info['title'] = soup.title.string
-
-        # Extracting meta tags
-        for meta in soup.find_all('meta'):
-            if 'name' in meta.attrs:
-                name = meta.attrs['name'].lower()
-                if name in ['description', 'keywords']:
-                    meta_info[name] = meta.attrs['content']
-            elif 'property' in meta.attrs:
-                property_name = meta.attrs['property'].lower()
-                if property_name in ['og:title', 'og:description', 'og:image', 'og:url', 'og:type']:
-                    meta_info[property_name] = meta.attrs['content']
-
-        # Extracting tags (keywords)
-        if 'keywords' in meta_info:
-            meta_info['tags'] = [tag.strip() for tag in meta_info['keywords'].split(',')]
-
-        return meta_info
+    def describe_non_html(self, parsed_url, content_type):
+        file_name = unquote(parsed_url.path.rstrip('/').split('/')[-1]) or parsed_url.netloc
+        return {
+            'title': file_name,
+            'og:type': content_type.split(';')[0].strip(),
+        }
+
+    def extract_meta_information(self, html):
+        return self.meta_parser.parse(html)
 
     def format_youtube_content(self, url_type, meta_info):
         meta_text = f"Type: YouTube {url_type.capitalize()}\n"
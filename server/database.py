@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -28,6 +28,21 @@ def get_db():
     finally:
         db.close()
 
+
+# Add columns that were introduced after a table was first created
+def add_missing_columns(table_name, columns):
+    """columns maps column names to their SQL definition, e.g. {"flag": "BOOLEAN NOT NULL DEFAULT 0"}."""
+    inspector = inspect(engine)
+    if not inspector.has_table(table_name):
+        return
+    existing = {col['name'] for col in inspector.get_columns(table_name)}
+    with engine.connect() as conn:
+        for name, definition in columns.items():
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {definition}"))
+        conn.commit()
+
+
 # Function to initialize the database
 def init_db():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
@@ -0,0 +1,122 @@
+# disk_cache.py
+import json
+import logging
+import threading
+import time
+import zlib
+from typing import Optional, Tuple
+
+from sqlalchemy import create_engine, text
+
+logger = logging.getLogger(__name__)
+
+EVICTION_BATCH = 100
+
+
+class DiskCache:
+    """Key/value store in a SQLite file, bounded by size with LRU eviction.
+
+    Values are JSON-serialisable dicts stored zlib-compressed. Freshness is left
+    to the caller, get returns when the entry was stored.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        self._lock = threading.Lock()
+        with self.engine.connect() as conn:
+            conn.execute(text("PRAGMA journal_mode=WAL"))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_cache_entries_accessed_at ON cache_entries (accessed_at)"))
+            conn.commit()
+            self._total_bytes = conn.execute(text("SELECT COALESCE(SUM(size), 0) FROM cache_entries")).scalar()
+
+    def get(self, key: str) -> Optional[Tuple[dict, float]]:
+        """Return (value, stored_at) for key, or None."""
+        with self._lock, self.engine.connect() as conn:
+            row = conn.execute(
+                text("SELECT value, stored_at FROM cache_entries WHERE key = :key"), {"key": key}
+            ).first()
+            if row is None:
+                return None
+            conn.execute(
+                text("UPDATE cache_entries SET accessed_at = :now WHERE key = :key"),
+                {"key": key, "now": time.time()},
+            )
+            conn.commit()
+        try:
+            return json.loads(zlib.decompress(row.value)), row.stored_at
+        except (zlib.error, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache entry {key}: {str(e)}")
+            self.delete(key)
+            return None
+
+    def put(self, key: str, value: dict):
+        blob = zlib.compress(json.dumps(value).encode("utf-8"))
+        now = time.time()
+        with self._lock, self.engine.connect() as conn:
+            previous = conn.execute(
+                text("SELECT size FROM cache_entries WHERE key = :key"), {"key": key}
+            ).scalar()
+            conn.execute(text("""
+                INSERT OR REPLACE INTO cache_entries (key, value, size, stored_at, accessed_at)
+                VALUES (:key, :value, :size, :now, :now)
+            """), {"key": key, "value": blob, "size": len(blob), "now": now})
+            self._total_bytes += len(blob) - (previous or 0)
+            self._evict(conn)
+            conn.commit()
+
+    def touch(self, key: str):
+        """Mark an entry as freshly stored without rewriting it."""
+        now = time.time()
+        with self._lock, self.engine.connect() as conn:
+            conn.execute(
+                text("UPDATE cache_entries SET stored_at = :now, accessed_at = :now WHERE key = :key"),
+                {"key": key, "now": now},
+            )
+            conn.commit()
+
+    def delete(self, key: str):
+        with self._lock, self.engine.connect() as conn:
+            size = conn.execute(text("SELECT size FROM cache_entries WHERE key = :key"), {"key": key}).scalar()
+            if size is not None:
+                conn.execute(text("DELETE FROM cache_entries WHERE key = :key"), {"key": key})
+                conn.commit()
+                self._total_bytes -= size
+
+    def clear(self):
+        with self._lock, self.engine.connect() as conn:
+            conn.execute(text("DELETE FROM cache_entries"))
+            conn.commit()
+            self._total_bytes = 0
+
+    def _evict(self, conn):
+        while self._total_bytes > self.max_bytes:
+            rows = conn.execute(
+                text("SELECT key, size FROM cache_entries ORDER BY accessed_at LIMIT :limit"),
+                {"limit": EVICTION_BATCH},
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                return
+            evicted = []
+            for row in rows:
+                evicted.append({"key": row.key})
+                self._total_bytes -= row.size
+                if self._total_bytes <= self.max_bytes:
+                    break
+            conn.execute(text("DELETE FROM cache_entries WHERE key = :key"), evicted)
+
+    def stats(self):
+        with self.engine.connect() as conn:
+            entries = conn.execute(text("SELECT COUNT(*) FROM cache_entries")).scalar()
+        return {"entries": entries, "bytes": self._total_bytes, "max_bytes": self.max_bytes}
@@ -0,0 +1,142 @@
+# domain_affinity.py
+import logging
+import os
+import threading
+from typing import List, Optional
+from urllib.parse import urlsplit
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('DOMAIN_AFFINITY_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Share of a site's favorites one folder needs before new ones go there without asking the LLM
+MIN_SHARE = float(os.environ.get('DOMAIN_AFFINITY_MIN_SHARE', '0.8'))
+# Sites with fewer favorites than this are left to the LLM
+MIN_COUNT = int(os.environ.get('DOMAIN_AFFINITY_MIN_COUNT', '3'))
+
+
+def affinity_key(url: str, level: int) -> Optional[str]:
+    """Host (level 0) or host plus first path directory (level 1) of url.
+
+    The path key is only formed when the first segment is a directory, as in
+    github.com/org/repo, not for a page directly below the host.
+    """
+    try:
+        parts = urlsplit(url or "")
+    except ValueError:
+        return None
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if not host:
+        return None
+    if level == 0:
+        return host
+    segments = [segment for segment in parts.path.split("/") if segment]
+    if len(segments) < 2:
+        return None
+    return f"{host}/{segments[0].lower()}"
+
+
+def affinity_keys(url: str) -> List[str]:
+    """Keys of url, most specific first."""
+    return [key for key in (affinity_key(url, 1), affinity_key(url, 0)) if key]
+
+
+class DomainAffinity:
+    """Folder counts per site, to file a favorite where its site's favorites went.
+
+    The counts are built from the favorites table with one aggregate query and
+    kept up to date by record as favorites are created, moved and deleted.
+    """
+
+    def __init__(self, min_share: float = MIN_SHARE, min_count: int = MIN_COUNT):
+        self.min_share = min_share
+        self.min_count = min_count
+        self._counts = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def rebuild(self, engine):
+        with engine.connect() as conn:
+            conn.connection.driver_connection.create_function("affinity_key", 2, affinity_key, deterministic=True)
+            rows = conn.execute(text("""
+                SELECT key, folder_id, COUNT(*) AS favorites FROM (
+                    SELECT affinity_key(url, 0) AS key, folder_id FROM favorites WHERE folder_id IS NOT NULL
+                    UNION ALL
+                    SELECT affinity_key(url, 1) AS key, folder_id FROM favorites WHERE folder_id IS NOT NULL
+                )
+                WHERE key IS NOT NULL
+                GROUP BY key, folder_id
+            """)).all()
+        counts = {}
+        for key, folder_id, favorites in rows:
+            counts.setdefault(key, {})[folder_id] = favorites
+        with self._lock:
+            self._counts = counts
+        logger.info(f"Built domain affinity map for {len(counts)} sites and path prefixes")
+
+    def record(self, url: str, old_folder_id: Optional[int], new_folder_id: Optional[int], new_url: str = None):
+        """Account for a favorite of url moving from old_folder_id to new_folder_id, either may be None.
+
+        new_url is the favorite's url after the change when that changed as well.
+        """
+        new_url = new_url or url
+        if old_folder_id == new_folder_id and new_url == url:
+            return
+        with self._lock:
+            if old_folder_id is not None:
+                for key in affinity_keys(url):
+                    self._add(key, old_folder_id, -1)
+            if new_folder_id is not None:
+                for key in affinity_keys(new_url):
+                    self._add(key, new_folder_id, 1)
+
+    def _add(self, key: str, folder_id: int, delta: int):
+        folders = self._counts.setdefault(key, {})
+        count = folders.get(folder_id, 0) + delta
+        if count > 0:
+            folders[folder_id] = count
+        else:
+            folders.pop(folder_id, None)
+        if not folders:
+            del self._counts[key]
+
+    def lookup(self, url: str) -> Optional[int]:
+        """Folder of url's site when it is clear enough, decided by the most specific key with enough favorites."""
+        folder_id = None
+        with self._lock:
+            for key in affinity_keys(url):
+                folders = self._counts.get(key)
+                total = sum(folders.values()) if folders else 0
+                if total < self.min_count:
+                    continue
+                best, count = max(folders.items(), key=lambda item: item[1])
+                if count / total >= self.min_share:
+                    folder_id = best
+                break
+            if folder_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return folder_id
+
+    def clear(self):
+        with self._lock:
+            self._counts = {}
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "keys": len(self._counts),
+            "min_share": self.min_share,
+            "min_count": self.min_count,
+        }
+
+
+domain_affinity = DomainAffinity() if ENABLED else None
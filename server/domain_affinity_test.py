@@ -0,0 +1,52 @@
+import models
+from database import SessionLocal
+from domain_affinity import DomainAffinity, affinity_key, affinity_keys
+
+
+def test_affinity_keys():
+    assert affinity_keys("https://www.GitHub.com/Org/repo") == ["github.com/org", "github.com"]
+    # A page right below the host has no path key
+    assert affinity_keys("https://example.com/page") == ["example.com"]
+    assert affinity_key("not a url", 0) is None
+
+
+def test_lookup_needs_enough_favorites_and_a_clear_majority():
+    affinity = DomainAffinity(min_share=0.75, min_count=3)
+    for folder_id in (1, 1, 1, 2):
+        affinity.record("https://news.example.com/story", None, folder_id)
+    assert affinity.lookup("https://news.example.com/other") == 1
+
+    affinity.record("https://blog.example.com/post", None, 3)
+    affinity.record("https://blog.example.com/post", None, 3)
+    # Two favorites are too few to go by
+    assert affinity.lookup("https://blog.example.com/new") is None
+
+    # Moving one to folder 2 leaves folder 1 with half the site
+    affinity.record("https://news.example.com/story", 1, 2)
+    assert affinity.lookup("https://news.example.com/other") is None
+    assert affinity.stats()["hits"] == 1
+
+
+def test_most_specific_key_decides():
+    affinity = DomainAffinity(min_share=0.8, min_count=2)
+    for repo in ("a", "b", "c"):
+        affinity.record(f"https://github.com/python/{repo}", None, 1)
+        affinity.record(f"https://github.com/rust-lang/{repo}", None, 2)
+    assert affinity.lookup("https://github.com/python/d") == 1
+    assert affinity.lookup("https://github.com/rust-lang/d") == 2
+    # The host alone is split between the folders
+    assert affinity.lookup("https://github.com/golang/go") is None
+
+
+def test_rebuild_counts_existing_favorites(isolated_db):
+    with SessionLocal() as session:
+        session.add_all([
+            models.Folder(id=1, name="Python"),
+            *(models.Favorite(url=f"https://docs.python.org/3/{page}", folder_id=1) for page in ("a", "b", "c")),
+            models.Favorite(url="https://docs.python.org/3/unfiled"),
+        ])
+        session.commit()
+    affinity = DomainAffinity(min_share=0.8, min_count=3)
+    affinity.rebuild(isolated_db)
+    assert affinity.lookup("https://docs.python.org/3/d") == 1
+    assert affinity.stats()["keys"] == 2
@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import random
+
+from sqlalchemy.orm import joinedload
+
+import models
+from database import SessionLocal
+from tag_suggester import TagSuggester
+
+# Measures how often the nearest neighbour tag suggester answers without the
+# LLM and how well its tags agree with the LLM's, on favorites held out one at
+# a time (each favorite is left out of its own neighbours). Usage:
+#   python evaluate_tag_suggester.py --sample 300 --min-share 0.25 0.35 0.5
+# The reference tags are the ones stored with the favorites, which the LLM
+# suggested at import. --live asks the LLM again instead.
+
+
+def normalize(tags):
+    return {tag.strip().lower() for tag in tags if tag.strip()}
+
+
+def agreement(suggested, reference):
+    suggested, reference = normalize(suggested), normalize(reference)
+    common = len(suggested & reference)
+    union = len(suggested | reference)
+    return {
+        "precision": common / len(suggested) if suggested else 0.0,
+        "recall": common / len(reference) if reference else 0.0,
+        "jaccard": common / union if union else 1.0,
+        "exact": suggested == reference,
+    }
+
+
+def load_sample(size, seed):
+    with SessionLocal() as db:
+        favorites = (
+            db.query(models.Favorite)
+            .options(joinedload(models.Favorite.tags))
+            .filter(models.Favorite.tags.any())
+            .all()
+        )
+        sample = random.Random(seed).sample(favorites, min(size, len(favorites)))
+        return [(f.id, f.summary or "", [tag.name for tag in f.tags]) for f in sample]
+
+
+async def llm_reference(sample):
+    from services import nlp_service
+
+    return {
+        favorite_id: await nlp_service.suggest_tags_with_llm(summary, "")
+        for favorite_id, summary, _ in sample
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate kNN tag suggestions against the LLM")
+    parser.add_argument("--sample", type=int, default=200, help="Number of held-out favorites")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--neighbours", type=int, default=None)
+    parser.add_argument("--min-share", type=float, nargs="+", default=[None],
+                        help="Vote thresholds to compare, defaults to TAG_KNN_MIN_SHARE")
+    parser.add_argument("--live", action="store_true", help="Compare with fresh LLM suggestions")
+    args = parser.parse_args()
+
+    sample = load_sample(args.sample, args.seed)
+    if not sample:
+        raise SystemExit("No tagged favorites to evaluate")
+    if args.live:
+        references = asyncio.run(llm_reference(sample))
+    else:
+        references = {favorite_id: tags for favorite_id, _, tags in sample}
+    print(f"{len(sample)} held-out favorites, reference: {'live LLM' if args.live else 'stored tags'}\n")
+
+    print(f"{'min share':>10}{'LLM skipped':>13}{'precision':>11}{'recall':>8}{'jaccard':>9}{'exact':>7}")
+    for min_share in args.min_share:
+        suggester = TagSuggester()
+        if args.neighbours:
+            suggester.neighbours = args.neighbours
+        if min_share is not None:
+            suggester.min_share = min_share
+
+        scores = []
+        for favorite_id, summary, _ in sample:
+            tags = suggester.suggest(summary, exclude_id=favorite_id)
+            if tags is not None:
+                scores.append(agreement(tags, references[favorite_id]))
+
+        skipped = len(scores) / len(sample)
+        means = {
+            key: sum(score[key] for score in scores) / len(scores) if scores else 0.0
+            for key in ("precision", "recall", "jaccard", "exact")
+        }
+        print(f"{suggester.min_share:>10.2f}{skipped:>13.1%}{means['precision']:>11.2f}"
+              f"{means['recall']:>8.2f}{means['jaccard']:>9.2f}{means['exact']:>7.1%}")
+    print("\nAgreement is measured on the favorites the suggester answered for.")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,15 +4,17 @@ from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from fastapi.responses import HTMLResponse
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from typing import List, Dict
+from typing import List, Dict, Optional, Union
 from pydantic import ValidationError
 from rich import print as rprint
 from database import get_db
 import schemas
 from services import favorite_service, folder_service, nlp_service
 from task_queue import task_queue
-from models import Task, FavoriteToProcess
+from import_checkpoints import import_checkpoints
+from models import Task
 from vector_store import vector_store
+from ndjson_reader import NDJSONError
 from fastapi.templating import Jinja2Templates
 from rich import print as rprint
 import builtins
@@ -24,12 +26,26 @@ router = APIRouter()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
     
-@router.post("/", response_model=Dict[str, str])
-async def create_favorite(favorite: schemas.FavoriteCreate):
+@router.post("/", response_model=Union[schemas.Favorite, Dict[str, str]])
+def create_favorite(favorite: schemas.FavoriteCreate, db: Session = Depends(get_db)):
     try:
+        # Nothing to ask the LLM, the favorite is saved right away and returned
+        if favorite_service.is_fully_specified(favorite):
+            return favorite_service.save_favorites(db, [favorite])[0]
         task_name = f"Create Favorite: {favorite.title}"
-        result = favorite_service.create_favorite(favorite, task_name)
-        return {"task_id": result["task_id"]}
+        # With lazy enrichment the result also has the id of the favorite, written already
+        return favorite_service.create_favorite(favorite, task_name)
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/bulk", response_model=List[schemas.Favorite])
+def create_favorites(favorites: List[schemas.FavoriteCreate], db: Session = Depends(get_db)):
+    """Save favorites that all come with summary, tags and folder_id in one transaction."""
+    try:
+        return favorite_service.create_favorites(db, favorites)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -45,13 +61,13 @@ async def get_task_status(task_id: str):
 async def get_tasks(db: Session = Depends(get_db)):
     tasks = task_queue.get_all_tasks()
     
-    # Check if there are any running tasks or existing restartable tasks
-    running_tasks = [task for task in tasks if task["status"] == "processing"]
+    # Check if there are any queued or running tasks or existing restartable tasks
+    running_tasks = [task for task in tasks if task["status"] in ("pending", "processing")]
     restartable_tasks = [task for task in tasks if task["status"] == "restartable"]
     
     if not running_tasks and not restartable_tasks:
         # Check for unprocessed tasks in favorites_to_process
-        unprocessed_count = db.query(FavoriteToProcess).filter(FavoriteToProcess.processed == False).count()
+        unprocessed_count = import_checkpoints.count_pending(db)
         
         if unprocessed_count > 0:
             # Create a new restartable task
@@ -93,8 +109,13 @@ def read_favorite(favorite_id: int, db: Session = Depends(get_db)):
     return db_favorite
 
 @router.get("/", response_model=List[schemas.Favorite])
-def read_favorites(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return favorite_service.get_favorites(db, skip=skip, limit=limit)
+def read_favorites(
+    skip: int = 0,
+    limit: int = 100,
+    enrichment_state: Optional[str] = Query(None, description="Only favorites in this state: pending, enriched or failed"),
+    db: Session = Depends(get_db)
+):
+    return favorite_service.get_favorites(db, skip=skip, limit=limit, enrichment_state=enrichment_state)
 
 @router.put("/{favorite_id}", response_model=schemas.Favorite)
 def update_favorite(favorite_id: int, favorite: schemas.FavoriteUpdate, db: Session = Depends(get_db)):
@@ -128,16 +149,46 @@ async def delete_all_favorites():
         logger.error(f"Unexpected error: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/refine", response_model=Dict[str, str])
+async def refine_favorites():
+    try:
+        task_name = "Refine Favorites"
+        result = favorite_service.refine_favorites(task_name)
+        return {"task_id": result["task_id"]}
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/import", response_model=Dict[str, str])
 async def import_favorites(favorites: List[schemas.FavoriteImport]):
     try:
         task_name = f"Import Favorites: {len(favorites)} items"
-        result = favorite_service.import_favorites(favorites, task_name)
+        result = await favorite_service.import_favorites(favorites, task_name)
         return {"task_id": result["task_id"]}
     except Exception as e:
         logger.error(f"Unexpected error during import: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
     
+@router.post("/import/stream", response_model=schemas.StreamImportResult)
+async def import_favorites_stream(request: Request):
+    """Import favorites from an NDJSON body, one FavoriteImport object per line.
+
+    The body may be gzip-compressed, with Content-Encoding: gzip or detected from
+    its first bytes. Favorites are staged as they arrive, the task id is returned
+    once the whole body has been read.
+    """
+    try:
+        gzipped = True if request.headers.get("content-encoding", "").lower() == "gzip" else None
+        result = await favorite_service.import_favorites_stream(request.stream(), gzipped=gzipped)
+    except NDJSONError as e:
+        raise HTTPException(status_code=400, detail=f"{str(e)}. Favorites read before the error can be resumed with restart-import")
+    except Exception as e:
+        logger.error(f"Unexpected error during streaming import: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    if not result["accepted"]:
+        raise HTTPException(status_code=400, detail={"message": "No valid favorites in the stream", **result})
+    return result
+
 @router.get("/search/vector", response_model=List[schemas.Favorite])
 async def vector_search_favorites(
     query: str = Query(..., description="The search query"),
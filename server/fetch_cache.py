@@ -0,0 +1,94 @@
+# fetch_cache.py
+import logging
+import os
+import threading
+import time
+
+from disk_cache import DiskCache
+from url_utils import canonical_url
+
+logger = logging.getLogger(__name__)
+
+sqlite_dir = os.environ.get('SQLITE_DIR', '.')
+
+ENABLED = os.environ.get('FETCH_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CACHE_PATH = os.environ.get('FETCH_CACHE_PATH', os.path.join(sqlite_dir, 'fetch_cache.db'))
+# Entries younger than this are used without asking the server, older ones are revalidated
+TTL = float(os.environ.get('FETCH_CACHE_TTL', str(7 * 24 * 3600)))
+MAX_BYTES = int(os.environ.get('FETCH_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+
+class CachedPage:
+    """Metadata extracted from an earlier fetch of a page."""
+
+    def __init__(self, key: str, meta_info: dict, etag: str, last_modified: str, stored_at: float):
+        self.key = key
+        self.meta_info = meta_info
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at
+
+    @property
+    def is_fresh(self) -> bool:
+        return time.time() - self.stored_at < TTL
+
+    def conditional_headers(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class FetchCache:
+    """Persistent cache of extracted page metadata plus the validators to revalidate it."""
+
+    def __init__(self, path: str = CACHE_PATH, max_bytes: int = MAX_BYTES):
+        self.store = DiskCache(path, max_bytes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def lookup(self, url: str):
+        key = canonical_url(url)
+        cached = self.store.get(key)
+        if cached is None:
+            return None
+        value, stored_at = cached
+        return CachedPage(key, value["meta_info"], value.get("etag"), value.get("last_modified"), stored_at)
+
+    def put(self, url: str, meta_info: dict, response):
+        self.store.put(canonical_url(url), {
+            "meta_info": meta_info,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        })
+
+    def refresh(self, page: CachedPage):
+        self.store.touch(page.key)
+        page.stored_at = time.time()
+
+    def record(self, outcome: str):
+        with self._lock:
+            if outcome == "hit":
+                self.hits += 1
+            elif outcome == "revalidated":
+                self.revalidated += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        lookups = self.hits + self.revalidated + self.misses
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.revalidated) / lookups, 3) if lookups else 0.0,
+            "ttl_seconds": TTL,
+            **self.store.stats(),
+        }
+
+
+fetch_cache = FetchCache() if ENABLED else None
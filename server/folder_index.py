@@ -0,0 +1,188 @@
+# folder_index.py
+import logging
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+import models
+from folder_tree import FolderTree, folder_tree_cache
+from vector_store import vector_store
+
+logger = logging.getLogger(__name__)
+
+# Number of most similar folders listed in folder prompts, 0 lists the whole tree
+SHORTLIST_SIZE = int(os.environ.get('FOLDER_SHORTLIST_SIZE', '8'))
+# A best match at least this similar is used without asking the LLM, above 1 never skips
+SKIP_LLM_SIMILARITY = float(os.environ.get('FOLDER_SKIP_LLM_SIMILARITY', '0.8'))
+# Folder vectors are rebuilt when the folder tree changes and at least this often
+# (in seconds) to pick up the favorites added to the folders since
+REFRESH_INTERVAL = float(os.environ.get('FOLDER_INDEX_REFRESH_INTERVAL', '300'))
+# Share of a folder vector that comes from the centroid of its favorites
+MEMBER_WEIGHT = 0.5
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class FolderShortlist:
+    """Folders ranked by similarity to a favorite, with the prompt text listing the best ones."""
+
+    def __init__(self, candidates: List[Tuple[int, float]], prompt_text: str, skip_similarity: float):
+        self.candidates = candidates
+        self.prompt_text = prompt_text
+        self.skip_similarity = skip_similarity
+
+    @property
+    def best(self) -> Tuple[Optional[int], float]:
+        return self.candidates[0] if self.candidates else (None, 0.0)
+
+    @property
+    def confident(self) -> bool:
+        return bool(self.candidates) and self.candidates[0][1] >= self.skip_similarity
+
+
+class FolderIndex:
+    """Embeddings of the folders to shortlist candidates for a favorite.
+
+    A folder's vector combines the embedding of its path and description with
+    the centroid of the vectors of the favorites already in it, taken from the
+    favorites collection of the vector store.
+    """
+
+    def __init__(self, store=vector_store, shortlist_size: int = SHORTLIST_SIZE,
+                 skip_similarity: float = SKIP_LLM_SIMILARITY):
+        self.store = store
+        self.shortlist_size = shortlist_size
+        self.skip_similarity = skip_similarity
+        self._lock = threading.Lock()
+        self._tree = None
+        self._built_at = 0.0
+        self._refreshing = False
+        self._ids = []
+        self._texts = {}
+        self._matrix = None
+        # (folder id, text) -> embedding, so unchanged folders are not embedded again
+        self._text_vectors = {}
+        # folder id -> centroid of its favorites' vectors, None for an empty folder
+        self._centroids = {}
+
+    @staticmethod
+    def folder_text(tree: FolderTree, folder_id: int) -> str:
+        names = [tree.folders[ancestor][0] for ancestor in tree.path(folder_id)[1:]]
+        description = tree.folders[folder_id][2]
+        text = " / ".join(names)
+        return f"{text}: {description}" if description else text
+
+    def _member_centroids(self, db: Session, folder_ids: List[int]) -> dict:
+        members = {folder_id: [] for folder_id in folder_ids}
+        for favorite_id, folder_id in (
+            db.query(models.Favorite.id, models.Favorite.folder_id)
+            .filter(models.Favorite.folder_id.in_(folder_ids))
+            .all()
+        ):
+            members[folder_id].append(favorite_id)
+        favorite_vectors = self.store.get_embeddings(
+            [favorite_id for favorite_ids in members.values() for favorite_id in favorite_ids]
+        )
+        centroids = {}
+        for folder_id, favorite_ids in members.items():
+            member_vectors = [favorite_vectors[f] for f in favorite_ids if f in favorite_vectors]
+            centroids[folder_id] = (
+                _normalize(np.mean(np.asarray(member_vectors, dtype=np.float32), axis=0)) if member_vectors else None
+            )
+        return centroids
+
+    def _update(self, db: Session, tree: FolderTree):
+        """Follow a change of the folder tree, only new and renamed folders are embedded
+        and only new folders have their favorites looked up."""
+        # The root is where new top level folders go, it is not a candidate itself
+        ids = sorted(folder_id for folder_id in tree.tree_ids if folder_id != tree.root_id)
+        texts = {folder_id: self.folder_text(tree, folder_id) for folder_id in ids}
+        missing = [(folder_id, text) for folder_id, text in texts.items() if (folder_id, text) not in self._text_vectors]
+        if missing:
+            vectors = self.store.embed([text for _, text in missing])
+            for key, vector in zip(missing, vectors):
+                self._text_vectors[key] = _normalize(np.asarray(vector, dtype=np.float32))
+        self._text_vectors = {key: self._text_vectors[key] for key in texts.items()}
+
+        new = [folder_id for folder_id in ids if folder_id not in self._centroids]
+        centroids = {folder_id: self._centroids[folder_id] for folder_id in ids if folder_id in self._centroids}
+        centroids.update(self._member_centroids(db, new))
+        if self._tree is None:
+            self._built_at = time.monotonic()
+        self._centroids = centroids
+        self._tree = tree
+        self._ids = ids
+        self._texts = texts
+        self._assemble()
+        logger.info(f"Updated folder index for {len(ids)} folders, {len(new)} of them new")
+
+    def _assemble(self):
+        rows = []
+        for folder_id in self._ids:
+            vector = self._text_vectors[(folder_id, self._texts[folder_id])]
+            centroid = self._centroids.get(folder_id)
+            if centroid is not None:
+                vector = _normalize((1 - MEMBER_WEIGHT) * vector + MEMBER_WEIGHT * centroid)
+            rows.append(vector)
+        self._matrix = np.vstack(rows) if rows else None
+
+    def _refresh(self, db: Session, ids: List[int]):
+        """Recompute the centroids of ids to take in the favorites filed since, outside the lock."""
+        try:
+            centroids = self._member_centroids(db, ids)
+        except Exception as e:
+            logger.warning(f"Error refreshing the folder index: {str(e)}")
+            centroids = None
+        with self._lock:
+            self._refreshing = False
+            if centroids is None:
+                return
+            # Folders removed while refreshing stay removed
+            self._centroids.update((f, c) for f, c in centroids.items() if f in self._centroids)
+            self._built_at = time.monotonic()
+            self._assemble()
+        logger.info(f"Refreshed folder index for {len(ids)} folders")
+
+    def shortlist(self, db: Session, text: str) -> Optional[FolderShortlist]:
+        """Rank the folders for text, or None when the folders cannot be embedded.
+
+        Changes of the folder tree are applied right away, the periodic refresh
+        of the favorites in the folders runs in one caller while the others
+        keep using the current vectors.
+        """
+        tree = folder_tree_cache.get(db)
+        try:
+            with self._lock:
+                if tree is not self._tree:
+                    self._update(db, tree)
+                refresh = not self._refreshing and time.monotonic() - self._built_at > REFRESH_INTERVAL
+                if refresh:
+                    self._refreshing = True
+                ids, matrix = self._ids, self._matrix
+            if refresh:
+                self._refresh(db, ids)
+            if matrix is None:
+                return None
+            query = _normalize(np.asarray(self.store.embed([text])[0], dtype=np.float32))
+        except Exception as e:
+            logger.warning(f"Folder shortlist unavailable, listing all folders: {str(e)}")
+            return None
+
+        scores = matrix @ query
+        order = np.argsort(-scores)
+        candidates = [(ids[i], float(scores[i])) for i in order]
+        if self.shortlist_size <= 0 or len(ids) <= self.shortlist_size:
+            prompt_text = tree.prompt_text
+        else:
+            prompt_text = tree.render_subset(folder_id for folder_id, _ in candidates[:self.shortlist_size])
+        return FolderShortlist(candidates, prompt_text, self.skip_similarity)
+
+
+folder_index = FolderIndex()
@@ -0,0 +1,121 @@
+# folder_tree.py
+import logging
+import threading
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+import models
+
+logger = logging.getLogger(__name__)
+
+
+def format_folder_lines(structure, level=0, lines=None):
+    """Render a folder structure as the indented "- Name (ID: n)" list the prompts use."""
+    if lines is None:
+        lines = []
+    lines.append("  " * level + f"- {structure['name']} (ID: {structure['id']})")
+    for child in structure["children"]:
+        format_folder_lines(child, level + 1, lines)
+    return lines
+
+
+class FolderTree:
+    """Snapshot of the folder tree below the root folder, with its prompt rendering."""
+
+    def __init__(self, structure: Optional[dict], folders: dict):
+        self.structure = structure
+        # id -> (name, parent_id, description) of every folder, including ones outside the root's tree
+        self.folders = folders
+        self.prompt_text = "\n".join(format_folder_lines(structure)) + "\n" if structure else ""
+        self.tree_ids = set()
+        stack = [structure] if structure else []
+        while stack:
+            node = stack.pop()
+            self.tree_ids.add(node["id"])
+            stack.extend(node["children"])
+
+    @property
+    def root_id(self) -> Optional[int]:
+        return self.structure["id"] if self.structure else None
+
+    def exists(self, folder_id) -> bool:
+        return folder_id in self.folders
+
+    def path(self, folder_id) -> List[int]:
+        """Ids from the root down to folder_id."""
+        path = []
+        while folder_id is not None and folder_id in self.folders and folder_id not in path:
+            path.append(folder_id)
+            folder_id = self.folders[folder_id][1]
+        return path[::-1]
+
+    def render_subset(self, folder_ids) -> str:
+        """Prompt text listing only folder_ids and their ancestors, at their depth in the full tree."""
+        keep = set()
+        for folder_id in folder_ids:
+            keep.update(self.path(folder_id))
+
+        def prune(node):
+            return {**node, "children": [prune(child) for child in node["children"] if child["id"] in keep]}
+
+        if not self.structure:
+            return ""
+        return "\n".join(format_folder_lines(prune(self.structure))) + "\n"
+
+    @classmethod
+    def load(cls, db: Session) -> "FolderTree":
+        rows = (
+            db.query(models.Folder.id, models.Folder.name, models.Folder.parent_id, models.Folder.description)
+            .order_by(models.Folder.id)
+            .all()
+        )
+        nodes = {}
+        for row in rows:
+            nodes[row.id] = {"name": row.name, "id": row.id, "level": 0, "children": []}
+        root = None
+        for row in rows:
+            if row.parent_id is None:
+                root = root or nodes[row.id]
+            elif row.parent_id in nodes:
+                nodes[row.parent_id]["children"].append(nodes[row.id])
+
+        if root is not None:
+            stack = [(root, 0)]
+            while stack:
+                node, level = stack.pop()
+                node["level"] = level
+                stack.extend((child, level + 1) for child in node["children"])
+        return cls(root, {row.id: (row.name, row.parent_id, row.description) for row in rows})
+
+
+class FolderTreeCache:
+    """Keeps the folder tree in memory until a folder is created, changed or deleted.
+
+    Everything that mutates folders calls invalidate after committing. A tree
+    loaded while an invalidation happened is returned but not kept.
+    """
+
+    def __init__(self):
+        self._tree = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, db: Session) -> FolderTree:
+        with self._lock:
+            tree, generation = self._tree, self._generation
+        if tree is not None:
+            return tree
+        tree = FolderTree.load(db)
+        with self._lock:
+            if generation == self._generation:
+                self._tree = tree
+        return tree
+
+    def invalidate(self):
+        with self._lock:
+            self._tree = None
+            self._generation += 1
+
+
+folder_tree_cache = FolderTreeCache()
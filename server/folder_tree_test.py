@@ -0,0 +1,73 @@
+import models
+from database import SessionLocal
+from folder_tree import FolderTree, FolderTreeCache
+
+
+def add_folders(session):
+    root = models.Folder(name="Root")
+    session.add(root)
+    session.flush()
+    code = models.Folder(name="Code", parent_id=root.id, description="Programming")
+    news = models.Folder(name="News", parent_id=root.id)
+    session.add_all([code, news])
+    session.flush()
+    python = models.Folder(name="Python", parent_id=code.id)
+    session.add(python)
+    session.commit()
+    return root.id, code.id, news.id, python.id
+
+
+def test_folder_tree_renders_prompt_and_subsets(isolated_db):
+    with SessionLocal() as session:
+        root, code, news, python = add_folders(session)
+        tree = FolderTree.load(session)
+
+    assert tree.root_id == root
+    assert tree.tree_ids == {root, code, news, python}
+    assert tree.path(python) == [root, code, python]
+    assert tree.prompt_text == (
+        f"- Root (ID: {root})\n"
+        f"  - Code (ID: {code})\n"
+        f"    - Python (ID: {python})\n"
+        f"  - News (ID: {news})\n"
+    )
+    assert tree.render_subset([python]) == (
+        f"- Root (ID: {root})\n"
+        f"  - Code (ID: {code})\n"
+        f"    - Python (ID: {python})\n"
+    )
+
+
+def test_folder_tree_cache_reloads_after_invalidate(isolated_db):
+    cache = FolderTreeCache()
+    with SessionLocal() as session:
+        root, _, _, _ = add_folders(session)
+        tree = cache.get(session)
+        assert cache.get(session) is tree
+
+        session.add(models.Folder(name="Rust", parent_id=root))
+        session.commit()
+        # Still the cached tree until a change is announced
+        assert cache.get(session) is tree
+        cache.invalidate()
+        reloaded = cache.get(session)
+        assert reloaded is not tree
+        assert "Rust" in reloaded.prompt_text
+        assert cache.get(session) is reloaded
+
+
+def test_tree_loaded_during_invalidate_is_not_kept(isolated_db, monkeypatch):
+    cache = FolderTreeCache()
+    load = FolderTree.load
+
+    def load_while_invalidated(session):
+        tree = load(session)
+        cache.invalidate()
+        return tree
+
+    with SessionLocal() as session:
+        add_folders(session)
+        monkeypatch.setattr(FolderTree, "load", staticmethod(load_while_invalidated))
+        first = cache.get(session)
+        monkeypatch.setattr(FolderTree, "load", staticmethod(load))
+        assert cache.get(session) is not first
@@ -0,0 +1,125 @@
+# host_scheduler.py
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of seconds between two request starts against the same host
+MIN_INTERVAL = float(os.environ.get('FETCH_HOST_MIN_INTERVAL', '1.0'))
+# Maximum number of requests in flight against the same host
+MAX_IN_FLIGHT = int(os.environ.get('FETCH_HOST_MAX_IN_FLIGHT', '2'))
+# Retry-After values above this are not waited for, the fetch fails instead
+MAX_RETRY_AFTER = float(os.environ.get('FETCH_MAX_RETRY_AFTER', '120'))
+
+# How often a waiter re-checks a host whose in-flight slots are all taken
+POLL_INTERVAL = 0.05
+# Idle host entries are dropped once the table grows past this size
+MAX_IDLE_HOSTS = 1024
+
+
+class _HostState:
+    def __init__(self):
+        self.in_flight = 0
+        self.next_start = 0.0
+        self.last_used = 0.0
+
+
+class HostScheduler:
+    """Per-host request spacing and concurrency limits.
+
+    Requests to the same host are started at least min_interval seconds apart
+    and at most max_in_flight of them run at once, while requests to different
+    hosts do not wait on each other. The state is guarded by a threading lock
+    rather than asyncio primitives because every task runs its own event loop.
+    """
+
+    def __init__(self, min_interval: float = None, max_in_flight: int = None):
+        self.min_interval = MIN_INTERVAL if min_interval is None else min_interval
+        self.max_in_flight = max_in_flight or MAX_IN_FLIGHT
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def host_for(url: str) -> str:
+        return (urlparse(url).hostname or "").lower()
+
+    def _state(self, host: str) -> _HostState:
+        state = self._hosts.get(host)
+        if state is None:
+            if len(self._hosts) >= MAX_IDLE_HOSTS:
+                self._prune()
+            state = self._hosts[host] = _HostState()
+        return state
+
+    def _prune(self):
+        now = time.monotonic()
+        idle = [
+            host for host, state in self._hosts.items()
+            if state.in_flight == 0 and state.next_start < now and now - state.last_used > 60
+        ]
+        for host in idle:
+            del self._hosts[host]
+
+    async def acquire(self, url: str):
+        host = self.host_for(url)
+        while True:
+            with self._lock:
+                state = self._state(host)
+                now = time.monotonic()
+                if state.in_flight < self.max_in_flight and now >= state.next_start:
+                    state.in_flight += 1
+                    state.next_start = now + self.min_interval
+                    state.last_used = now
+                    return
+                wait = state.next_start - now if now < state.next_start else POLL_INTERVAL
+            await asyncio.sleep(wait)
+
+    def release(self, url: str):
+        host = self.host_for(url)
+        with self._lock:
+            state = self._state(host)
+            state.in_flight = max(0, state.in_flight - 1)
+            state.last_used = time.monotonic()
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        await self.acquire(url)
+        try:
+            yield
+        finally:
+            self.release(url)
+
+    def defer(self, url: str, delay: float):
+        """Hold back every request to the host of url for at least delay seconds."""
+        host = self.host_for(url)
+        with self._lock:
+            state = self._state(host)
+            state.next_start = max(state.next_start, time.monotonic() + delay)
+        logger.info(f"Deferring requests to {host} for {delay:.1f}s")
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """Return the Retry-After header value in seconds, given as seconds or as an HTTP date."""
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+host_scheduler = HostScheduler()
@@ -0,0 +1,52 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+from host_scheduler import HostScheduler
+
+
+def test_requests_to_one_host_are_spaced_and_capped():
+    scheduler = HostScheduler(min_interval=0.1, max_in_flight=1)
+    starts = []
+
+    async def fetch(url):
+        async with scheduler.slot(url):
+            starts.append((url, time.monotonic()))
+            await asyncio.sleep(0.02)
+
+    async def run():
+        await asyncio.gather(
+            fetch("https://a.example.com/1"),
+            fetch("https://A.example.com/2"),
+            fetch("https://b.example.com/1"),
+        )
+
+    began = time.monotonic()
+    asyncio.run(run())
+    started = {url: at - began for url, at in starts}
+    # Other hosts do not wait, the second request to a host waits for the interval
+    assert started["https://b.example.com/1"] < 0.05
+    assert started["https://A.example.com/2"] - started["https://a.example.com/1"] >= 0.09
+
+
+def test_defer_holds_back_the_host():
+    scheduler = HostScheduler(min_interval=0, max_in_flight=2)
+    scheduler.defer("https://slow.example.com/a", 0.1)
+
+    async def run():
+        began = time.monotonic()
+        async with scheduler.slot("https://slow.example.com/b"):
+            return time.monotonic() - began
+
+    assert asyncio.run(run()) >= 0.09
+
+
+def test_parse_retry_after():
+    assert HostScheduler.parse_retry_after("120") == 120.0
+    assert HostScheduler.parse_retry_after(None) is None
+    assert HostScheduler.parse_retry_after("soon") is None
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < HostScheduler.parse_retry_after(format_datetime(retry_at, usegmt=True)) <= 30
+    past = datetime.now(timezone.utc) - timedelta(seconds=30)
+    assert HostScheduler.parse_retry_after(format_datetime(past, usegmt=True)) == 0.0
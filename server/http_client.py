@@ -0,0 +1,273 @@
+# http_client.py
+import asyncio
+import logging
+import os
+import re
+from typing import Optional
+
+import aiohttp
+
+from host_scheduler import HostScheduler
+from lanes import LaneLimiter, parse_reserved
+from loop_local import LoopLocal
+
+logger = logging.getLogger(__name__)
+
+# Connection pool, shared by all fetches running on the same event loop
+MAX_CONNECTIONS = int(os.environ.get('FETCH_MAX_CONNECTIONS', '100'))
+KEEPALIVE_EXPIRY = float(os.environ.get('FETCH_KEEPALIVE_EXPIRY', '30'))
+# Per-request timeouts in seconds
+TIMEOUT = float(os.environ.get('FETCH_TIMEOUT', '15'))
+CONNECT_TIMEOUT = float(os.environ.get('FETCH_CONNECT_TIMEOUT', '5'))
+# Requests in flight across all event loops, of which the lanes above bulk and
+# maintenance have these slots to themselves, see lanes.LaneLimiter
+MAX_CONCURRENCY = int(os.environ.get('FETCH_MAX_CONCURRENCY', '32'))
+RESERVED_SLOTS = parse_reserved(os.environ.get('FETCH_RESERVED_SLOTS', 'interactive=4,bulk=2'))
+# HTTP/2 goes through httpx and needs the optional 'h2' package (pip install httpx[http2])
+HTTP2 = os.environ.get('FETCH_HTTP2', 'false').lower() in ('1', 'true', 'yes')
+
+# Same policy as the urllib3 Retry(total=5, backoff_factor=0.1,
+# status_forcelist=[500, 502, 503, 504]) adapter the requests session used
+RETRY_TOTAL = 5
+RETRY_BACKOFF_FACTOR = 0.1
+RETRY_BACKOFF_MAX = 120
+RETRY_STATUS_FORCELIST = {500, 502, 503, 504}
+RETRY_AFTER_STATUS_CODES = {413, 429, 503}
+
+CHUNK_SIZE = 16 * 1024
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+# Markers that end the part of a page holding <title> and <meta> tags
+HEAD_END_MARKERS = (b"</head", b"<body")
+
+
+class FetchError(Exception):
+    """Raised when a page cannot be fetched."""
+
+
+class FetchStatusError(FetchError):
+    """Raised by FetchResponse.raise_for_status for 4xx and 5xx responses."""
+
+    def __init__(self, message: str, response: "FetchResponse"):
+        super().__init__(message)
+        self.response = response
+
+
+class _RetryableError(FetchError):
+    pass
+
+
+def is_html_content_type(content_type: Optional[str]) -> bool:
+    # A missing Content-Type is treated as HTML, plenty of servers leave it out
+    if not content_type:
+        return True
+    return content_type.split(";")[0].strip().lower() in HTML_CONTENT_TYPES
+
+
+async def read_body(chunks, content_type: Optional[str], head_only: bool = False, max_bytes: int = None):
+    """Read a streamed body and return (content, truncated).
+
+    With head_only the body of a non-HTML response is not read at all, and an
+    HTML body is read only until the end of its <head>. max_bytes caps the
+    amount read either way.
+    """
+    if head_only and not is_html_content_type(content_type):
+        return b"", True
+
+    buffer = bytearray()
+    async for chunk in chunks:
+        search_from = max(0, len(buffer) - 8)
+        buffer.extend(chunk)
+        if max_bytes and len(buffer) >= max_bytes:
+            del buffer[max_bytes:]
+            return bytes(buffer), True
+        if head_only:
+            window = buffer[search_from:].lower()
+            if any(marker in window for marker in HEAD_END_MARKERS):
+                return bytes(buffer), True
+    return bytes(buffer), False
+
+
+class FetchResponse:
+    """A read response, independent of the HTTP library that fetched it.
+
+    truncated is set when only part of the body was read.
+    """
+
+    def __init__(self, url: str, status_code: int, headers, content: bytes, truncated: bool = False):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.truncated = truncated
+
+    @property
+    def content_type(self) -> str:
+        return self.headers.get("Content-Type", "")
+
+    @property
+    def is_html(self) -> bool:
+        return is_html_content_type(self.content_type)
+
+    @property
+    def encoding(self) -> str:
+        match = re.search(r'charset=["\']?([\w.:-]+)', self.headers.get("Content-Type", ""), re.I)
+        return match.group(1) if match else "utf-8"
+
+    @property
+    def text(self) -> str:
+        try:
+            return self.content.decode(self.encoding, errors="replace")
+        except LookupError:
+            return self.content.decode("utf-8", errors="replace")
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise FetchStatusError(f"{self.status_code} error for url: {self.url}", self)
+        return self
+
+
+class _AiohttpBackend:
+    def __init__(self, max_connections: int, timeout: float):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._sessions = LoopLocal(self._create_session, closer=lambda session: session.close())
+
+    def _create_session(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            keepalive_timeout=KEEPALIVE_EXPIRY,
+            ttl_dns_cache=300,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout, connect=CONNECT_TIMEOUT),
+        )
+
+    async def get(self, url: str, headers: Optional[dict], timeout: Optional[float],
+                  head_only: bool, max_bytes: Optional[int]) -> FetchResponse:
+        session = self._sessions.get()
+        request_timeout = aiohttp.ClientTimeout(total=timeout, connect=CONNECT_TIMEOUT) if timeout else None
+        try:
+            async with session.get(url, headers=headers, timeout=request_timeout) as response:
+                content, truncated = await read_body(
+                    response.content.iter_chunked(CHUNK_SIZE), response.headers.get("Content-Type"),
+                    head_only, max_bytes,
+                )
+                return FetchResponse(str(response.url), response.status, response.headers, content, truncated)
+        except (aiohttp.InvalidURL, aiohttp.TooManyRedirects) as e:
+            raise FetchError(f"{type(e).__name__}: {e}") from e
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise _RetryableError(f"{type(e).__name__}: {e}") from e
+
+    async def aclose(self):
+        session = self._sessions.pop()
+        if session is not None:
+            await session.close()
+
+
+class _HttpxBackend:
+    def __init__(self, max_connections: int, timeout: float):
+        import httpx
+
+        self.httpx = httpx
+        self.limits = httpx.Limits(max_connections=max_connections, keepalive_expiry=KEEPALIVE_EXPIRY)
+        self.timeout = httpx.Timeout(timeout, connect=CONNECT_TIMEOUT)
+        self._clients = LoopLocal(self._create_client, closer=lambda client: client.aclose())
+
+    def _create_client(self):
+        return self.httpx.AsyncClient(limits=self.limits, timeout=self.timeout, http2=True, follow_redirects=True)
+
+    async def get(self, url: str, headers: Optional[dict], timeout: Optional[float],
+                  head_only: bool, max_bytes: Optional[int]) -> FetchResponse:
+        client = self._clients.get()
+        request_timeout = self.httpx.Timeout(timeout, connect=CONNECT_TIMEOUT) if timeout else self.timeout
+        try:
+            async with client.stream("GET", url, headers=headers, timeout=request_timeout) as response:
+                content, truncated = await read_body(
+                    response.aiter_bytes(CHUNK_SIZE), response.headers.get("Content-Type"),
+                    head_only, max_bytes,
+                )
+                return FetchResponse(str(response.url), response.status_code, response.headers, content, truncated)
+        except self.httpx.TransportError as e:
+            raise _RetryableError(f"{type(e).__name__}: {e}") from e
+        except self.httpx.HTTPError as e:
+            raise FetchError(f"{type(e).__name__}: {e}") from e
+
+    async def aclose(self):
+        client = self._clients.pop()
+        if client is not None:
+            await client.aclose()
+
+
+class AsyncHttpClient:
+    """Async GET with a bounded keep-alive connection pool and urllib3 style retries.
+
+    Connection errors, timeouts and 500/502/503/504 responses are retried up to
+    RETRY_TOTAL times with exponential backoff. A 503 with Retry-After is
+    returned right away, waiting for it is up to the caller, see
+    NLPService.fetch_with_retries. Once the retries are used up the last
+    response is returned as is. Requests
+    go through aiohttp, or through httpx when HTTP/2 is enabled. With a limiter
+    every attempt takes one of its slots, backoff waits do not.
+    """
+
+    def __init__(self, max_connections: int = None, timeout: float = None, http2: bool = None,
+                 retries: int = RETRY_TOTAL, backoff_factor: float = RETRY_BACKOFF_FACTOR,
+                 limiter: Optional[LaneLimiter] = None):
+        max_connections = max_connections or MAX_CONNECTIONS
+        timeout = timeout or TIMEOUT
+        self.limiter = limiter
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.backend = None
+        if HTTP2 if http2 is None else http2:
+            try:
+                import h2  # noqa: F401
+                self.backend = _HttpxBackend(max_connections, timeout)
+            except ImportError:
+                logger.warning("HTTP/2 requested but the 'h2' package is not installed, using HTTP/1.1")
+        if self.backend is None:
+            self.backend = _AiohttpBackend(max_connections, timeout)
+
+    def _backoff(self, errors: int) -> float:
+        if errors <= 1:
+            return 0
+        return min(RETRY_BACKOFF_MAX, self.backoff_factor * (2 ** (errors - 1)))
+
+    async def get(self, url: str, headers: dict = None, timeout: float = None,
+                  head_only: bool = False, max_bytes: int = None) -> FetchResponse:
+        """GET url. See read_body for what head_only and max_bytes leave out of the body."""
+        errors = 0
+        while True:
+            try:
+                if self.limiter is None:
+                    response = await self.backend.get(url, headers, timeout, head_only, max_bytes)
+                else:
+                    async with self.limiter.slot():
+                        response = await self.backend.get(url, headers, timeout, head_only, max_bytes)
+            except _RetryableError as e:
+                errors += 1
+                if errors > self.retries:
+                    raise FetchError(str(e)) from e.__cause__
+                await asyncio.sleep(self._backoff(errors))
+                continue
+
+            if response.status_code in RETRY_STATUS_FORCELIST and errors < self.retries:
+                if (response.status_code in RETRY_AFTER_STATUS_CODES
+                        and HostScheduler.parse_retry_after(response.headers.get("Retry-After")) is not None):
+                    # However long the server asks for, the caller defers the host
+                    # instead of this request sleeping in the host's slot
+                    return response
+                errors += 1
+                await asyncio.sleep(self._backoff(errors))
+                continue
+
+            return response
+
+    async def aclose(self):
+        """Close the connection pool of the current event loop."""
+        await self.backend.aclose()
+
+
+fetch_limiter = LaneLimiter("fetch", MAX_CONCURRENCY, RESERVED_SLOTS)
+http_client = AsyncHttpClient(limiter=fetch_limiter)
@@ -0,0 +1,172 @@
+# import_checkpoints.py
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, func, or_, select, update
+
+import models
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# A claimed staging row belongs to its worker until the lease runs out, workers
+# renew the leases of their rows while they process them
+LEASE_SECONDS = float(os.environ.get('IMPORT_LEASE_SECONDS', '60'))
+CLAIM_BATCH_SIZE = int(os.environ.get('IMPORT_CLAIM_BATCH_SIZE', '100'))
+# Failed rows are retried after RETRY_BASE_SECONDS, doubling per attempt, until MAX_ATTEMPTS
+MAX_ATTEMPTS = int(os.environ.get('IMPORT_MAX_ATTEMPTS', '3'))
+RETRY_BASE_SECONDS = float(os.environ.get('IMPORT_RETRY_BASE_SECONDS', '30'))
+RETRY_MAX_SECONDS = float(os.environ.get('IMPORT_RETRY_MAX_SECONDS', '600'))
+# Processed rows are kept this long to report their outcome
+KEEP_PROCESSED_DAYS = float(os.environ.get('IMPORT_KEEP_PROCESSED_DAYS', '7'))
+MAX_ERROR_CHARS = 1000
+
+Row = models.FavoriteToProcess
+
+
+def _now() -> datetime:
+    # Naive UTC, the way SQLite hands DateTime values back
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class ImportCheckpoints:
+    """Leases, outcomes and retries of the rows in the import staging table.
+
+    A row is pending until it is processed, successfully or after its last
+    attempt. Pending rows are claimed in batches under a lease; rows of a
+    worker that stopped renewing its leases become claimable again once they
+    expire. Enrichments are saved on the rows, so a row that is claimed again
+    skips the fetch and the LLM.
+    """
+
+    def _claimable(self, now: datetime):
+        return (
+            Row.processed == False,
+            or_(Row.lease_expires_at.is_(None), Row.lease_expires_at < now),
+            or_(Row.next_attempt_at.is_(None), Row.next_attempt_at <= now),
+        )
+
+    def claim(self, owner: str, limit: int = CLAIM_BATCH_SIZE) -> list:
+        """Lease up to limit claimable rows to owner, oldest first.
+
+        Returns (id, url, title, metainfo, favorite_id, attempts, enrichment) rows.
+        """
+        now = _now()
+        with SessionLocal() as db:
+            ids = select(Row.id).where(*self._claimable(now)).order_by(Row.id).limit(limit).scalar_subquery()
+            rows = db.execute(
+                update(Row)
+                .where(Row.id.in_(ids))
+                .values(lease_owner=owner, lease_expires_at=now + timedelta(seconds=LEASE_SECONDS))
+                .returning(Row.id, Row.url, Row.title, Row.metainfo, Row.favorite_id, Row.attempts, Row.enrichment)
+                .execution_options(synchronize_session=False)
+            ).all()
+            db.commit()
+        return sorted(rows, key=lambda row: row.id)
+
+    def renew(self, owner: str) -> int:
+        """Extend the leases of owner's pending rows, returns how many it holds."""
+        with SessionLocal() as db:
+            result = db.execute(
+                update(Row)
+                .where(Row.lease_owner == owner, Row.processed == False)
+                .values(lease_expires_at=_now() + timedelta(seconds=LEASE_SECONDS))
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+        return result.rowcount
+
+    def release(self, owner: str, staging_ids: Optional[List[int]] = None):
+        """Give up owner's leases, or those of staging_ids only, the unprocessed rows can be claimed right away."""
+        criteria = [Row.lease_owner == owner, Row.processed == False]
+        if staging_ids is not None:
+            criteria.append(Row.id.in_(staging_ids))
+        with SessionLocal() as db:
+            db.execute(
+                update(Row)
+                .where(*criteria)
+                .values(lease_owner=None, lease_expires_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+
+    def seconds_until_claimable(self, owner: str) -> Optional[float]:
+        """How long until a pending row that is waiting for a retry or another
+        worker's lease can be claimed, None when there is none."""
+        now = _now()
+        with SessionLocal() as db:
+            next_retry = db.scalar(
+                select(func.min(Row.next_attempt_at)).where(Row.processed == False, Row.next_attempt_at > now)
+            )
+            next_expiry = db.scalar(
+                select(func.min(Row.lease_expires_at))
+                .where(Row.processed == False, Row.lease_expires_at > now, Row.lease_owner != owner)
+            )
+        times = [value for value in (next_retry, next_expiry) if value is not None]
+        if not times:
+            return None
+        return max((min(times) - now).total_seconds(), 0.0)
+
+    def save_enrichments(self, enrichments: Dict[int, dict]):
+        """Save enrichments by staging row id, in one executemany. Rows processed meanwhile are left alone."""
+        with SessionLocal() as db:
+            db.execute(
+                update(Row).where(Row.processed == False).execution_options(synchronize_session=None),
+                [{"id": staging_id, "enrichment": enrichment} for staging_id, enrichment in enrichments.items()],
+            )
+            db.commit()
+
+    def mark_done(self, db, staging_ids: List[int]):
+        """Record staging_ids as processed successfully, in db's transaction."""
+        if staging_ids:
+            db.execute(update(Row), [
+                {"id": staging_id, "processed": True, "outcome": models.STAGING_DONE, "last_error": None,
+                 "lease_owner": None, "lease_expires_at": None, "next_attempt_at": None, "enrichment": None}
+                for staging_id in staging_ids
+            ])
+
+    def mark_failed(self, db, failures: List[tuple]) -> List[int]:
+        """Record (staging_id, attempts so far, error, enrichment or None) failures in db's transaction.
+
+        Rows with attempts left are scheduled for a retry with exponential
+        backoff, the others are processed as failed. Returns the ids of the latter.
+        """
+        now = _now()
+        values, final = [], []
+        for staging_id, attempts, error, enrichment in failures:
+            attempts += 1
+            value = {"id": staging_id, "attempts": attempts, "last_error": str(error)[:MAX_ERROR_CHARS],
+                     "lease_owner": None, "lease_expires_at": None}
+            if enrichment is not None:
+                value["enrichment"] = enrichment
+            if attempts >= MAX_ATTEMPTS:
+                value.update(processed=True, outcome=models.STAGING_FAILED, next_attempt_at=None)
+                final.append(staging_id)
+            else:
+                delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+                value["next_attempt_at"] = now + timedelta(seconds=delay)
+            values.append(value)
+        if values:
+            # A row processed meanwhile keeps its outcome
+            db.execute(update(Row).where(Row.processed == False).execution_options(synchronize_session=None), values)
+        return final
+
+    def count_pending(self, db) -> int:
+        return db.query(Row).filter(Row.processed == False).count()
+
+    def prune(self):
+        """Drop processed rows older than KEEP_PROCESSED_DAYS."""
+        with SessionLocal() as db:
+            result = db.execute(
+                delete(Row)
+                .where(Row.processed == True, Row.updated_at < _now() - timedelta(days=KEEP_PROCESSED_DAYS))
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+        if result.rowcount:
+            logger.info(f"Pruned {result.rowcount} processed staging rows")
+
+
+import_checkpoints = ImportCheckpoints()
@@ -0,0 +1,464 @@
+# import_pipeline.py
+import asyncio
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+from sqlalchemy import update
+
+import models
+from database import SessionLocal
+from domain_affinity import domain_affinity
+from http_client import FetchError
+from import_checkpoints import CLAIM_BATCH_SIZE, LEASE_SECONDS, import_checkpoints
+from tag_resolver import tag_resolver
+from task_queue import task_queue
+from url_utils import canonical_url
+from vector_store import vector_store
+
+logger = logging.getLogger(__name__)
+
+# Worker counts per stage. Fetching is network bound and can run wide, extraction
+# is CPU bound, the LLM stage is limited by the provider and SQLite only accepts
+# a single writer at a time.
+FETCH_WORKERS = int(os.environ.get('IMPORT_FETCH_WORKERS', '8'))
+EXTRACT_WORKERS = int(os.environ.get('IMPORT_EXTRACT_WORKERS', '2'))
+# Enough LLM workers to reach LLM_MAX_CONCURRENCY, the LLM limiter decides how many calls run
+LLM_WORKERS = int(os.environ.get('IMPORT_LLM_WORKERS', '16'))
+WRITE_WORKERS = int(os.environ.get('IMPORT_WRITE_WORKERS', '1'))
+# The write stage commits up to this many favorites at once, as many as are waiting
+WRITE_BATCH_SIZE = int(os.environ.get('IMPORT_WRITE_BATCH_SIZE', '50'))
+# Capacity of the queue in front of each stage, this is what gives backpressure
+QUEUE_SIZE = int(os.environ.get('IMPORT_QUEUE_SIZE', '16'))
+# Enrichments are saved on their staging rows in batches of this size
+CHECKPOINT_BATCH_SIZE = int(os.environ.get('IMPORT_CHECKPOINT_BATCH_SIZE', '16'))
+# How often the feeder looks for rows again while others are in flight or waiting for a retry
+POLL_SECONDS = float(os.environ.get('IMPORT_POLL_SECONDS', '1'))
+# Log a stats line every this many written favorites
+STATS_LOG_INTERVAL = int(os.environ.get('IMPORT_STATS_LOG_INTERVAL', '50'))
+
+_DONE = object()
+
+
+@dataclass
+class ImportItem:
+    staging_id: int
+    url: str
+    title: Optional[str]
+    metadata: Optional[str]
+    page: Any = None
+    fetch_error: Optional[Exception] = None
+    meta_info: Optional[dict] = None
+    content: Any = None
+    summary: Optional[str] = None
+    tags: List[str] = field(default_factory=list)
+    folder_id: Optional[int] = None
+    needs_refinement: bool = False
+    favorite_id: Optional[int] = None
+    attempts: int = 0
+    # Enriched by the llm stage, or by an earlier attempt when restored from its checkpoint
+    enriched: bool = False
+    restored: bool = False
+    retry_scheduled: bool = False
+    error: Optional[Exception] = None
+
+    def enrichment(self) -> Optional[dict]:
+        if not self.enriched:
+            return None
+        return {"summary": self.summary, "tags": self.tags, "folder_id": self.folder_id,
+                "needs_refinement": self.needs_refinement}
+
+
+class StageStats:
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.processed = 0
+        self.failed = 0
+        self.busy_time = 0.0
+        self.started_at = None
+        self.finished_at = None
+
+    def record(self, started: float, ended: float, failed: bool, busy: float = None):
+        """busy is the item's share of ended - started when it was handled in a batch."""
+        if self.started_at is None:
+            self.started_at = started
+        self.finished_at = ended
+        self.busy_time += ended - started if busy is None else busy
+        self.processed += 1
+        if failed:
+            self.failed += 1
+
+    def items_per_second(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "processed": self.processed,
+            "failed": self.failed,
+            "items_per_second": round(self.items_per_second(), 2),
+            "busy_seconds": round(self.busy_time, 2),
+        }
+
+
+class ImportPipeline:
+    """Runs staged favorites through fetch -> extract -> llm -> write.
+
+    Every stage has its own pool of workers and a bounded queue in front of it,
+    so a slow stage makes the stages before it wait instead of buffering the
+    whole import in memory. Staging rows are claimed in batches under a lease
+    that is renewed while the pipeline runs, see ImportCheckpoints.
+    """
+
+    def __init__(self, nlp_service, task_id: str, fetch_workers: int = None, extract_workers: int = None,
+                 llm_workers: int = None, write_workers: int = None, queue_size: int = None):
+        self.nlp_service = nlp_service
+        self.task_id = task_id
+        self.queue_size = queue_size or QUEUE_SIZE
+        self.stages = [
+            ("fetch", self._fetch, fetch_workers or FETCH_WORKERS),
+            ("extract", self._extract, extract_workers or EXTRACT_WORKERS),
+            ("llm", self._enrich, llm_workers or LLM_WORKERS),
+            ("write", self._write, write_workers or WRITE_WORKERS),
+        ]
+        self.stats = {name: StageStats(name, workers) for name, _, workers in self.stages}
+        self.total = 0
+        self.written = 0
+        self.succeeded = 0
+        self.needs_refinement = 0
+        self.retried = 0
+        self.fed = 0
+        self.owner = f"{task_id}:{uuid.uuid4().hex[:8]}"
+        self._checkpoints = {}
+
+    async def run(self, total: int):
+        """Process the pending staging rows and return the run statistics.
+
+        Runs until no row is pending, including rows waiting for a retry and rows
+        leased by a worker that stopped. total is the number of rows expected, for
+        the progress.
+        """
+        self.total = total
+        started = time.monotonic()
+
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        coros = [self._feed(queues[0], self.stages[0][2]), self._renew_leases()]
+        for index, (name, handler, workers) in enumerate(self.stages):
+            outbox = queues[index + 1] if index + 1 < len(queues) else None
+            downstream = self.stages[index + 1][2] if outbox is not None else 0
+            coros.append(self._run_stage(name, handler, workers, queues[index], outbox, downstream))
+
+        tasks = [asyncio.ensure_future(coro) for coro in coros]
+        renewer = tasks[1]
+        try:
+            await asyncio.gather(*(task for task in tasks if task is not renewer))
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Shielded, so a cancelled run still saves the enrichments it paid for
+            checkpoints, self._checkpoints = self._checkpoints, {}
+            await asyncio.shield(asyncio.to_thread(self._finish, checkpoints))
+
+        report = self.report()
+        report["elapsed_seconds"] = round(time.monotonic() - started, 2)
+        logger.info(f"Import pipeline finished: {report}")
+        return report
+
+    def report(self):
+        return {
+            "total": self.total,
+            "processed": self.written,
+            "succeeded": self.succeeded,
+            "retried": self.retried,
+            "needs_refinement": self.needs_refinement,
+            "stages": [self.stats[name].as_dict() for name, _, _ in self.stages],
+        }
+
+    def format_rates(self) -> str:
+        return ", ".join(
+            f"{name} {self.stats[name].items_per_second():.2f}/s" for name, _, _ in self.stages
+        )
+
+    async def _feed(self, outbox: asyncio.Queue, downstream: int):
+        while True:
+            rows = await asyncio.to_thread(import_checkpoints.claim, self.owner, CLAIM_BATCH_SIZE)
+            for staging_id, url, title, metainfo, favorite_id, attempts, enrichment in rows:
+                item = ImportItem(staging_id=staging_id, url=str(url), title=title, metadata=metainfo,
+                                  favorite_id=favorite_id, attempts=attempts)
+                if enrichment:
+                    item.summary = enrichment["summary"]
+                    item.tags = enrichment["tags"]
+                    item.folder_id = enrichment["folder_id"]
+                    item.needs_refinement = enrichment.get("needs_refinement", False)
+                    item.enriched = item.restored = True
+                self.fed += 1
+                await outbox.put(item)
+            if rows:
+                continue
+            # Items in flight may still fail and be scheduled for a retry
+            in_flight = self.fed - self.written
+            wait = await asyncio.to_thread(import_checkpoints.seconds_until_claimable, self.owner)
+            if wait is None and in_flight == 0:
+                break
+            await asyncio.sleep(min(wait, POLL_SECONDS) if wait is not None else POLL_SECONDS)
+        for _ in range(downstream):
+            await outbox.put(_DONE)
+
+    async def _renew_leases(self):
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            try:
+                await asyncio.to_thread(import_checkpoints.renew, self.owner)
+            except Exception as e:
+                logger.error(f"Error renewing the import leases of {self.owner}: {str(e)}")
+
+    async def _run_stage(self, name, handler, workers, inbox, outbox, downstream):
+        stats = self.stats[name]
+        is_last = outbox is None
+
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is _DONE:
+                    return
+                if is_last:
+                    if not await write_batch(item):
+                        return
+                    continue
+                # Failed items skip the remaining work but still reach the write
+                # stage, which is responsible for settling their staging row.
+                # Restored items only need the write.
+                if item.error is None and not item.restored:
+                    started = time.monotonic()
+                    try:
+                        await handler(item)
+                    except Exception as e:
+                        logger.error(f"Import stage '{name}' failed for {item.url}: {str(e)}")
+                        item.error = e
+                    stats.record(started, time.monotonic(), item.error is not None)
+                await outbox.put(item)
+
+        async def write_batch(item):
+            """Hand item and the items already waiting behind it to handler, False once the inbox is done."""
+            batch = [item]
+            more = True
+            while len(batch) < WRITE_BATCH_SIZE and not inbox.empty():
+                item = inbox.get_nowait()
+                if item is _DONE:
+                    more = False
+                    break
+                batch.append(item)
+            started = time.monotonic()
+            try:
+                await handler(batch)
+            except Exception as e:
+                logger.error(f"Import stage '{name}' failed for {len(batch)} favorites: {str(e)}")
+                for item in batch:
+                    item.error = item.error or e
+                # The feeder waits for every item it fed to be written
+                await asyncio.to_thread(self._settle_unwritten, batch)
+                self._count_written(batch)
+            ended = time.monotonic()
+            for item in batch:
+                stats.record(started, ended, item.error is not None, busy=(ended - started) / len(batch))
+            return more
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        for _ in range(downstream):
+            await outbox.put(_DONE)
+
+    async def _fetch(self, item: ImportItem):
+        try:
+            item.page = await self.nlp_service.content_extractor.fetch_page(item.url)
+        except FetchError as e:
+            # Not fatal, the llm stage falls back to describing the URL and metadata
+            logger.error(f"Error fetching URL {item.url}: {str(e)}")
+            item.fetch_error = e
+
+    async def _extract(self, item: ImportItem):
+        if item.fetch_error is None:
+            item.meta_info, item.content = await asyncio.to_thread(
+                self.nlp_service.content_extractor.extract_page, item.url, item.page
+            )
+        item.page = None
+
+    async def _enrich(self, item: ImportItem):
+        with SessionLocal() as db:
+            enrichment = await self.nlp_service.enrich(
+                db, item.url, item.content, item.metadata, fetch_failed=item.fetch_error is not None,
+                meta_info=item.meta_info,
+            )
+        item.meta_info = None
+        item.summary = enrichment["summary"]
+        item.tags = enrichment["tags"]
+        item.folder_id = enrichment["folder_id"]
+        item.needs_refinement = enrichment.get("needs_refinement", False)
+        item.enriched = True
+
+        self._checkpoints[item.staging_id] = item.enrichment()
+        if len(self._checkpoints) >= CHECKPOINT_BATCH_SIZE:
+            checkpoints, self._checkpoints = self._checkpoints, {}
+            await asyncio.to_thread(self._save_checkpoints, checkpoints)
+
+    def _save_checkpoints(self, checkpoints: dict):
+        if not checkpoints:
+            return
+        try:
+            import_checkpoints.save_enrichments(checkpoints)
+        except Exception as e:
+            # Only costs a repeated LLM call should the item be claimed again
+            logger.error(f"Error saving {len(checkpoints)} import checkpoints: {str(e)}")
+
+    def _finish(self, checkpoints: dict):
+        """Save the checkpoints short of a batch and give up the leases, however the run ended."""
+        self._save_checkpoints(checkpoints)
+        try:
+            import_checkpoints.release(self.owner)
+        except Exception as e:
+            # The leases run out by themselves
+            logger.error(f"Error releasing the import leases of {self.owner}: {str(e)}")
+
+    async def _write(self, items: List[ImportItem]):
+        await asyncio.to_thread(self._write_items, items)
+        self._count_written(items)
+
+    def _count_written(self, items: List[ImportItem]):
+        for item in items:
+            self.written += 1
+            if item.retry_scheduled:
+                self.retried += 1
+            elif item.error is None:
+                self.succeeded += 1
+                if item.needs_refinement:
+                    self.needs_refinement += 1
+            if self.written % STATS_LOG_INTERVAL == 0:
+                logger.info(f"Import progress {self.written}/{self.total}: {self.format_rates()}")
+        settled = self.written - self.retried
+        progress = min(int((settled / self.total) * 100), 100) if self.total else 100
+        task_queue.update_progress(self.task_id, progress)
+
+    def _write_items(self, items: List[ImportItem]):
+        """Write the favorites of items and settle their staging rows in one transaction.
+
+        When the transaction fails the items are written one by one, so a bad item
+        only fails itself.
+        """
+        db = SessionLocal()
+        try:
+            written = []
+            try:
+                live = [item for item in items if item.error is None]
+                existing = self._existing_favorites(db, live)
+                for item in live:
+                    written.append((item, *self._add_favorite(db, item, existing.get(item.staging_id))))
+                db.flush()
+                tag_resolver.set_tags(db, {db_favorite.id: item.tags for item, db_favorite, _ in written})
+                self._settle_failed(db, [item for item in items if item.error is not None])
+                import_checkpoints.mark_done(db, [item.staging_id for item, _, _ in written])
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                if len(items) > 1:
+                    for item in items:
+                        self._write_items([item])
+                    return
+                logger.error(f"Error processing favorite {items[0].url}: {str(e)}")
+                items[0].error = e
+                self._settle_failed(db, items)
+                db.commit()
+                return
+
+            rows = []
+            for item, db_favorite, old_folder_id in written:
+                item.favorite_id = db_favorite.id
+                if domain_affinity is not None:
+                    domain_affinity.record(item.url, old_folder_id, item.folder_id)
+                rows.append((db_favorite.id, item.url, db_favorite.title, item.summary))
+            try:
+                vector_store.add_favorites(rows)
+            except Exception as e:
+                # The favorites are committed, only the vector store write failed
+                logger.error(f"Error adding {len(rows)} imported favorites to the vector store: {str(e)}")
+        finally:
+            db.close()
+
+    def _settle_unwritten(self, items: List[ImportItem]):
+        """Settle the staging rows of items whose write failed as a whole.
+
+        They are scheduled for a retry like any failed item. Should that fail
+        too, their leases are given up so they can be claimed again.
+        """
+        try:
+            with SessionLocal() as db:
+                self._settle_failed(db, items)
+                db.commit()
+            return
+        except Exception as e:
+            logger.error(f"Error settling {len(items)} unwritten import items: {str(e)}")
+        for item in items:
+            item.retry_scheduled = True
+        try:
+            import_checkpoints.release(self.owner, [item.staging_id for item in items])
+        except Exception as e:
+            # The leases are not renewed any more once the run ends, see run
+            logger.error(f"Error releasing {len(items)} unwritten import items: {str(e)}")
+
+    def _existing_favorites(self, db, items: List[ImportItem]) -> dict:
+        """Favorites the items fill in, by staging id, found with one query per kind.
+
+        Those are the favorites written up front by the lazy mode and the ones
+        saved by other means since the item was staged.
+        """
+        by_id = [item.favorite_id for item in items if item.favorite_id is not None]
+        by_url = {canonical_url(item.url): item for item in items if item.favorite_id is None}
+        existing = {}
+        if by_id:
+            favorites = {f.id: f for f in db.query(models.Favorite).filter(models.Favorite.id.in_(by_id))}
+            for item in items:
+                if item.favorite_id in favorites:
+                    existing[item.staging_id] = favorites[item.favorite_id]
+        if by_url:
+            for db_favorite in db.query(models.Favorite).filter(models.Favorite.canonical_url.in_(list(by_url))):
+                existing[by_url[db_favorite.canonical_url].staging_id] = db_favorite
+        return existing
+
+    def _add_favorite(self, db, item: ImportItem, db_favorite):
+        """Fill in db_favorite, or add a new favorite when it is None, from item.
+
+        Returns the favorite and its previous folder id.
+        """
+        old_folder_id = db_favorite.folder_id if db_favorite else None
+        if db_favorite is None:
+            db_favorite = models.Favorite(url=item.url, title=item.title)
+            db.add(db_favorite)
+        db_favorite.summary = item.summary
+        db_favorite.folder_id = item.folder_id
+        db_favorite.needs_refinement = item.needs_refinement
+        db_favorite.enrichment_state = models.ENRICHMENT_DONE
+        return db_favorite, old_folder_id
+
+    def _settle_failed(self, db, items: List[ImportItem]):
+        """Schedule failed items for a retry, or mark their pending favorites failed after the last attempt."""
+        if not items:
+            return
+        final = set(import_checkpoints.mark_failed(db, [
+            (item.staging_id, item.attempts, item.error, item.enrichment()) for item in items
+        ]))
+        for item in items:
+            item.retry_scheduled = item.staging_id not in final
+        favorite_ids = [item.favorite_id for item in items if item.staging_id in final and item.favorite_id is not None]
+        if favorite_ids:
+            db.execute(
+                update(models.Favorite)
+                .where(models.Favorite.id.in_(favorite_ids))
+                .values(enrichment_state=models.ENRICHMENT_FAILED)
+            )
@@ -0,0 +1,144 @@
+# lanes.py
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Priority classes of work, highest first. Interactive is what a user waits for,
+# bulk are imports, maintenance is background upkeep like refining favorites.
+LANE_INTERACTIVE = 'interactive'
+LANE_BULK = 'bulk'
+LANE_MAINTENANCE = 'maintenance'
+LANES = (LANE_INTERACTIVE, LANE_BULK, LANE_MAINTENANCE)
+
+# The lane of the running code. Tasks set it from their queue entry, code that
+# runs outside a task serves a request directly and stays interactive.
+current_lane: ContextVar[str] = ContextVar('lane', default=LANE_INTERACTIVE)
+
+
+def parse_reserved(value: str) -> Dict[str, int]:
+    """Parse "interactive=2,bulk=1" into {lane: slots}, unknown lanes are ignored."""
+    reserved = {}
+    for part in (value or "").split(","):
+        lane, _, slots = part.partition("=")
+        lane = lane.strip()
+        if lane in LANES and slots.strip().isdigit():
+            reserved[lane] = int(slots)
+    return reserved
+
+
+def lane_cap(lane: str, limit: int, reserved: Dict[str, int]) -> int:
+    """How many of limit slots lane may fill, the rest is reserved for the lanes above it.
+
+    At least one, so every lane makes progress however small limit gets.
+    """
+    above = sum(reserved.get(higher, 0) for higher in LANES[:LANES.index(lane)])
+    return max(1, limit - above)
+
+
+class LaneLimiter:
+    """Concurrency limit shared by all event loops, with slots reserved for higher lanes.
+
+    A lane starts work while fewer than its lane_cap slots are taken and no
+    higher lane is waiting, so freed slots go to interactive work before bulk
+    work. Waiters are woken on their own loop, every task runs its own.
+    """
+
+    def __init__(self, name: str, limit: int, reserved: Dict[str, int]):
+        self.name = name
+        self.limit = max(1, limit)
+        self.reserved = reserved
+        self.in_flight = {lane: 0 for lane in LANES}
+        self.started = {lane: 0 for lane in LANES}
+        self._waiters = {lane: deque() for lane in LANES}
+        self._lock = threading.Lock()
+
+    def _can_start(self, lane: str) -> bool:
+        if sum(self.in_flight.values()) >= lane_cap(lane, self.limit, self.reserved):
+            return False
+        return not any(self._waiters[higher] for higher in LANES[:LANES.index(lane)])
+
+    def _start(self, lane: str):
+        self.in_flight[lane] += 1
+        self.started[lane] += 1
+
+    async def acquire(self, lane: Optional[str] = None) -> str:
+        """Wait for a slot for lane, the current lane by default, and return the lane."""
+        lane = lane or current_lane.get()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._waiters[lane] and self._can_start(lane):
+                self._start(lane)
+                return lane
+            waiter = (loop, loop.create_future())
+            self._waiters[lane].append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters[lane]:
+                    self._waiters[lane].remove(waiter)
+                    waiter = None
+            if waiter is None:
+                # Its turn may have come for the next waiter
+                self._grant()
+            # Otherwise the slot was granted already, _resolve gives it back
+            raise
+        return lane
+
+    def release(self, lane: str):
+        with self._lock:
+            self.in_flight[lane] -= 1
+        self._grant()
+
+    def _grant(self):
+        granted = []
+        with self._lock:
+            for lane in LANES:
+                waiters = self._waiters[lane]
+                while waiters and sum(self.in_flight.values()) < lane_cap(lane, self.limit, self.reserved):
+                    self._start(lane)
+                    granted.append((lane, waiters.popleft()))
+                if waiters:
+                    # Lower lanes wait behind this one
+                    break
+        for lane, (loop, future) in granted:
+            try:
+                loop.call_soon_threadsafe(self._resolve, lane, future)
+            except RuntimeError:
+                # The waiter's loop is closed, nobody is left to use the slot
+                self.release(lane)
+
+    def _resolve(self, lane: str, future: asyncio.Future):
+        if future.done():
+            self.release(lane)
+        else:
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, lane: Optional[str] = None):
+        lane = await self.acquire(lane)
+        try:
+            yield
+        finally:
+            self.release(lane)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "reserved": dict(self.reserved),
+                "lanes": {
+                    lane: {
+                        "cap": lane_cap(lane, self.limit, self.reserved),
+                        "in_flight": self.in_flight[lane],
+                        "waiting": len(self._waiters[lane]),
+                        "started": self.started[lane],
+                    } for lane in LANES
+                },
+            }
@@ -0,0 +1,70 @@
+import asyncio
+
+from lanes import LANE_BULK, LANE_INTERACTIVE, LANE_MAINTENANCE, LaneLimiter, lane_cap, parse_reserved
+
+
+def test_parse_reserved():
+    assert parse_reserved("interactive=2, bulk=1,unknown=3,maintenance=x") == {LANE_INTERACTIVE: 2, LANE_BULK: 1}
+    assert parse_reserved("") == {}
+
+
+def test_lane_cap():
+    reserved = {LANE_INTERACTIVE: 2, LANE_BULK: 1}
+    assert lane_cap(LANE_INTERACTIVE, 8, reserved) == 8
+    assert lane_cap(LANE_BULK, 8, reserved) == 6
+    assert lane_cap(LANE_MAINTENANCE, 8, reserved) == 5
+    # Every lane keeps one slot
+    assert lane_cap(LANE_MAINTENANCE, 2, reserved) == 1
+
+
+def test_limiter_keeps_reserved_slot_and_serves_higher_lanes_first():
+    limiter = LaneLimiter("test", 2, {LANE_INTERACTIVE: 1})
+    order = []
+
+    async def run():
+        await limiter.acquire(LANE_BULK)
+        # The second slot is reserved for interactive work
+        bulk = asyncio.create_task(limiter.acquire(LANE_BULK))
+        await asyncio.sleep(0)
+        assert not bulk.done()
+        assert await limiter.acquire(LANE_INTERACTIVE) == LANE_INTERACTIVE
+
+        async def wait(lane):
+            await limiter.acquire(lane)
+            order.append(lane)
+
+        maintenance = asyncio.create_task(wait(LANE_MAINTENANCE))
+        interactive = asyncio.create_task(wait(LANE_INTERACTIVE))
+        await asyncio.sleep(0)
+        limiter.release(LANE_INTERACTIVE)
+        await interactive
+        assert order == [LANE_INTERACTIVE]
+        assert not bulk.done() and not maintenance.done()
+
+        limiter.release(LANE_INTERACTIVE)
+        limiter.release(LANE_BULK)
+        await bulk
+        limiter.release(LANE_BULK)
+        await maintenance
+        assert order == [LANE_INTERACTIVE, LANE_MAINTENANCE]
+
+    asyncio.run(run())
+    stats = limiter.stats()
+    assert stats["lanes"][LANE_MAINTENANCE]["in_flight"] == 1
+    assert stats["lanes"][LANE_BULK]["started"] == 2
+
+
+def test_cancelled_waiter_passes_its_turn_on():
+    limiter = LaneLimiter("test", 1, {})
+
+    async def run():
+        await limiter.acquire(LANE_BULK)
+        first = asyncio.create_task(limiter.acquire(LANE_BULK))
+        second = asyncio.create_task(limiter.acquire(LANE_BULK))
+        await asyncio.sleep(0)
+        first.cancel()
+        limiter.release(LANE_BULK)
+        assert await second == LANE_BULK
+
+    asyncio.run(run())
+    assert limiter.stats()["lanes"][LANE_BULK]["in_flight"] == 1
@@ -1,13 +1,16 @@
 from abc import ABC, abstractmethod
+import asyncio
 import ollama
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import os
-from typing import Optional, Generator, Any
+from typing import Optional, Generator, AsyncGenerator, Any
 from anthropic import Anthropic, AsyncAnthropic, RateLimitError, APIStatusError, APIConnectionError
 import logging
 
 logger = logging.getLogger(__name__)
 
+_STREAM_END = object()
+
 class LLMProvider(ABC):
     @abstractmethod
     def generate(self, prompt: str) -> str:
@@ -17,9 +20,22 @@ class LLMProvider(ABC):
     def generate_stream(self, prompt: str) -> Generator[str, None, None]:
         pass
 
+    async def agenerate(self, prompt: str) -> str:
+        # Providers without an async client run the blocking call in a worker thread
+        return await asyncio.to_thread(self.generate, prompt)
+
+    async def agenerate_stream(self, prompt: str) -> AsyncGenerator[str, None]:
+        stream = await asyncio.to_thread(self.generate_stream, prompt)
+        while True:
+            chunk = await asyncio.to_thread(next, stream, _STREAM_END)
+            if chunk is _STREAM_END:
+                break
+            yield chunk
+
 class OllamaProvider(LLMProvider):
     def __init__(self, model: str = 'phi3.5'):
         self.model = model
+        self.async_clients = LoopLocal(ollama.AsyncClient, closer=lambda client: client._client.aclose())
 
     def generate(self, prompt: str) -> str:
         try:
@@ -36,13 +52,29 @@ class OllamaProvider(LLMProvider):
         except Exception as e:
             raise RuntimeError(f"Error generating streaming response with Ollama: {str(e)}")
 
+    async def agenerate(self, prompt: str) -> str:
+        try:
+            response = await self.async_clients.get().generate(model=self.model, prompt=prompt)
+            return response['response']
+        except Exception as e:
+            raise RuntimeError(f"Error generating response with Ollama: {str(e)}")
+
+    async def agenerate_stream(self, prompt: str) -> AsyncGenerator[str, None]:
+        try:
+            stream = await self.async_clients.get().generate(model=self.model, prompt=prompt, stream=True)
+            async for chunk in stream:
+                yield chunk['response']
+        except Exception as e:
+            raise RuntimeError(f"Error generating streaming response with Ollama: {str(e)}")
+
 class OpenAIProvider(LLMProvider):
     def __init__(self, model: str = "gpt-3.5-turbo"):
         self.model = model
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OpenAI API key not found. Please set the OPENAI_API_KEY environment variable.")
-        self.client = OpenAI()
+        self.client = OpenAI(max_retries=SDK_MAX_RETRIES)
+        self.async_clients = LoopLocal(lambda: AsyncOpenAI(max_retries=SDK_MAX_RETRIES), closer=lambda client: client.close())
 
     def generate(self, prompt: str) -> str:
         try:
@@ -67,6 +99,29 @@ class OpenAIProvider(LLMProvider):
         except Exception as e:
             raise RuntimeError(f"Error generating streaming response with OpenAI: {str(e)}")
 
+    async def agenerate(self, prompt: str) -> str:
+        try:
+            completion = await self.async_clients.get().chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}]
+            )
+            return completion.choices[0].message.content
+        except Exception as e:
+            raise RuntimeError(f"Error generating response with OpenAI: {str(e)}")
+
+    async def agenerate_stream(self, prompt: str) -> AsyncGenerator[str, None]:
+        try:
+            stream = await self.async_clients.get().chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                stream=True
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            raise RuntimeError(f"Error generating streaming response with OpenAI: {str(e)}")
+
     def generate_with_metadata(self, prompt: str) -> tuple[str, Any]:
         try:
             response = self.client.chat.completions.with_raw_response.create(
@@ -89,8 +144,16 @@ from typing import Optional, Generator, Any
 from anthropic import Anthropic, AsyncAnthropic, RateLimitError, APIStatusError, APIConnectionError
 import httpx
 
+from llm_cache import LLMCache, llm_cache, prompt_cache_key
+from llm_limiter import LLMRateLimiter, llm_limiter
+from loop_local import LoopLocal
+
 logger = logging.getLogger(__name__)
 
+# The limiter retries rate limit and overload errors with its own backoff, the
+# SDK clients only retry when it is turned off
+SDK_MAX_RETRIES = 0 if llm_limiter is not None else 3
+
 class AnthropicProvider(LLMProvider):
     def __init__(self, model: str = "claude-3-haiku-20240307"):
         self.model = model
@@ -101,7 +164,15 @@ class AnthropicProvider(LLMProvider):
         if not api_key:
             raise ValueError("Anthropic API key not found. Please set the ANTHROPIC_API_KEY environment variable.")
         self.client = Anthropic(
-            max_retries=3,
+            max_retries=SDK_MAX_RETRIES,
+            timeout=httpx.Timeout(30.0, connect=5.0)
+        )
+        # Async clients hold a connection pool bound to the event loop that uses it
+        self.async_clients = LoopLocal(self.create_async_client, closer=lambda client: client.close())
+
+    def create_async_client(self):
+        return AsyncAnthropic(
+            max_retries=SDK_MAX_RETRIES,
             timeout=httpx.Timeout(30.0, connect=5.0)
         )
 
@@ -159,15 +230,131 @@ class AnthropicProvider(LLMProvider):
         except Exception as e:
             logger.error(f"Unexpected error generating streaming response: {str(e)}")
             raise
+
+    async def agenerate(self, prompt: str) -> str:
+        try:
+            message = await self.async_clients.get().messages.create(
+                model=self.model,
+                max_tokens=1024,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt,
+                    }
+                ],
+            )
+            return message.content[0].text
+        except RateLimitError as e:
+            logger.warning(f"Rate limit reached: {str(e)}")
+            raise
+        except APIConnectionError as e:
+            logger.error(f"Connection error: {str(e)}")
+            raise
+        except APIStatusError as e:
+            logger.error(f"API error: {e.status_code} - {str(e)}")
+            raise
+        except Exception as e:
+            logger.error(f"Unexpected error generating response: {str(e)}")
+            raise
+
+    async def agenerate_stream(self, prompt: str) -> AsyncGenerator[str, None]:
+        try:
+            stream = await self.async_clients.get().messages.create(
+                model=self.model,
+                max_tokens=1024,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt,
+                    }
+                ],
+                stream=True,
+            )
+            async for event in stream:
+                if event.type == "content_block_delta":
+                    yield event.delta.text
+        except RateLimitError as e:
+            logger.warning(f"Rate limit reached in stream: {str(e)}")
+            raise
+        except APIConnectionError as e:
+            logger.error(f"Connection error in stream: {str(e)}")
+            raise
+        except APIStatusError as e:
+            logger.error(f"API error in stream: {e.status_code} - {str(e)}")
+            raise
+        except Exception as e:
+            logger.error(f"Unexpected error generating streaming response: {str(e)}")
+            raise
 class LLMService:
-    def __init__(self, provider: Optional[LLMProvider] = None):
+    def __init__(self, provider: Optional[LLMProvider] = None, cache: Optional[LLMCache] = None,
+                 limiter: Optional[LLMRateLimiter] = None):
         if provider is None:
             # Default to Ollama if no provider is specified
             provider = OllamaProvider()
         self.provider = provider
+        self.cache = cache
+        self.limiter = limiter
 
-    def generate(self, prompt: str) -> str:
-        return self.provider.generate(prompt)
+    def cache_key(self, prompt: str) -> str:
+        return prompt_cache_key(type(self.provider).__name__, getattr(self.provider, "model", ""), prompt)
+
+    def _call_provider(self, prompt: str) -> tuple[str, float]:
+        """Return the provider's response and how long the provider took, within the limiter."""
+        def call():
+            started = time.perf_counter()
+            response = self.provider.generate(prompt)
+            return response, time.perf_counter() - started
+
+        if self.limiter is None:
+            return call()
+        return self.limiter.run_blocking(call, prompt)
+
+    async def _acall_provider(self, prompt: str) -> tuple[str, float]:
+        async def call():
+            started = time.perf_counter()
+            response = await self.provider.agenerate(prompt)
+            return response, time.perf_counter() - started
+
+        if self.limiter is None:
+            return await call()
+        return await self.limiter.run(call, prompt)
+
+    def generate(self, prompt: str, use_cache: bool = True) -> str:
+        """Generate a response, answered from the cache for a prompt seen before.
+
+        use_cache=False bypasses the cache for both lookup and storage.
+        """
+        if self.cache is None or not use_cache:
+            return self._call_provider(prompt)[0]
+
+        key = self.cache_key(prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        response, latency = self._call_provider(prompt)
+        self.cache.put(key, response, latency)
+        return response
+
+    async def agenerate(self, prompt: str, use_cache: bool = True) -> str:
+        """Async version of generate, see there for use_cache."""
+        if self.cache is None or not use_cache:
+            return (await self._acall_provider(prompt))[0]
+
+        key = self.cache_key(prompt)
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            return cached
+        response, latency = await self._acall_provider(prompt)
+        await asyncio.to_thread(self.cache.put, key, response, latency)
+        return response
+
+    def agenerate_stream(self, prompt: str) -> AsyncGenerator[str, None]:
+        return self.provider.agenerate_stream(prompt)
+
+    def invalidate(self, prompt: str):
+        """Drop a cached response, e.g. one that turned out to be unusable."""
+        if self.cache is not None:
+            self.cache.store.delete(self.cache_key(prompt))
 
     def generate_stream(self, prompt: str) -> Generator[str, None, None]:
         return self.provider.generate_stream(prompt)
@@ -179,10 +366,10 @@ class LLMService:
             return self.generate(prompt), None
 
 # Initialize with default provider (Ollama)
-# llm_service = LLMService()
+# llm_service = LLMService(cache=llm_cache, limiter=llm_limiter)
 
 # To use OpenAI provider, uncomment the following line and ensure OPENAI_API_KEY is set
-# llm_service = LLMService(OpenAIProvider())
+# llm_service = LLMService(OpenAIProvider(), cache=llm_cache, limiter=llm_limiter)
 
 # To use Anthropic provider, uncomment the following line and ensure ANTHROPIC_API_KEY is set
-llm_service = LLMService(AnthropicProvider())
\ No newline at end of file
+llm_service = LLMService(AnthropicProvider(), cache=llm_cache, limiter=llm_limiter)
\ No newline at end of file
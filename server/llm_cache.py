@@ -0,0 +1,67 @@
+# llm_cache.py
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+sqlite_dir = os.environ.get('SQLITE_DIR', '.')
+
+ENABLED = os.environ.get('LLM_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CACHE_PATH = os.environ.get('LLM_CACHE_PATH', os.path.join(sqlite_dir, 'llm_cache.db'))
+TTL = float(os.environ.get('LLM_CACHE_TTL', str(30 * 24 * 3600)))
+MAX_BYTES = int(os.environ.get('LLM_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+
+
+def prompt_cache_key(provider: str, model: str, prompt: str) -> str:
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return f"{provider}:{model}:{digest}"
+
+
+class LLMCache:
+    """Persistent cache of LLM responses keyed by provider, model and rendered prompt."""
+
+    def __init__(self, path: str = CACHE_PATH, max_bytes: int = MAX_BYTES, ttl: float = TTL):
+        self.store = DiskCache(path, max_bytes)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def get(self, key: str) -> Optional[str]:
+        cached = self.store.get(key)
+        if cached is not None:
+            value, stored_at = cached
+            if time.time() - stored_at < self.ttl:
+                with self._lock:
+                    self.hits += 1
+                    # What the original call took is what this hit saved
+                    self.saved_seconds += value.get("latency", 0.0)
+                return value["response"]
+            self.store.delete(key)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, response: str, latency: float):
+        self.store.put(key, {"response": response, "latency": latency})
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 2),
+            "ttl_seconds": self.ttl,
+            **self.store.stats(),
+        }
+
+
+llm_cache = LLMCache() if ENABLED else None
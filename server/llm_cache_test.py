@@ -0,0 +1,51 @@
+import asyncio
+
+import llm_cache
+from llm import LLMProvider, LLMService
+from llm_cache import LLMCache, prompt_cache_key
+
+
+class CountingProvider(LLMProvider):
+    model = "counting"
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate(self, prompt: str) -> str:
+        self.calls += 1
+        return f"Response {self.calls}"
+
+    def generate_stream(self, prompt: str):
+        yield self.generate(prompt)
+
+
+def test_cache_hit_miss_and_ttl(tmp_path, monkeypatch):
+    cache = LLMCache(path=str(tmp_path / "llm_cache.db"), max_bytes=1024 * 1024, ttl=60)
+    key = prompt_cache_key("Provider", "model", "Summarize")
+    assert cache.get(key) is None
+    cache.put(key, "A summary", latency=1.5)
+    assert cache.get(key) == "A summary"
+    assert cache.get(prompt_cache_key("Provider", "other-model", "Summarize")) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["saved_seconds"]) == (1, 2, 1.5)
+
+    now = llm_cache.time.time()
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now + 61)
+    assert cache.get(key) is None
+    # The expired entry is dropped
+    assert cache.store.get(key) is None
+    assert cache.stats()["misses"] == 3
+
+
+def test_service_answers_repeated_prompts_from_cache(tmp_path):
+    provider = CountingProvider()
+    cache = LLMCache(path=str(tmp_path / "llm_cache.db"), max_bytes=1024 * 1024, ttl=60)
+    service = LLMService(provider, cache=cache)
+
+    assert service.generate("Summarize") == "Response 1"
+    assert asyncio.run(service.agenerate("Summarize")) == "Response 1"
+    assert service.generate("Summarize", use_cache=False) == "Response 2"
+    assert provider.calls == 2
+
+    service.invalidate("Summarize")
+    assert service.generate("Summarize") == "Response 3"
@@ -0,0 +1,290 @@
+# llm_limiter.py
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from host_scheduler import HostScheduler
+from lanes import LANES, current_lane, lane_cap, parse_reserved
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('LLM_LIMITER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Provider budgets, 0 disables a budget. The defaults match Anthropic's first usage tier
+REQUESTS_PER_MINUTE = float(os.environ.get('LLM_REQUESTS_PER_MINUTE', '50'))
+TOKENS_PER_MINUTE = float(os.environ.get('LLM_TOKENS_PER_MINUTE', '40000'))
+# Calls in flight start at INITIAL_CONCURRENCY and adapt between 1 and MAX_CONCURRENCY
+INITIAL_CONCURRENCY = int(os.environ.get('LLM_INITIAL_CONCURRENCY', '4'))
+MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '16'))
+# Slots of the concurrency limit only the lanes above bulk and maintenance may use
+RESERVED_SLOTS = parse_reserved(os.environ.get('LLM_RESERVED_SLOTS', 'interactive=2,bulk=1'))
+# How often a call that hit a rate limit or overload error is retried
+MAX_RETRIES = int(os.environ.get('LLM_RATE_LIMIT_RETRIES', '5'))
+# Tokens reserved for the response of a call before its actual size is known
+OUTPUT_TOKEN_ESTIMATE = int(os.environ.get('LLM_OUTPUT_TOKEN_ESTIMATE', '300'))
+
+# 429 rate limited, 503 unavailable, 529 Anthropic overloaded
+OVERLOAD_STATUS_CODES = {429, 503, 529}
+POLL_INTERVAL = 0.05
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+
+def estimate_tokens(text: str) -> int:
+    # About four characters per token for English text
+    return max(1, len(text or "") // 4)
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def overload_error(error: BaseException) -> Optional[BaseException]:
+    """Return the rate limit or overload error behind error, if any.
+
+    Providers wrap SDK errors in RuntimeError, so the exception chain is searched.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if _status_code(error) in OVERLOAD_STATUS_CODES:
+            return error
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    return HostScheduler.parse_retry_after(headers.get("retry-after"))
+
+
+class TokenBucket:
+    """Budget of per_minute units refilled continuously."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount is available, amounts above the capacity wait for a full bucket."""
+        missing = min(amount, self.capacity) - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float):
+        # Going negative makes later callers wait for what an oversized call used
+        self.tokens -= amount
+
+
+class LLMRateLimiter:
+    """Keeps LLM calls within request and token budgets with adaptive concurrency.
+
+    A call starts once a concurrency slot, a request and its estimated tokens are
+    available. The concurrency limit grows by one per limit's worth of successful
+    calls and halves on a rate limit or overload error (AIMD), which is then
+    retried after Retry-After or an exponential backoff. Like HostScheduler the
+    state sits behind a threading lock because every task runs its own event loop.
+
+    Calls are made in the current lane. A lane waits while a higher lane is
+    waiting and only fills the part of the concurrency limit not reserved for
+    the lanes above it, see lanes.lane_cap.
+    """
+
+    def __init__(self, requests_per_minute: float = REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = TOKENS_PER_MINUTE,
+                 initial_concurrency: int = INITIAL_CONCURRENCY,
+                 max_concurrency: int = MAX_CONCURRENCY, max_retries: int = MAX_RETRIES,
+                 reserved: dict = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = float(min(max(1, initial_concurrency), self.max_concurrency))
+        self.max_retries = max_retries
+        self.reserved = RESERVED_SLOTS if reserved is None else reserved
+        self.in_flight = 0
+        self.waiting = {lane: 0 for lane in LANES}
+        self.started = {lane: 0 for lane in LANES}
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.succeeded = 0
+        self.rate_limited = 0
+        self.retried = 0
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, cost: int, lane: str):
+        """Take a slot and return (0, start time), or (seconds to wait, None)."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now, None
+            if any(self.waiting[higher] for higher in LANES[:LANES.index(lane)]):
+                return POLL_INTERVAL, None
+            if self.in_flight >= lane_cap(lane, int(self.concurrency), self.reserved):
+                return POLL_INTERVAL, None
+            wait = 0.0
+            for bucket, amount in ((self.requests, 1), (self.tokens, cost)):
+                if bucket is not None:
+                    bucket.refill(now)
+                    wait = max(wait, bucket.wait_time(amount))
+            if wait > 0:
+                return max(wait, POLL_INTERVAL), None
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(cost)
+            self.in_flight += 1
+            self.started[lane] += 1
+            return 0.0, now
+
+    async def acquire(self, cost: int, lane: str = None) -> float:
+        """Wait for a slot for a call of cost tokens in lane, the current one by default, and return its start time."""
+        lane = lane or current_lane.get()
+        with self._lock:
+            self.waiting[lane] += 1
+        try:
+            while True:
+                wait, started = self._try_acquire(cost, lane)
+                if started is not None:
+                    return started
+                await asyncio.sleep(wait)
+        finally:
+            with self._lock:
+                self.waiting[lane] -= 1
+
+    def acquire_blocking(self, cost: int, lane: str = None) -> float:
+        lane = lane or current_lane.get()
+        with self._lock:
+            self.waiting[lane] += 1
+        try:
+            while True:
+                wait, started = self._try_acquire(cost, lane)
+                if started is not None:
+                    return started
+                time.sleep(wait)
+        finally:
+            with self._lock:
+                self.waiting[lane] -= 1
+
+    def on_success(self, estimated_tokens: int, used_tokens: int):
+        with self._lock:
+            self.in_flight -= 1
+            self.succeeded += 1
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+            if self.tokens is not None:
+                # Settle the estimate against what the call actually used
+                self.tokens.take(used_tokens - estimated_tokens)
+
+    def on_error(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def on_overload(self, started: float, attempt: int, delay: Optional[float]) -> float:
+        """Back off after a rate limit or overload error and return the pause in seconds."""
+        if delay is None:
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+        with self._lock:
+            self.in_flight -= 1
+            self.rate_limited += 1
+            # Calls started before the last decrease saw the old limit, halve once per round
+            if started >= self.last_decrease:
+                self.concurrency = max(1.0, self.concurrency / 2)
+                self.last_decrease = time.monotonic()
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            concurrency = int(self.concurrency)
+        logger.warning(f"LLM provider is rate limiting, concurrency {concurrency}, pausing {delay:.1f}s")
+        return delay
+
+    async def run(self, call, prompt: str):
+        """Await call() within the limits, retrying rate limit and overload errors."""
+        estimate = estimate_tokens(prompt) + OUTPUT_TOKEN_ESTIMATE
+        attempt = 0
+        while True:
+            started = await self.acquire(estimate)
+            try:
+                response = await call()
+            except Exception as e:
+                if not self._should_retry(e, started, attempt):
+                    raise
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled, or the thread is exiting, the slot is given back all the same
+                self.on_error()
+                raise
+            self.on_success(estimate, estimate_tokens(prompt) + estimate_tokens(response))
+            return response
+
+    def run_blocking(self, call, prompt: str):
+        estimate = estimate_tokens(prompt) + OUTPUT_TOKEN_ESTIMATE
+        attempt = 0
+        while True:
+            started = self.acquire_blocking(estimate)
+            try:
+                response = call()
+            except Exception as e:
+                if not self._should_retry(e, started, attempt):
+                    raise
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled, or the thread is exiting, the slot is given back all the same
+                self.on_error()
+                raise
+            self.on_success(estimate, estimate_tokens(prompt) + estimate_tokens(response))
+            return response
+
+    def _should_retry(self, error: Exception, started: float, attempt: int) -> bool:
+        overload = overload_error(error)
+        if overload is None:
+            self.on_error()
+            return False
+        self.on_overload(started, attempt, retry_after(overload))
+        if attempt >= self.max_retries:
+            return False
+        with self._lock:
+            self.retried += 1
+        return True
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            for bucket in (self.requests, self.tokens):
+                if bucket is not None:
+                    bucket.refill(now)
+            return {
+                "concurrency_limit": int(self.concurrency),
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "queue_depth": sum(self.waiting.values()),
+                "reserved": dict(self.reserved),
+                "lanes": {
+                    lane: {
+                        "cap": lane_cap(lane, int(self.concurrency), self.reserved),
+                        "waiting": self.waiting[lane],
+                        "started": self.started[lane],
+                    } for lane in LANES
+                },
+                "requests_per_minute": self.requests.capacity if self.requests else None,
+                "requests_available": round(self.requests.tokens, 1) if self.requests else None,
+                "tokens_per_minute": self.tokens.capacity if self.tokens else None,
+                "tokens_available": round(self.tokens.tokens) if self.tokens else None,
+                "paused_seconds": round(max(0.0, self.paused_until - now), 1),
+                "succeeded": self.succeeded,
+                "rate_limited": self.rate_limited,
+                "retried": self.retried,
+            }
+
+
+llm_limiter = LLMRateLimiter() if ENABLED else None
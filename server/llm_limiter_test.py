@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+import llm_limiter
+from lanes import LANE_BULK
+from llm_limiter import LLMRateLimiter
+
+
+class OverloadError(Exception):
+    status_code = 529
+
+
+def make_limiter(**kwargs):
+    # Budgets off, only the concurrency limit applies
+    return LLMRateLimiter(requests_per_minute=0, tokens_per_minute=0, reserved={}, **kwargs)
+
+
+def test_concurrency_grows_additively_and_halves_once_per_round():
+    limiter = make_limiter(initial_concurrency=4, max_concurrency=8)
+    first = limiter.acquire_blocking(10, LANE_BULK)
+    second = limiter.acquire_blocking(10, LANE_BULK)
+
+    limiter.on_overload(first, 0, 0)
+    assert limiter.concurrency == 2
+    # Started before the decrease, it saw the old limit and does not halve again
+    limiter.on_overload(second, 0, 0)
+    assert limiter.concurrency == 2
+    assert limiter.stats()["rate_limited"] == 2
+
+    limiter.acquire_blocking(10, LANE_BULK)
+    limiter.on_success(10, 10)
+    assert limiter.concurrency == 2.5
+    for _ in range(100):
+        limiter.acquire_blocking(10, LANE_BULK)
+        limiter.on_success(10, 10)
+    assert limiter.concurrency == 8
+    assert limiter.in_flight == 0
+
+
+def test_run_backs_off_and_retries_overload_errors(monkeypatch):
+    monkeypatch.setattr(llm_limiter, "BACKOFF_BASE", 0.01)
+    limiter = make_limiter(initial_concurrency=4, max_concurrency=8, max_retries=2)
+    attempts = []
+
+    async def call():
+        attempts.append(limiter.in_flight)
+        if len(attempts) < 3:
+            raise RuntimeError("Error generating response") from OverloadError()
+        return "response"
+
+    assert asyncio.run(limiter.run(call, "prompt")) == "response"
+    assert attempts == [1, 1, 1]
+    stats = limiter.stats()
+    assert (stats["rate_limited"], stats["retried"], stats["succeeded"]) == (2, 2, 1)
+    # Halved by both errors as each retry started after the last decrease, then one success
+    assert limiter.concurrency == 2
+    assert limiter.in_flight == 0
+
+
+def test_run_gives_up_after_max_retries_and_passes_other_errors(monkeypatch):
+    monkeypatch.setattr(llm_limiter, "BACKOFF_BASE", 0.01)
+    limiter = make_limiter(initial_concurrency=2, max_retries=0)
+
+    async def overloaded():
+        raise OverloadError()
+
+    async def broken():
+        raise ValueError("bad prompt")
+
+    with pytest.raises(OverloadError):
+        asyncio.run(limiter.run(overloaded, "prompt"))
+    with pytest.raises(ValueError):
+        asyncio.run(limiter.run(broken, "prompt"))
+    stats = limiter.stats()
+    assert (stats["rate_limited"], stats["retried"]) == (1, 0)
+    assert limiter.in_flight == 0
@@ -0,0 +1,45 @@
+# loop_local.py
+import asyncio
+import threading
+import weakref
+
+
+_instances = weakref.WeakSet()
+
+
+class LoopLocal:
+    """Lazily creates one value per running event loop.
+
+    Async clients keep connection pools that are bound to the loop that created
+    them, and every task runs on its own loop, so they cannot be shared across
+    the whole process. Values are dropped together with their loop, closer is
+    awaited on them by aclose_loop_values before the loop shuts down.
+    """
+
+    def __init__(self, factory, closer=None):
+        self._factory = factory
+        self._closer = closer
+        self._values = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        _instances.add(self)
+
+    def get(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            value = self._values.get(loop)
+            if value is None:
+                value = self._values[loop] = self._factory()
+        return value
+
+    def pop(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            return self._values.pop(loop, None)
+
+
+async def aclose_loop_values():
+    """Close every value created for the running loop, call before closing the loop."""
+    for loop_local in list(_instances):
+        value = loop_local.pop()
+        if value is not None and loop_local._closer is not None:
+            await loop_local._closer(value)
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
@@ -5,7 +6,7 @@ import uuid
 from contextlib import asynccontextmanager
 from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import Session, sessionmaker
-from database import Base, engine, SessionLocal
+from database import Base, engine, SessionLocal, add_missing_columns
 import models
 from favorites_router import router as favorites_router
 from folders_router import router as folders_router
@@ -14,8 +15,16 @@ from vector_store import vector_store
 import os
 import json
 import schemas
-from services import favorite_service
+from services import favorite_service, RESUME_IMPORT_ON_STARTUP
 from task_queue import task_queue
+from fetch_cache import fetch_cache
+from http_client import fetch_limiter
+from llm import llm_service
+from folder_tree import folder_tree_cache
+from tag_suggester import tag_suggester
+from domain_affinity import domain_affinity
+from tag_resolver import tag_resolver
+from url_utils import backfill_canonical_urls
 from fastapi.templating import Jinja2Templates
 
 templates = Jinja2Templates(directory="templates")
@@ -35,6 +44,10 @@ def clear_tables():
                 session.execute(text(f"DELETE FROM {table}"))
                 logger.info(f"Cleared table: {table}")
         session.commit()
+    folder_tree_cache.invalidate()
+    tag_resolver.invalidate()
+    if domain_affinity is not None:
+        domain_affinity.clear()
 
     logger.info("Cleared all non-embedding tables.")
     Base.metadata.create_all(engine)
@@ -55,27 +68,31 @@ def create_folder_structure(session, structure, parent=None):
 
 def check_running_tasks():
     tasks = task_queue.get_all_tasks()
-    running_tasks = [task for task in tasks if task["status"] == "processing"]
+    running_tasks = [task for task in tasks if task["status"] in ("pending", "processing")]
     return len(running_tasks) > 0
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Clear the tasks table and handle unprocessed favorites
-    db = SessionLocal()
+    # Startup: Tasks that were running died with the previous process and are
+    # queued again, the favorites they did not get to are still pending in the
+    # staging table
     try:
-        # Clear all tasks
-        db.query(models.Task).delete()
-        db.commit() 
+        requeued, failed = task_queue.recover_interrupted_tasks()
+        if requeued or failed:
+            logger.info(f"Queued {requeued} interrupted tasks again, marked {failed} without a handler as failed")
+        if RESUME_IMPORT_ON_STARTUP:
+            favorite_service.resume_import("Resume Import Favorites")
     except Exception as e:
         logger.error(f"Error during startup: {str(e)}")
-        db.rollback()
-    finally:
-        db.close()
+
+    if domain_affinity is not None:
+        domain_affinity.rebuild(engine)
+    task_queue.start()
     
     yield  # This is where the app runs
     
-    # Shutdown: Add any cleanup code here if needed
-    pass
+    # Shutdown: Let running tasks finish, the pending ones stay queued for the next start
+    await asyncio.to_thread(task_queue.shutdown)
 
 def create_application() -> FastAPI:
     application = FastAPI(
@@ -101,6 +118,23 @@ def create_application() -> FastAPI:
 
     # Initialize database
     Base.metadata.create_all(bind=engine)
+    add_missing_columns("favorites", {
+        "needs_refinement": "BOOLEAN NOT NULL DEFAULT 0",
+        "enrichment_state": "VARCHAR NOT NULL DEFAULT 'enriched'",
+        "canonical_url": "VARCHAR",
+    })
+    add_missing_columns("favorites_to_process", {
+        "favorite_id": "INTEGER",
+        "canonical_url": "VARCHAR",
+        "outcome": "VARCHAR",
+        "attempts": "INTEGER NOT NULL DEFAULT 0",
+        "last_error": "TEXT",
+        "lease_owner": "VARCHAR",
+        "lease_expires_at": "DATETIME",
+        "next_attempt_at": "DATETIME",
+        "enrichment": "JSON",
+    })
+    backfill_canonical_urls(engine)
 
     # Include routers
     application.include_router(favorites_router, prefix="/api/favorites", tags=["favorites"])
@@ -130,6 +164,7 @@ async def reset_database():
                 folder_structure = json.load(f)
             create_folder_structure(session, folder_structure)
             session.commit()
+            folder_tree_cache.invalidate()
         
         return {"message": "Database reset successful"}
     except Exception as e:
@@ -153,6 +188,7 @@ async def reindex_database(db: Session = Depends(SessionLocal)):
             folder_structure = json.load(f)
         create_folder_structure(db, folder_structure)
         db.commit()
+        folder_tree_cache.invalidate()
         
         # Prepare favorites for reindexing
         favorites_to_import = []
@@ -170,13 +206,51 @@ async def reindex_database(db: Session = Depends(SessionLocal)):
         
         # Use import_favorites function to reindex
         task_name = f"Reindex Favorites: {len(favorites_to_import)} items"
-        result = favorite_service.import_favorites(favorites_to_import, task_name)
+        result = await favorite_service.import_favorites(favorites_to_import, task_name)
         
         return {"message": f"Database reindexing started with {len(favorites_to_import)} favorites", "task_id": result["task_id"]}
     except Exception as e:
         logger.error(f"Error reindexing database: {str(e)}")
         raise HTTPException(status_code=500, detail="Error reindexing database")
 
+@app.get("/api/stats/fetch-cache", tags=["root"])
+async def fetch_cache_stats():
+    if fetch_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **fetch_cache.stats()}
+
+@app.get("/api/stats/fetch-limiter", tags=["root"])
+async def fetch_limiter_stats():
+    return fetch_limiter.stats()
+
+@app.get("/api/stats/llm-cache", tags=["root"])
+async def llm_cache_stats():
+    if llm_service.cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **llm_service.cache.stats()}
+
+@app.get("/api/stats/llm-limiter", tags=["root"])
+async def llm_limiter_stats():
+    if llm_service.limiter is None:
+        return {"enabled": False}
+    return {"enabled": True, **llm_service.limiter.stats()}
+
+@app.get("/api/stats/tag-suggester", tags=["root"])
+async def tag_suggester_stats():
+    if tag_suggester is None:
+        return {"enabled": False}
+    return {"enabled": True, **tag_suggester.stats()}
+
+@app.get("/api/stats/task-queue", tags=["root"])
+async def task_queue_stats():
+    return await asyncio.to_thread(task_queue.stats)
+
+@app.get("/api/stats/domain-affinity", tags=["root"])
+async def domain_affinity_stats():
+    if domain_affinity is None:
+        return {"enabled": False}
+    return {"enabled": True, **domain_affinity.stats()}
+
 if __name__ == "__main__":
     import uvicorn
     logger.info("Starting the Intelligent Favorites Extension API")
@@ -0,0 +1,211 @@
+from abc import ABC, abstractmethod
+from html.parser import HTMLParser
+import logging
+import re
+
+from bs4 import BeautifulSoup
+
+logger = logging.getLogger(__name__)
+
+META_NAMES = ['description', 'keywords']
+META_PROPERTIES = ['og:title', 'og:description', 'og:image', 'og:url', 'og:type']
+
+# Elements without content or an end tag, as BeautifulSoup's html.parser builder knows them
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link',
+                 'menuitem', 'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound',
+                 'command', 'frame', 'image', 'isindex', 'nextid', 'spacer'}
+# Elements a title sits in, their end tag closes an unterminated title
+TITLE_ANCESTORS = {'head', 'html', 'body'}
+
+_BODY_START = re.compile(r'<body[\s>]', re.I)
+_META_OR_TITLE = re.compile(r'<(?:meta|title)[\s/>]', re.I)
+
+
+def add_tags(meta_info):
+    # Extracting tags (keywords)
+    if 'keywords' in meta_info:
+        meta_info['tags'] = [tag.strip() for tag in meta_info['keywords'].split(',')]
+    return meta_info
+
+
+def collect_meta(meta_info, attrs):
+    """Copy a <meta> tag's content into meta_info when it is one we keep."""
+    content = attrs.get('content')
+    if content is None:
+        return
+    if 'name' in attrs:
+        name = attrs['name'].lower()
+        if name in META_NAMES:
+            meta_info[name] = content
+    elif 'property' in attrs:
+        property_name = attrs['property'].lower()
+        if property_name in META_PROPERTIES:
+            meta_info[property_name] = content
+
+
+class MetaParser(ABC):
+    """Extracts the title, description, keywords and og:* tags of an HTML page."""
+
+    name = None
+
+    @abstractmethod
+    def parse(self, html: str) -> dict:
+        pass
+
+
+class BeautifulSoupMetaParser(MetaParser):
+    name = 'bs4'
+
+    def parse(self, html: str) -> dict:
+        soup = BeautifulSoup(html, 'html.parser')
+        meta_info = {}
+
+        # Extracting title
+        if soup.title:
+            meta_info['title'] = soup.title.string
+
+        # Extracting meta tags
+        for meta in soup.find_all('meta'):
+            collect_meta(meta_info, meta.attrs)
+
+        return add_tags(meta_info)
+
+
+class _TitleComment(str):
+    """A comment in the title, kept apart from the text around it like BeautifulSoup does."""
+
+
+def _tag_string(children):
+    # Same as BeautifulSoup's Tag.string: the only child's string, None for none or several
+    if len(children) != 1:
+        return None
+    child = children[0]
+    return str(child) if isinstance(child, str) else _tag_string(child[1])
+
+
+class _MetaEventHandler(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.meta_info = {}
+        # Open elements from the title down, as (tag, children) with children holding
+        # strings and further (tag, children) pairs
+        self.title_stack = None
+        self.title_done = False
+
+    @property
+    def title_open(self) -> bool:
+        return self.title_stack is not None and not self.title_done
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'meta':
+            # Attributes without a value come through as None, BeautifulSoup uses ''
+            collect_meta(self.meta_info, {key: value or '' for key, value in attrs})
+        if self.title_open:
+            node = (tag, [])
+            self.title_stack[-1][1].append(node)
+            if tag not in VOID_ELEMENTS:
+                self.title_stack.append(node)
+        elif tag == 'title' and self.title_stack is None:
+            self.title_stack = [(tag, [])]
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if not self.title_open:
+            return
+        for index in range(len(self.title_stack) - 1, -1, -1):
+            if self.title_stack[index][0] == tag:
+                del self.title_stack[index + 1:]
+                if index == 0:
+                    self.finish_title()
+                else:
+                    self.title_stack.pop()
+                return
+        # The end of an element around the title closes the title as well,
+        # other stray end tags are ignored
+        if tag in TITLE_ANCESTORS:
+            self.finish_title()
+
+    def handle_data(self, data):
+        if self.title_open:
+            children = self.title_stack[-1][1]
+            if children and type(children[-1]) is str:
+                children[-1] += data
+            else:
+                children.append(data)
+
+    def handle_comment(self, data):
+        if self.title_open:
+            self.title_stack[-1][1].append(_TitleComment(data))
+
+    def finish_title(self):
+        self.title_done = True
+        self.meta_info['title'] = _tag_string(self.title_stack[0][1])
+
+
+class StreamingMetaParser(MetaParser):
+    """Event based parser that keeps only the tags it needs instead of building a tree.
+
+    The body is only tokenized when it contains <meta> or <title> tags, which a
+    regex finds far quicker than the parser can skip over the markup.
+    """
+
+    name = 'streaming'
+
+    def parse(self, html: str) -> dict:
+        body = _BODY_START.search(html)
+        if body and not _META_OR_TITLE.search(html, body.start()):
+            handler = self._feed(html[:body.start()])
+            # An unterminated title would have run on into the body
+            if handler.title_open:
+                handler = self._feed(html)
+        else:
+            handler = self._feed(html)
+        if handler.title_open:
+            handler.finish_title()
+        # Keep the key order of the BeautifulSoup backend, title first
+        meta_info = {}
+        if 'title' in handler.meta_info:
+            meta_info['title'] = handler.meta_info.pop('title')
+        meta_info.update(handler.meta_info)
+        return add_tags(meta_info)
+
+    def _feed(self, html: str) -> _MetaEventHandler:
+        handler = _MetaEventHandler()
+        handler.feed(html)
+        handler.close()
+        return handler
+
+
+class FallbackMetaParser(MetaParser):
+    """Uses the primary parser and falls back to another one when it raises."""
+
+    def __init__(self, primary: MetaParser, fallback: MetaParser):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = primary.name
+
+    def parse(self, html: str) -> dict:
+        try:
+            return self.primary.parse(html)
+        except Exception as e:
+            logger.warning(f"{self.primary.name} meta parser failed, falling back to {self.fallback.name}: {str(e)}")
+            return self.fallback.parse(html)
+
+
+PARSERS = {
+    'streaming': StreamingMetaParser,
+    'bs4': BeautifulSoupMetaParser,
+}
+
+
+def get_meta_parser(name: str) -> MetaParser:
+    if name not in PARSERS:
+        raise ValueError(f"Unknown meta parser '{name}', expected one of: {', '.join(PARSERS)}")
+    parser = PARSERS[name]()
+    if name == 'bs4':
+        return parser
+    return FallbackMetaParser(parser, BeautifulSoupMetaParser())
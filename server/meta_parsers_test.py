@@ -0,0 +1,60 @@
+import pytest
+
+from meta_parsers import BeautifulSoupMetaParser, FallbackMetaParser, MetaParser, StreamingMetaParser, get_meta_parser
+
+PAGES = [
+    '<html><head><title>Fish &amp; Chips</title>'
+    '<meta name="Description" content="Where to eat">'
+    '<meta name="keywords" content="food, uk ,fish">'
+    '<meta property="og:title" content="Fish">'
+    '<meta property="og:site_name" content="Ignored">'
+    '</head><body><p>Menu</p></body></html>',
+    # Meta tags in the body are kept as well
+    '<html><head><title>Body meta</title></head><body><meta name="description" content="Late"></body></html>',
+    # An unterminated title ends with the head, or runs on into the body without one
+    '<html><head><title>Runaway</head><body><p>Text</p></body></html>',
+    '<html><head><title>Runaway<body><p>Text</p></body></html>',
+    '<html><head><title><b>Bold</b></title></head><body></body></html>',
+    '<html><head><title><b><i>Nested</i></b></p></title></head></html>',
+    '<html><head><title>Two<br>lines</title></head></html>',
+    '<html><head><title> <b>Spaced</b></title></head></html>',
+    '<html><head><title><!-- draft --></title></head></html>',
+    '<html><head><title>Text<!-- draft --></title></head></html>',
+    '<html><head><title></title><meta name="description"></head><body></body></html>',
+    '<HTML><HEAD><TITLE>Upper</TITLE><META NAME="DESCRIPTION" CONTENT="Shouting"></HEAD></HTML>',
+    '<meta property="og:description" content="No head at all">',
+    '',
+]
+
+
+@pytest.mark.parametrize("html", PAGES)
+def test_streaming_parser_matches_beautifulsoup(html):
+    assert StreamingMetaParser().parse(html) == BeautifulSoupMetaParser().parse(html)
+
+
+def test_streaming_parser_extracts_meta_information():
+    assert StreamingMetaParser().parse(PAGES[0]) == {
+        "title": "Fish & Chips",
+        "description": "Where to eat",
+        "keywords": "food, uk ,fish",
+        "og:title": "Fish",
+        "tags": ["food", "uk", "fish"],
+    }
+
+
+def test_fallback_parser_uses_fallback_when_primary_raises():
+    class Broken(MetaParser):
+        name = "broken"
+
+        def parse(self, html):
+            raise AssertionError("unexpected markup")
+
+    parser = FallbackMetaParser(Broken(), BeautifulSoupMetaParser())
+    assert parser.parse(PAGES[1]) == {"title": "Body meta", "description": "Late"}
+
+
+def test_get_meta_parser():
+    assert isinstance(get_meta_parser("bs4"), BeautifulSoupMetaParser)
+    assert get_meta_parser("streaming").name == "streaming"
+    with pytest.raises(ValueError):
+        get_meta_parser("lxml")
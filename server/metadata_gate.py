@@ -0,0 +1,73 @@
+# metadata_gate.py
+import html
+import logging
+import os
+import re
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Derive summaries from page metadata when it is good enough instead of asking the LLM
+ENABLED = os.environ.get('METADATA_GATE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+MIN_DESCRIPTION_CHARS = int(os.environ.get('METADATA_GATE_MIN_CHARS', '80'))
+MAX_DESCRIPTION_CHARS = int(os.environ.get('METADATA_GATE_MAX_CHARS', '600'))
+MIN_DESCRIPTION_WORDS = int(os.environ.get('METADATA_GATE_MIN_WORDS', '12'))
+# Keywords are used as tags when at least this many usable ones are present
+MIN_KEYWORD_TAGS = int(os.environ.get('METADATA_GATE_MIN_TAGS', '3'))
+MAX_KEYWORD_TAGS = 5
+MAX_TAG_WORDS = 3
+MAX_TAG_CHARS = 30
+
+# Descriptions that describe the site's plumbing rather than the page
+BOILERPLATE = re.compile(
+    r"\b(cookies?|javascript|enable js|sign in|log in|login|subscribe|page not found|404|"
+    r"access denied|just a moment|captcha|are you a robot|all rights reserved)\b",
+    re.I,
+)
+
+
+def clean_text(value) -> str:
+    return re.sub(r"\s+", " ", html.unescape(str(value or ""))).strip()
+
+
+def description_of(meta_info: dict) -> str:
+    return clean_text(meta_info.get('og:description') or meta_info.get('description'))
+
+
+def summary_from_metadata(meta_info: Optional[dict]) -> Optional[str]:
+    """The page's own description when it reads like a summary, otherwise None."""
+    if not meta_info:
+        return None
+    description = description_of(meta_info)
+    if not MIN_DESCRIPTION_CHARS <= len(description) <= MAX_DESCRIPTION_CHARS:
+        return None
+    if len(description.split()) < MIN_DESCRIPTION_WORDS:
+        return None
+    if BOILERPLATE.search(description):
+        return None
+    letters = sum(1 for char in description if char.isalpha())
+    if letters < 0.6 * len(description):
+        return None
+    title = clean_text(meta_info.get('og:title') or meta_info.get('title'))
+    if description.lower() == title.lower():
+        return None
+    return description if description[-1] in ".!?" else f"{description}."
+
+
+def tags_from_metadata(meta_info: Optional[dict]) -> Optional[List[str]]:
+    """Up to five of the page's keywords when enough of them look like tags, otherwise None."""
+    if not meta_info:
+        return None
+    tags = []
+    seen = set()
+    for keyword in meta_info.get('tags') or []:
+        keyword = clean_text(keyword)
+        if not keyword or len(keyword) > MAX_TAG_CHARS or len(keyword.split()) > MAX_TAG_WORDS:
+            continue
+        if keyword.lower() in seen:
+            continue
+        seen.add(keyword.lower())
+        tags.append(keyword)
+    if len(tags) < MIN_KEYWORD_TAGS:
+        return None
+    return tags[:MAX_KEYWORD_TAGS]
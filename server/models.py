@@ -3,6 +3,20 @@ from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from sqlalchemy.sql import func
 from database import Base
+from url_utils import canonical_url
+
+# Values of Favorite.enrichment_state. Pending favorites have only what was
+# provided with them, summary, tags, folder and embedding are added later.
+ENRICHMENT_PENDING = 'pending'
+ENRICHMENT_DONE = 'enriched'
+ENRICHMENT_FAILED = 'failed'
+
+# Values of FavoriteToProcess.outcome once the row is processed
+STAGING_DONE = 'done'
+STAGING_FAILED = 'failed'
+
+def canonical_url_default(context):
+    return canonical_url(context.get_current_parameters()['url'])
 
 # Association table for many-to-many relationship between Favorite and Tag
 favorite_tags = Table('favorite_tags', Base.metadata,
@@ -29,9 +43,14 @@ class Favorite(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     url = Column(String, nullable=False)
+    # Derived from url on insert, NULL only for duplicates that predate the column
+    canonical_url = Column(String, unique=True, index=True, default=canonical_url_default)
     title = Column(String)
     summary = Column(Text)
     folder_id = Column(Integer, ForeignKey('folders.id'))
+    # Summary and tags were taken from the page's metadata and can be refined by the LLM
+    needs_refinement = Column(Boolean, nullable=False, default=False, server_default='0')
+    enrichment_state = Column(String, nullable=False, default=ENRICHMENT_DONE, server_default=ENRICHMENT_DONE)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
@@ -51,9 +70,23 @@ class FavoriteToProcess(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     url = Column(String, nullable=False)
+    canonical_url = Column(String, index=True, default=canonical_url_default)
     title = Column(String)
     metainfo = Column(String)
+    # The pending favorite this row enriches, None when the favorite is created on write
+    favorite_id = Column(Integer)
     processed = Column(Boolean, default=False)
+    # STAGING_DONE or STAGING_FAILED once processed, last_error holds the error of the last attempt
+    outcome = Column(String)
+    attempts = Column(Integer, nullable=False, default=0, server_default='0')
+    last_error = Column(Text)
+    # The worker processing the row, the row can be claimed again once the lease expires
+    lease_owner = Column(String)
+    lease_expires_at = Column(DateTime)
+    # A failed row waits until then for its next attempt
+    next_attempt_at = Column(DateTime)
+    # Summary, tags and folder from an earlier attempt, a retry only repeats the write
+    enrichment = Column(JSON(none_as_null=True))
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
@@ -65,5 +98,14 @@ class Task(Base):
     status = Column(String, nullable=False)
     progress = Column(String, nullable=False)
     result = Column(Text)
+    # Name of the registered task function and its JSON arguments, see TaskQueue
+    handler = Column(String)
+    payload = Column(JSON)
+    # Lane of the task, see lanes.py, and the matching priority: pending tasks
+    # of higher priority run first, FIFO within a priority
+    lane = Column(String, nullable=False, default='bulk', server_default='bulk')
+    priority = Column(Integer, nullable=False, default=0, server_default='0')
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
\ No newline at end of file
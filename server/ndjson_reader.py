@@ -0,0 +1,76 @@
+# ndjson_reader.py
+import os
+import zlib
+from typing import AsyncIterator, Iterator, Optional, Tuple
+
+GZIP_MAGIC = b"\x1f\x8b"
+# Longer lines are rejected instead of buffered, a favorite never needs this much
+MAX_LINE_BYTES = 1024 * 1024
+# Gzipped bodies that inflate to more than this are rejected
+MAX_DECOMPRESSED_BYTES = int(os.environ.get('NDJSON_MAX_DECOMPRESSED_BYTES', str(1024 * 1024 * 1024)))
+# Gzip data is inflated this many bytes at a time
+INFLATE_CHUNK_BYTES = 64 * 1024
+
+
+class NDJSONError(ValueError):
+    pass
+
+
+def _inflate(decompressor, data: bytes) -> Iterator[bytes]:
+    """Inflate data in pieces of at most INFLATE_CHUNK_BYTES, so a small gzip bomb never inflates at once."""
+    while True:
+        try:
+            piece = decompressor.decompress(data, INFLATE_CHUNK_BYTES)
+        except zlib.error as e:
+            raise NDJSONError(f"Invalid gzip data: {str(e)}")
+        data = decompressor.unconsumed_tail
+        if piece:
+            yield piece
+        # A full piece may leave output pending without input left
+        if not data and len(piece) < INFLATE_CHUNK_BYTES:
+            return
+
+
+async def iter_ndjson_lines(chunks: AsyncIterator[bytes], gzipped: Optional[bool] = None,
+                            max_decompressed: int = MAX_DECOMPRESSED_BYTES) -> AsyncIterator[Tuple[int, bytes]]:
+    """Yield (line number, line) for the non-empty lines of a newline delimited byte stream.
+
+    gzipped None detects gzip from the first bytes. Only one line and one
+    chunk of the stream are held in memory at a time, gzipped streams that
+    inflate to more than max_decompressed bytes are rejected.
+    """
+    decompressor = None
+    buffer = b""
+    line_number = 0
+    inflated = 0
+    first = True
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        if first:
+            first = False
+            if gzipped or (gzipped is None and chunk.startswith(GZIP_MAGIC)):
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        pieces = [chunk] if decompressor is None else _inflate(decompressor, chunk)
+        for piece in pieces:
+            if decompressor is not None:
+                inflated += len(piece)
+                if inflated > max_decompressed:
+                    raise NDJSONError(f"The body inflates to more than {max_decompressed} bytes")
+            buffer += piece
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                line_number += 1
+                if line.strip():
+                    yield line_number, line
+            if len(buffer) > MAX_LINE_BYTES:
+                raise NDJSONError(f"Line {line_number + 1} is longer than {MAX_LINE_BYTES} bytes")
+
+    if decompressor is not None:
+        buffer += decompressor.flush()
+        if not decompressor.eof:
+            raise NDJSONError("Truncated gzip data")
+    for line in buffer.split(b"\n"):
+        line_number += 1
+        if line.strip():
+            yield line_number, line
@@ -52,6 +52,8 @@ class FavoriteUpdate(BaseModel):
 class Favorite(FavoriteBase):
     id: int
     folder_id: Optional[int]
+    needs_refinement: bool = False
+    enrichment_state: str = "enriched"
     created_at: datetime
     updated_at: datetime
     tags: List[Tag] = []
@@ -84,4 +86,12 @@ class FavoriteImport(BaseModel):
     title: str
     metadata: Optional[str] = None
 
+class StreamImportResult(BaseModel):
+    task_id: Optional[str] = None
+    accepted: int
+    # Accepted favorites skipped because their URL is already known
+    duplicates: int = 0
+    rejected: int
+    errors: List[str] = []
+
 FolderWithChildren.model_rebuild()
\ No newline at end of file
@@ -1,21 +1,21 @@
 # services.py
-from sqlalchemy import func, case
+from sqlalchemy import func, case, select, insert, update
 from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
+from pydantic import ValidationError
 import models, schemas
 from typing import List, Optional
-import requests
 from bs4 import BeautifulSoup
 import logging
-from threading import Thread
 import re
 from typing import Union
 from task_queue import task_queue
+from lanes import LANE_INTERACTIVE, LANE_MAINTENANCE
 from database import SessionLocal, engine
 import asyncio
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import random
+import threading
 from urllib.parse import urlparse
 from llm import llm_service
 from rich import print as rprint
@@ -23,15 +23,44 @@ import builtins
 import json
 from jinja2 import Environment, FileSystemLoader
 import os
+from datetime import datetime, timezone
 from content_extractor import ContentExtractor
 from typing import List
 import math
 from vector_store import vector_store
+from import_checkpoints import import_checkpoints
+from import_pipeline import ImportPipeline
+from host_scheduler import host_scheduler, MAX_RETRY_AFTER
+from http_client import http_client, FetchError, FetchStatusError
+from fetch_cache import fetch_cache
+from folder_tree import FolderTree, folder_tree_cache, format_folder_lines
+from folder_index import folder_index
+from tag_suggester import tag_suggester
+from domain_affinity import domain_affinity
+from tag_resolver import tag_resolver
+from ndjson_reader import iter_ndjson_lines
+from url_utils import canonical_url
+import metadata_gate
 
 builtins.print = rprint
 
 logger = logging.getLogger(__name__)
 
+# 'combined' asks for summary, tags and folder in one prompt, 'separate' uses one prompt each
+ENRICH_MODE = os.environ.get('LLM_ENRICH_MODE', 'combined')
+# Write favorites right away and add summary, tags, folder and embedding in the background
+LAZY_ENRICHMENT = os.environ.get('LAZY_ENRICHMENT', 'false').lower() in ('1', 'true', 'yes')
+# Number of URLs or tag names per IN (...) query of the bulk save
+BULK_QUERY_SIZE = 500
+# Rows per executemany insert into the staging table
+STAGING_CHUNK_SIZE = int(os.environ.get('IMPORT_STAGING_CHUNK_SIZE', '1000'))
+# Invalid lines of a streamed import reported back, the rest are only counted
+MAX_REPORTED_ERRORS = 20
+# Refine favorites summarized from their metadata with the LLM once an import finishes
+REFINE_AFTER_IMPORT = os.environ.get('REFINE_AFTER_IMPORT', 'true').lower() in ('1', 'true', 'yes')
+# Continue imports a previous run of the server left unfinished when it starts
+RESUME_IMPORT_ON_STARTUP = os.environ.get('RESUME_IMPORT_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes')
+
 
 class FavoriteService:
     async def create_favorite_task(self, task_id: str, favorite_data: dict):
@@ -39,75 +68,47 @@ class FavoriteService:
         try:
             favorite = schemas.FavoriteCreate(**favorite_data)
             
-            task_queue._update_task(task_id, "processing", 10, None)
+            task_queue.update_progress(task_id, 10)
+            needs_refinement = False
+            # Summary, tags and folder from one LLM call when none of them is provided
+            if not (favorite.summary or favorite.tags or favorite.folder_id):
+                enrichment = await nlp_service.enrich_url(db, str(favorite.url), favorite.metadata)
+                favorite.summary = enrichment["summary"]
+                favorite.tags = enrichment["tags"]
+                favorite.folder_id = enrichment["folder_id"]
+                needs_refinement = enrichment.get("needs_refinement", False)
+
             # Generate summary if not provided
             if not favorite.summary:
                 favorite.summary = await nlp_service.summarize_content(str(favorite.url), favorite.metadata)
             
-            task_queue._update_task(task_id, "processing", 40, None)
+            task_queue.update_progress(task_id, 40)
             # Suggest tags if not provided
             if not favorite.tags:
                 favorite.tags = await nlp_service.suggest_tags(favorite.summary, favorite.metadata)
             
-            task_queue._update_task(task_id, "processing", 70, None)
+            task_queue.update_progress(task_id, 70)
             # Suggest folder if not provided
             if not favorite.folder_id:
-                favorite.folder_id = await nlp_service.suggest_folder(db, favorite.summary, favorite.metadata)
+                favorite.folder_id = await nlp_service.suggest_folder(
+                    db, favorite.summary, favorite.metadata, url=str(favorite.url)
+                )
             
-            # Prepare the favorite data
-            favorite_data = {
-                "url": str(favorite.url),
-                "title": favorite.title,
-                "summary": favorite.summary,
-                "folder_id": favorite.folder_id
-            }
-
-            # Try to get existing favorite or create a new one
-            db_favorite = db.query(models.Favorite).filter(models.Favorite.url == str(favorite.url)).first()
-            if db_favorite:
-                # Update existing favorite
-                for key, value in favorite_data.items():
-                    setattr(db_favorite, key, value)
-            else:
-                # Create new favorite
-                db_favorite = models.Favorite(**favorite_data)
-                db.add(db_favorite)
-
-            db.flush()
-
-            for tag_name in favorite.tags:
-                tag = db.query(models.Tag).filter(models.Tag.name == tag_name).first()
-                if not tag:
-                    tag = models.Tag(name=tag_name)
-                    db.add(tag)
-                    db.flush()
-                db_favorite.tags.append(tag)
-
-            db.commit()
-
-            # Add or update the favorite in the vector store
-            vector_store.add_favorite(db_favorite.id, db_favorite.url, db_favorite.title, db_favorite.summary)
-
+            db_favorite = self.save_favorites(db, [favorite], needs_refinement=needs_refinement)[0]
             return db_favorite.id
         except Exception as e:
             logger.error(f"Error creating favorite: {str(e)}")
             db.rollback()
+            # A favorite written up front by the lazy mode stays, marked as failed
+            db.query(models.Favorite).filter(
+                models.Favorite.canonical_url == canonical_url(str(favorite_data["url"])),
+                models.Favorite.enrichment_state == models.ENRICHMENT_PENDING,
+            ).update({"enrichment_state": models.ENRICHMENT_FAILED})
+            db.commit()
             raise
         finally:
             db.close()
 
-    def _run_task_wrapper(self, task_id, task_func):
-        try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            result = loop.run_until_complete(task_func(task_id))
-            task_queue._update_task(task_id, "completed", "100", result)
-        except Exception as e:
-            logger.error(f"Error in _run_task_wrapper: {str(e)}", exc_info=True)
-            task_queue._update_task(task_id, "failed", "0", str(e))
-        finally:
-            loop.close()
-
     def get_favorites_by_ids(self, db: Session, favorite_ids: List[int]) -> List[models.Favorite]:
         # Create a case statement for ordering
         # Use negative index to reverse the order
@@ -124,11 +125,134 @@ class FavoriteService:
         
         return favorites
 
+    @staticmethod
+    def is_fully_specified(favorite: schemas.FavoriteCreate) -> bool:
+        """Whether the favorite comes with everything the LLM would otherwise be asked for."""
+        return bool(favorite.summary and favorite.tags and favorite.folder_id)
+
+    def save_favorites(
+        self, db: Session, favorites: List[schemas.FavoriteCreate], needs_refinement: bool = False
+    ) -> List[models.Favorite]:
+        """Insert or update (by canonical URL) favorites whose summary, tags and folder are known, in one transaction.
+
+        Favorites, tags and their links are written with executemany statements and
+        the vector store in one batch after the commit. The favorites are returned
+        in the order given, a URL given twice is saved once.
+        """
+        by_url = {canonical_url(str(favorite.url)): favorite for favorite in favorites}
+        urls = list(by_url)
+        now = datetime.now(timezone.utc)
+
+        def chunks(values):
+            for i in range(0, len(values), BULK_QUERY_SIZE):
+                yield values[i:i + BULK_QUERY_SIZE]
+
+        existing_ids, old_folder_ids = {}, {}
+        for chunk in chunks(urls):
+            for url, favorite_id, folder_id in db.execute(
+                select(models.Favorite.canonical_url, models.Favorite.id, models.Favorite.folder_id)
+                .where(models.Favorite.canonical_url.in_(chunk))
+            ):
+                existing_ids[url], old_folder_ids[url] = favorite_id, folder_id
+
+        def values(favorite):
+            return {
+                "url": str(favorite.url),
+                "title": favorite.title,
+                "summary": favorite.summary,
+                "folder_id": favorite.folder_id,
+                "needs_refinement": needs_refinement,
+                "enrichment_state": models.ENRICHMENT_DONE,
+                "updated_at": now,
+            }
+
+        new_urls = [url for url in urls if url not in existing_ids]
+        if new_urls:
+            db.execute(insert(models.Favorite), [
+                {"created_at": now, **values(by_url[url])} for url in new_urls
+            ])
+        if existing_ids:
+            db.execute(update(models.Favorite), [
+                {"id": existing_ids[url], **values(by_url[url])} for url in existing_ids
+            ])
+        ids = dict(existing_ids)
+        for chunk in chunks(new_urls):
+            ids.update(db.execute(
+                select(models.Favorite.canonical_url, models.Favorite.id).where(models.Favorite.canonical_url.in_(chunk))
+            ).all())
+
+        tag_resolver.set_tags(db, {ids[url]: favorite.tags or [] for url, favorite in by_url.items()})
+        db.commit()
+
+        if domain_affinity is not None:
+            for url, favorite in by_url.items():
+                domain_affinity.record(str(favorite.url), old_folder_ids.get(url), favorite.folder_id)
+
+        # Add or update the favorites in the vector store
+        try:
+            vector_store.add_favorites([
+                (ids[url], str(favorite.url), favorite.title, favorite.summary) for url, favorite in by_url.items()
+            ])
+        except Exception as e:
+            # The favorites are committed, only the vector store write failed
+            logger.error(f"Error adding {len(by_url)} favorites to the vector store: {str(e)}")
+
+        loaded = {}
+        for chunk in chunks(list(ids.values())):
+            for db_favorite in (
+                db.query(models.Favorite)
+                .options(joinedload(models.Favorite.tags))
+                .filter(models.Favorite.id.in_(chunk))
+            ):
+                loaded[db_favorite.id] = db_favorite
+        return [loaded[ids[url]] for url in urls]
+
+    def create_favorites(self, db: Session, favorites: List[schemas.FavoriteCreate]) -> List[models.Favorite]:
+        incomplete = [str(favorite.url) for favorite in favorites if not self.is_fully_specified(favorite)]
+        if incomplete:
+            raise ValueError(f"Summary, tags and folder_id are required, missing for: {', '.join(incomplete[:10])}")
+        return self.save_favorites(db, favorites)
+
     def create_favorite(self, favorite: schemas.FavoriteCreate, task_name: str):
+        result = {}
+        if LAZY_ENRICHMENT:
+            result["favorite_id"] = str(self.create_pending_favorite(favorite))
         task_id = task_queue.add_task(
-            self.create_favorite_task, task_name, favorite.dict()
+            self.create_favorite_task, task_name, favorite.model_dump(mode="json"), lane=LANE_INTERACTIVE
         )
-        return {"task_id": task_id}
+        result["task_id"] = task_id
+        return result
+
+    def create_pending_favorite(self, favorite: schemas.FavoriteCreate) -> int:
+        """Write the favorite as provided so it can be listed and searched before it is enriched.
+
+        create_favorite_task finds the row by its canonical URL and fills in the rest.
+        An existing favorite of the same canonical URL is left as it is until then.
+        """
+        key = canonical_url(str(favorite.url))
+        with SessionLocal() as db:
+            db_favorite = db.query(models.Favorite).filter(models.Favorite.canonical_url == key).first()
+            if db_favorite:
+                return db_favorite.id
+            db_favorite = models.Favorite(
+                url=str(favorite.url),
+                title=favorite.title,
+                summary=favorite.summary,
+                folder_id=favorite.folder_id,
+                enrichment_state=models.ENRICHMENT_PENDING,
+            )
+            db.add(db_favorite)
+            try:
+                db.commit()
+            except IntegrityError:
+                # Another request saved the same canonical URL since the lookup
+                db.rollback()
+                db_favorite = db.query(models.Favorite).filter(models.Favorite.canonical_url == key).first()
+                if db_favorite is None:
+                    raise
+                return db_favorite.id
+            vector_store.index_text(db_favorite.id, db_favorite.url, db_favorite.title, db_favorite.summary)
+            return db_favorite.id
 
     def get_favorite(self, db: Session, favorite_id: int) -> Optional[models.Favorite]:
         return (
@@ -136,9 +260,12 @@ class FavoriteService:
         )
 
     def get_favorites(
-        self, db: Session, skip: int = 0, limit: int = 100
+        self, db: Session, skip: int = 0, limit: int = 100, enrichment_state: Optional[str] = None
     ) -> List[models.Favorite]:
-        return db.query(models.Favorite).offset(skip).limit(limit).all()
+        query = db.query(models.Favorite)
+        if enrichment_state:
+            query = query.filter(models.Favorite.enrichment_state == enrichment_state)
+        return query.offset(skip).limit(limit).all()
 
     def update_favorite(
         self, db: Session, favorite_id: int, favorite: schemas.FavoriteUpdate
@@ -147,30 +274,31 @@ class FavoriteService:
             db.query(models.Favorite).filter(models.Favorite.id == favorite_id).first()
         )
         if db_favorite:
+            old_url, old_folder_id = db_favorite.url, db_favorite.folder_id
             update_data = favorite.model_dump(exclude_unset=True)
             
             # Handle tags separately
             if 'tags' in update_data:
-                new_tags = update_data.pop('tags')
-                # Clear existing tags
-                db_favorite.tags.clear()
-                # Add new tags
-                for tag_name in new_tags:
-                    tag = db.query(models.Tag).filter(models.Tag.name == tag_name).first()
-                    if not tag:
-                        tag = models.Tag(name=tag_name)
-                        db.add(tag)
-                    db_favorite.tags.append(tag)
+                tag_resolver.set_tags(db, {db_favorite.id: update_data.pop('tags') or []})
             
             # Update other fields
             for key, value in update_data.items():
                 setattr(db_favorite, key, value)
+            # A summary or tags set by the user are not replaced by refinement
+            if 'summary' in update_data or favorite.tags is not None:
+                db_favorite.needs_refinement = False
             
             db.commit()
             db.refresh(db_favorite)
+            if domain_affinity is not None:
+                domain_affinity.record(old_url, old_folder_id, db_favorite.folder_id, new_url=db_favorite.url)
 
             # Update the favorite in the vector store
-            vector_store.update_favorite(db_favorite.id, db_favorite.url, db_favorite.title, db_favorite.summary)
+            try:
+                vector_store.update_favorite(db_favorite.id, db_favorite.url, db_favorite.title, db_favorite.summary)
+            except Exception as e:
+                # The favorite is committed, only the vector store write failed
+                logger.error(f"Error updating favorite {db_favorite.id} in the vector store: {str(e)}")
 
         return db_favorite
 
@@ -183,6 +311,8 @@ class FavoriteService:
         if db_favorite:
             db.delete(db_favorite)
             db.commit()
+            if domain_affinity is not None:
+                domain_affinity.record(db_favorite.url, db_favorite.folder_id, None)
 
             # Delete the favorite from the vector store
             vector_store.delete_favorite(favorite_id)
@@ -192,13 +322,15 @@ class FavoriteService:
     async def delete_all_favorites_task(self, task_id: str):
         db = SessionLocal()
         try:
-            task_queue._update_task(task_id, "processing", 10, None)
+            task_queue.update_progress(task_id, 10)
             
             # Delete all favorites
             db.query(models.Favorite).delete()
             db.commit()
+            if domain_affinity is not None:
+                domain_affinity.clear()
             
-            task_queue._update_task(task_id, "processing", 90, None)
+            task_queue.update_progress(task_id, 90)
             
             return "All favorites deleted successfully"
         except Exception as e:
@@ -214,74 +346,120 @@ class FavoriteService:
         )
         return {"task_id": task_id}
 
-    async def import_favorites_task(self, task_id: str, favorites: List[schemas.FavoriteImport]):
-        db = SessionLocal()
-        try:
-            total_favorites = len(favorites)
-            
-            # Store all favorites to process
-            for favorite in favorites:
-                db_favorite_to_process = models.FavoriteToProcess(
-                    url=str(favorite.url),
-                    title=favorite.title,
-                    metainfo=favorite.metadata
-                )
-                db.add(db_favorite_to_process)
-            db.commit()
-
-            # Process favorites
-            processed_count = 0
-            for favorite_to_process in db.query(models.FavoriteToProcess).filter(models.FavoriteToProcess.processed == False).all():
-                try:
-                    summary = await nlp_service.summarize_content(str(favorite_to_process.url), favorite_to_process.metainfo)
-                    suggested_tags = await nlp_service.suggest_tags(summary, favorite_to_process.metainfo)
-                    suggested_folder_id = await nlp_service.suggest_folder(db, summary, favorite_to_process.metainfo)
-                    
-                    db_favorite = models.Favorite(
-                        url=favorite_to_process.url,
-                        title=favorite_to_process.title,
-                        summary=summary,
-                        folder_id=suggested_folder_id
-                    )
-                    db.add(db_favorite)
-                    db.flush()
-
-                    for tag_name in suggested_tags:
-                        tag = db.query(models.Tag).filter(models.Tag.name == tag_name).first()
-                        if not tag:
-                            tag = models.Tag(name=tag_name)
-                            db.add(tag)
-                            db.flush()
-                        db_favorite.tags.append(tag)
+    async def import_staged_favorites_task(self, task_id: str, total_favorites: int):
+        # Failed favorites are retried, their outcome stays on the staging rows
+        await asyncio.to_thread(import_checkpoints.prune)
+        pipeline = ImportPipeline(nlp_service, task_id)
+        report = await pipeline.run(total_favorites)
+        self.refine_after_import(report)
 
-                    db.commit()
+        return f"Successfully processed {report['succeeded']} out of {total_favorites} favorites ({pipeline.format_rates()})"
 
-                except Exception as e:
-                    logger.error(f"Error processing favorite {favorite_to_process.url}: {str(e)}")
-                    db.rollback()
+    async def stage_ndjson(self, chunks, gzipped: Optional[bool] = None) -> dict:
+        """Validate NDJSON favorites line by line and stage them in chunks as they arrive.
 
-                finally:
-                    # Delete the processed favorite from FavoriteToProcess, regardless of success or failure
-                    db.delete(favorite_to_process)
-                    db.commit()
-
-                    processed_count += 1
-                    progress = int((processed_count / total_favorites) * 100)
-                    task_queue._update_task(task_id, "processing", str(progress), None)
+        Invalid lines are counted and skipped. Raises NDJSONError when the stream
+        itself is unreadable, chunks staged before that stay for a restart.
+        """
+        accepted, staged, rejected, errors = 0, 0, 0, []
+        batch = []
+        async for line_number, line in iter_ndjson_lines(chunks, gzipped):
+            try:
+                batch.append(schemas.FavoriteImport.model_validate_json(line))
+            except ValidationError as e:
+                rejected += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    error = e.errors()[0]
+                    location = ".".join(str(part) for part in error["loc"])
+                    errors.append(f"line {line_number}: {location + ': ' if location else ''}{error['msg']}")
+                continue
+            if len(batch) >= STAGING_CHUNK_SIZE:
+                staged += await asyncio.to_thread(self._stage_favorites, batch)
+                accepted += len(batch)
+                batch = []
+        if batch:
+            staged += await asyncio.to_thread(self._stage_favorites, batch)
+            accepted += len(batch)
+        return {"accepted": accepted, "duplicates": accepted - staged, "rejected": rejected, "errors": errors}
+
+    async def import_favorites_stream(self, chunks, gzipped: Optional[bool] = None) -> dict:
+        """Stage an NDJSON stream of favorites and start processing them once it is read."""
+        result = await self.stage_ndjson(chunks, gzipped)
+        staged = result["accepted"] - result["duplicates"]
+        if staged:
+            result["task_id"] = task_queue.add_task(
+                self.import_staged_favorites_task, f"Import Favorites: {staged} items", staged
+            )
+        return result
 
-                # Add a small delay between processing favorites
-                await asyncio.sleep(1)
+    def _stage_favorites(self, favorites: List[schemas.FavoriteImport]) -> int:
+        """Write favorites to the staging table with chunked executemany inserts, in one transaction.
+
+        Favorites whose canonical URL is already a favorite, is waiting in the
+        staging table or repeats an earlier one are skipped, before any fetch or
+        LLM work. The lazy mode also writes them as pending favorites up front,
+        the pipeline then fills them in. Their ids are read back from the insert,
+        a URL saved by other means in the meantime is skipped as well.
+        Returns the number of favorites staged.
+        """
+        pending = []
+        with SessionLocal() as db:
+            unique = {}
+            for favorite in favorites:
+                unique.setdefault(canonical_url(str(favorite.url)), favorite)
+            urls = list(unique)
+            known = set()
+            for start in range(0, len(urls), BULK_QUERY_SIZE):
+                chunk = urls[start:start + BULK_QUERY_SIZE]
+                known.update(db.scalars(
+                    select(models.Favorite.canonical_url).where(models.Favorite.canonical_url.in_(chunk))
+                ))
+                known.update(db.scalars(
+                    select(models.FavoriteToProcess.canonical_url)
+                    .where(models.FavoriteToProcess.canonical_url.in_(chunk), models.FavoriteToProcess.processed == False)
+                ))
+            skipped = len(favorites) - len(unique) + len(known)
+            unique = {url: favorite for url, favorite in unique.items() if url not in known}
+            if skipped:
+                logger.info(f"Skipping {skipped} favorites whose URL is already known")
+
+            staged = 0
+            urls = list(unique)
+            for start in range(0, len(urls), STAGING_CHUNK_SIZE):
+                chunk = urls[start:start + STAGING_CHUNK_SIZE]
+                favorite_ids = {}
+                if LAZY_ENRICHMENT:
+                    favorite_ids = dict(db.execute(
+                        sqlite_insert(models.Favorite)
+                        .on_conflict_do_nothing(index_elements=["canonical_url"])
+                        .returning(models.Favorite.canonical_url, models.Favorite.id),
+                        [{"url": str(unique[url].url), "title": unique[url].title,
+                          "enrichment_state": models.ENRICHMENT_PENDING} for url in chunk]
+                    ).all())
+                    # Left out by the unique index, another request saved them since the check
+                    chunk = [url for url in chunk if url in favorite_ids]
+                    pending.extend((favorite_ids[url], unique[url]) for url in chunk)
+                if not chunk:
+                    continue
+                db.execute(insert(models.FavoriteToProcess), [
+                    {"url": str(unique[url].url), "title": unique[url].title, "metainfo": unique[url].metadata,
+                     "favorite_id": favorite_ids.get(url)}
+                    for url in chunk
+                ])
+                staged += len(chunk)
+            db.commit()
 
-            return f"Successfully processed {processed_count} out of {total_favorites} favorites"
-        except Exception as e:
-            logger.error(f"Error importing favorites: {str(e)}")
-            raise
-        finally:
-            db.close()
+        if pending:
+            vector_store.index_texts([
+                (favorite_id, str(favorite.url), favorite.title, None) for favorite_id, favorite in pending
+            ])
+        return staged
 
-    def import_favorites(self, favorites: List[schemas.FavoriteImport], task_name: str):
+    async def import_favorites(self, favorites: List[schemas.FavoriteImport], task_name: str):
+        # Staged before the task is queued, so the task only carries their number
+        staged = await asyncio.to_thread(self._stage_favorites, favorites)
         task_id = task_queue.add_task(
-            self.import_favorites_task, task_name, favorites
+            self.import_staged_favorites_task, task_name, staged
         )
         return {"task_id": task_id}
     
@@ -291,13 +469,8 @@ class FavoriteService:
             # Find the restartable task
             restartable_task = db.query(models.Task).filter(models.Task.status == "restartable").first()
             if restartable_task:
-                # Update its status to processing
-                restartable_task.status = "processing"
-                db.commit()
-                
-                # Start processing remaining favorites without creating a new task
-                Thread(target=self._run_task_wrapper, args=(restartable_task.id, self.process_remaining_favorites)).start()
-                
+                # Queue it to process the remaining favorites without creating a new task
+                task_queue.requeue(restartable_task.id, self.process_remaining_favorites)
                 return {"task_id": restartable_task.id}
             else:
                 # If no restartable task exists, create a new one (this should not happen in your scenario)
@@ -309,61 +482,115 @@ class FavoriteService:
         finally:
             db.close()
 
+    def resume_import(self, task_name: str) -> Optional[str]:
+        """Queue processing the pending staging rows, returns the task id or None when
+        there are none or an import task that processes them is queued already."""
+        with SessionLocal() as db:
+            pending = import_checkpoints.count_pending(db)
+        if not pending or task_queue.has_unfinished([self.import_staged_favorites_task, self.process_remaining_favorites]):
+            return None
+        logger.info(f"Resuming the import of {pending} pending favorites")
+        return task_queue.add_task(self.process_remaining_favorites, task_name)
+
     async def process_remaining_favorites(self, task_id: str):
         db = SessionLocal()
         try:
-            total_favorites = db.query(models.FavoriteToProcess).filter(models.FavoriteToProcess.processed == False).count()
-            processed_count = 0
-
-            for favorite_to_process in db.query(models.FavoriteToProcess).filter(models.FavoriteToProcess.processed == False).all():
-                try:
-                    summary = await nlp_service.summarize_content(str(favorite_to_process.url), favorite_to_process.metadata)
-                    suggested_tags = await nlp_service.suggest_tags(summary, favorite_to_process.metadata)
-                    suggested_folder_id = await nlp_service.suggest_folder(db, summary, favorite_to_process.metadata)
-                    
-                    db_favorite = models.Favorite(
-                        url=favorite_to_process.url,
-                        title=favorite_to_process.title,
-                        summary=summary,
-                        folder_id=suggested_folder_id
-                    )
-                    db.add(db_favorite)
-                    db.flush()
-
-                    for tag_name in suggested_tags:
-                        tag = db.query(models.Tag).filter(models.Tag.name == tag_name).first()
-                        if not tag:
-                            tag = models.Tag(name=tag_name)
-                            db.add(tag)
-                            db.flush()
-                        db_favorite.tags.append(tag)
-
-                    favorite_to_process.processed = True
-                    db.commit()
-
-                    processed_count += 1
-                    progress = int((processed_count / total_favorites) * 100)
-                    task_queue._update_task(task_id, "processing", str(progress), None)
-
-                except Exception as e:
-                    logger.error(f"Error processing favorite {favorite_to_process.url}: {str(e)}")
-                    db.rollback()
-
-                # Add a small delay between processing favorites
-                await asyncio.sleep(1)
-
-            return f"Successfully processed {processed_count} out of {total_favorites} remaining favorites"
+            total_favorites = import_checkpoints.count_pending(db)
         except Exception as e:
             logger.error(f"Error processing remaining favorites: {str(e)}")
             raise
         finally:
             db.close()
 
+        pipeline = ImportPipeline(nlp_service, task_id)
+        report = await pipeline.run(total_favorites)
+        self.refine_after_import(report)
+
+        return f"Successfully processed {report['succeeded']} out of {total_favorites} remaining favorites ({pipeline.format_rates()})"
+
+    async def refine_favorites_task(self, task_id: str):
+        """Summarize and tag the favorites described from their metadata with the LLM.
+
+        Favorites are refined one at a time so the task never holds more than one
+        LLM call, imports and new favorites keep the rest. The page is summarized
+        again along with the metadata the favorite was imported with. Folders are kept.
+        """
+        with SessionLocal() as db:
+            favorite_ids = [
+                favorite_id for (favorite_id,) in db.query(models.Favorite.id)
+                .filter(models.Favorite.needs_refinement == True)
+                .order_by(models.Favorite.id)
+            ]
+
+        refined = 0
+        for index, favorite_id in enumerate(favorite_ids):
+            db = SessionLocal()
+            try:
+                db_favorite = db.get(models.Favorite, favorite_id)
+                if db_favorite is None or not db_favorite.needs_refinement:
+                    continue
+                url, metadata = db_favorite.url, self.import_metadata(db, db_favorite)
+                summary = await nlp_service.summarize_content(url, metadata)
+                tags = await nlp_service.suggest_tags(summary, metadata)
+
+                # The favorite may have been edited or deleted while the LLM was busy
+                db.refresh(db_favorite)
+                if not db_favorite.needs_refinement:
+                    continue
+                db_favorite.summary = summary
+                tag_resolver.set_tags(db, {db_favorite.id: tags})
+                db_favorite.needs_refinement = False
+                db.commit()
+                refined += 1
+                vector_store.update_favorite(db_favorite.id, db_favorite.url, db_favorite.title, db_favorite.summary)
+            except Exception as e:
+                logger.error(f"Error refining favorite {favorite_id}: {str(e)}")
+                db.rollback()
+            finally:
+                db.close()
+            progress = int(((index + 1) / len(favorite_ids)) * 100)
+            task_queue.update_progress(task_id, progress)
+
+        return f"Refined {refined} out of {len(favorite_ids)} favorites"
+
+    @staticmethod
+    def import_metadata(db: Session, db_favorite: models.Favorite) -> str:
+        """The metadata the favorite was imported with, kept on its staging row.
+
+        Falls back to the title for favorites saved otherwise or whose staging
+        row was pruned.
+        """
+        metainfo = db.scalar(
+            select(models.FavoriteToProcess.metainfo)
+            .where(models.FavoriteToProcess.canonical_url == db_favorite.canonical_url)
+            .order_by(models.FavoriteToProcess.id.desc())
+            .limit(1)
+        )
+        if metainfo:
+            return metainfo
+        return f"Title: {db_favorite.title}\n" if db_favorite.title else ""
+
+    def refine_after_import(self, report: dict):
+        """Queue the refinement of the favorites an import summarized from their metadata,
+        unless it is turned off or queued already."""
+        if not REFINE_AFTER_IMPORT or not report["needs_refinement"]:
+            return
+        if task_queue.has_unfinished([self.refine_favorites_task]):
+            return
+        self.refine_favorites("Refine Favorites")
+
+    def refine_favorites(self, task_name: str):
+        task_id = task_queue.add_task(
+            self.refine_favorites_task, task_name, lane=LANE_MAINTENANCE
+        )
+        return {"task_id": task_id}
+
 class FolderService:
     def create_folder(self, db: Session, folder: schemas.FolderCreate) -> models.Folder:
         db_folder = models.Folder(**folder.dict())
         db.add(db_folder)
         db.commit()
+        folder_tree_cache.invalidate()
         db.refresh(db_folder)
         return db_folder
 
@@ -392,6 +619,7 @@ class FolderService:
             for key, value in folder.dict().items():
                 setattr(db_folder, key, value)
             db.commit()
+            folder_tree_cache.invalidate()
             db.refresh(db_folder)
         return db_folder
 
@@ -414,6 +642,10 @@ class FolderService:
                     favorite.folder_id = None
             db.delete(db_folder)
             db.commit()
+            folder_tree_cache.invalidate()
+            if domain_affinity is not None:
+                # Its favorites moved in bulk, recount
+                domain_affinity.rebuild(engine)
         return db_folder
 
     def get_folder_structure(self, db: Session):
@@ -477,6 +709,7 @@ class TagService:
             for key, value in tag.dict().items():
                 setattr(db_tag, key, value)
             db.commit()
+            tag_resolver.invalidate()
             db.refresh(db_tag)
         return db_tag
 
@@ -485,6 +718,7 @@ class TagService:
         if db_tag:
             db.delete(db_tag)
             db.commit()
+            tag_resolver.invalidate()
         return db_tag
 
     def search_tags(self, db: Session, query: str) -> List[models.Tag]:
@@ -524,19 +758,14 @@ class TagService:
 
 class NLPService:
     def __init__(self):
-        self.session = requests.Session()
-        retries = Retry(
-            total=5, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504]
-        )
-        self.session.mount("http://", HTTPAdapter(max_retries=retries))
-        self.session.mount("https://", HTTPAdapter(max_retries=retries))
-
         # Set up Jinja2 environment
         template_dir = os.path.join(os.path.dirname(__file__), "templates")
         self.jinja_env = Environment(loader=FileSystemLoader(template_dir))
 
         # Initialize ContentExtractor
-        self.content_extractor = ContentExtractor(self.fetch_with_retries)
+        self.content_extractor = ContentExtractor(self.fetch_with_retries, cache=fetch_cache)
+        # Enrichments run concurrently, a suggested new folder is only created once
+        self._folder_lock = threading.Lock()
 
     def get_random_user_agent(self):
         user_agents = [
@@ -548,7 +777,7 @@ class NLPService:
         ]
         return random.choice(user_agents)
 
-    async def fetch_with_retries(self, url, max_retries=3):
+    async def fetch_with_retries(self, url, max_retries=3, head_only=False, max_bytes=None, extra_headers=None):
         for attempt in range(max_retries):
             headers = {
                 "User-Agent": self.get_random_user_agent(),
@@ -558,17 +787,32 @@ class NLPService:
                 "DNT": "1",
                 "Connection": "keep-alive",
                 "Upgrade-Insecure-Requests": "1",
+                **(extra_headers or {}),
             }
 
             try:
-                await asyncio.sleep(random.uniform(1, 3))  # Random delay
-                response = await asyncio.to_thread(
-                    self.session.get, url, headers=headers, timeout=15
-                )
+                async with host_scheduler.slot(url):
+                    response = await http_client.get(
+                        url, headers=headers, timeout=15, head_only=head_only, max_bytes=max_bytes
+                    )
                 response.raise_for_status()
                 return response
-            except requests.HTTPError as e:
-                if e.response.status_code == 403:
+            except FetchStatusError as e:
+                status_code = e.response.status_code
+                if status_code in (429, 503):
+                    retry_after = host_scheduler.parse_retry_after(e.response.headers.get("Retry-After"))
+                    if retry_after is None:
+                        retry_after = 2 ** (attempt + 1)
+                    logger.warning(
+                        f"{status_code} encountered on attempt {attempt + 1}, retrying after {retry_after:.1f}s..."
+                    )
+                    if attempt == max_retries - 1 or retry_after > MAX_RETRY_AFTER:
+                        logger.error(
+                            f"Max retries reached for URL {url}. Unable to fetch content."
+                        )
+                        raise
+                    host_scheduler.defer(url, retry_after)
+                elif status_code == 403:
                     logger.warning(
                         f"403 Forbidden encountered on attempt {attempt + 1}. Retrying..."
                     )
@@ -577,16 +821,16 @@ class NLPService:
                             f"Max retries reached for URL {url}. Unable to fetch content."
                         )
                         raise
+                    host_scheduler.defer(url, random.uniform(1, 3))  # Random delay
                 else:
                     raise
-            except requests.RequestException as e:
-                logger.error(
-                    f"Error fetching URL {url} on attempt {attempt + 1}: {str(e)}"
-                )
-                if attempt == max_retries - 1:
-                    raise
+            except FetchError as e:
+                # http_client retried connection errors and timeouts with backoff already,
+                # another round here would only hit the host again right away
+                logger.error(f"Error fetching URL {url}: {str(e)}")
+                raise
 
-    def generate_fallback_description(self, url: str, metadata: str) -> str:
+    async def generate_fallback_description(self, url: str, metadata: str) -> str:
         parsed_url = urlparse(url)
         domain = parsed_url.netloc
         path = parsed_url.path
@@ -594,111 +838,277 @@ class NLPService:
         template = self.jinja_env.get_template("generate_fallback_description.j2")
         prompt = template.render(url=url, metadata=metadata)
 
-        return llm_service.generate(prompt)
+        return await llm_service.agenerate(prompt)
+
+    async def summarize_extracted_content(self, content, metadata: str) -> str:
+        template = self.jinja_env.get_template("summarize_content.j2")
+        prompt = template.render(metadata=metadata, content=content)
+
+        return await llm_service.agenerate(prompt)
 
     async def summarize_content(self, url: str, metadata: str) -> str:
         try:
             content = await self.content_extractor.extract_content(url)
 
-            template = self.jinja_env.get_template("summarize_content.j2")
-            prompt = template.render(metadata=metadata, content=content)
+            return await self.summarize_extracted_content(content, metadata)
 
-            return llm_service.generate(prompt)
-
-        except requests.RequestException as e:
+        except FetchError as e:
             logger.error(f"Error fetching URL {url}: {str(e)}")
-            return self.generate_fallback_description(url, metadata)
+            return await self.generate_fallback_description(url, metadata)
         except Exception as e:
             logger.error(f"Unexpected error while summarizing content for {url}: {str(e)}")
             raise
 
+    async def suggest_tags_locally(self, text: str) -> Optional[List[str]]:
+        """Tags voted on by similar favorites, None when the LLM should be asked."""
+        if tag_suggester is None:
+            return None
+        try:
+            return await asyncio.to_thread(tag_suggester.suggest, text)
+        except Exception as e:
+            logger.warning(f"Nearest neighbour tag suggestion failed, asking the LLM: {str(e)}")
+            return None
+
     async def suggest_tags(self, summary: str, metadata: str) -> List[str]:
+        tags = await self.suggest_tags_locally(summary)
+        if tags:
+            return tags
+        return await self.suggest_tags_with_llm(summary, metadata)
+
+    async def suggest_tags_with_llm(self, summary: str, metadata: str) -> List[str]:
         try:
             template = self.jinja_env.get_template("suggest_tags.j2")
             prompt = template.render(summary=summary, metadata=metadata)
 
-            response = llm_service.generate(prompt)
+            response = await llm_service.agenerate(prompt)
             cleaned_response = response.split("\n")[0]
-            tags = cleaned_response.split(",")
-
-            formatted_tags = []
-            for tag in tags:
-                tag = tag.strip()
-                if tag:
-                    tag = tag.replace("-", " ").replace("_", " ")
-                    if tag[0].isalpha():
-                        tag = tag[0].upper() + tag[1:]
-                    formatted_tags.append(tag)
-
-            return formatted_tags
+            return self.format_tags(cleaned_response.split(","))
 
         except Exception as e:
             logger.error(f"Unexpected error while suggesting tags: {str(e)}")
             raise
 
-    def get_folder_structure(self, db: Session):
-        def build_structure(folder, level=0):
-            return {
-                "name": folder.name,
-                "id": folder.id,
-                "level": level,
-                "children": [
-                    build_structure(child, level + 1) for child in folder.children
-                ],
-            }
+    def format_tags(self, tags) -> List[str]:
+        formatted_tags = []
+        for tag in tags:
+            tag = str(tag).strip()
+            if tag:
+                tag = tag.replace("-", " ").replace("_", " ")
+                if tag[0].isalpha():
+                    tag = tag[0].upper() + tag[1:]
+                formatted_tags.append(tag)
+        return formatted_tags
 
-        root = db.query(models.Folder).filter(models.Folder.parent_id == None).first()
-        return build_structure(root)
+    def get_folder_structure(self, db: Session):
+        return folder_tree_cache.get(db).structure
 
     def format_folder_structure(self, structure, level=0):
-        result = "  " * level + f"- {structure['name']} (ID: {structure['id']})\n"
-        for child in structure["children"]:
-            result += self.format_folder_structure(child, level + 1)
-        return result
+        return "\n".join(format_folder_lines(structure, level)) + "\n"
+
+    def folder_from_affinity(self, folder_tree: FolderTree, url: Optional[str]) -> Optional[int]:
+        """The folder most favorites of url's site are in, when that is clear enough."""
+        if domain_affinity is None or not url:
+            return None
+        folder_id = domain_affinity.lookup(url)
+        if folder_id is not None and folder_tree.exists(folder_id):
+            logger.info(f"Filing {url} in folder {folder_id} with the other favorites of its site")
+            return folder_id
+        return None
 
-    async def suggest_folder(self, db: Session, summary: str, metadata: str) -> int:
+    async def suggest_folder(self, db: Session, summary: str, metadata: str, url: str = None) -> int:
         try:
-            folder_structure = self.get_folder_structure(db)
-            formatted_structure = self.format_folder_structure(folder_structure)
+            folder_tree = folder_tree_cache.get(db)
+            folder_id = self.folder_from_affinity(folder_tree, url)
+            if folder_id is not None:
+                return folder_id
+            shortlist = await asyncio.to_thread(folder_index.shortlist, db, summary)
+            if shortlist is not None and shortlist.confident:
+                folder_id, similarity = shortlist.best
+                logger.info(f"Folder {folder_id} matches with similarity {similarity:.2f}, skipping the LLM")
+                return folder_id
 
             template = self.jinja_env.get_template("suggest_folder.j2")
             prompt = template.render(
-                summary=summary, metadata=metadata, formatted_structure=formatted_structure
+                summary=summary,
+                metadata=metadata,
+                formatted_structure=shortlist.prompt_text if shortlist else folder_tree.prompt_text,
             )
 
-            suggestion = llm_service.generate(prompt)
+            suggestion = await llm_service.agenerate(prompt)
             suggestion_json = json.loads(suggestion)
 
-            parent_folder_id = suggestion_json.get("id")
-            suggested_folder = suggestion_json["children"][0]
-
-            parent_folder = db.query(models.Folder).filter(models.Folder.id == parent_folder_id).first()
-            if not parent_folder:
-                logger.warning(f"Suggested parent folder ID {parent_folder_id} does not exist. Using root folder.")
-                parent_folder_id = folder_structure["id"]
-
-            if "id" in suggested_folder:
-                existing_folder = db.query(models.Folder).filter(models.Folder.id == suggested_folder["id"]).first()
-                if existing_folder:
-                    return existing_folder.id
-                else:
-                    logger.warning(f"Suggested folder ID {suggested_folder['id']} does not exist. Creating a new folder.")
-
-            return self.create_new_folder(db, parent_folder_id, suggested_folder["name"])
+            return self.resolve_folder_suggestion(db, folder_tree, suggestion_json)
 
         except json.JSONDecodeError:
             logger.error(f"Failed to parse LLM response as JSON: {suggestion}")
+            llm_service.invalidate(prompt)
             return self.get_or_create_uncategorized_folder(db)
         except Exception as e:
             logger.error(f"Unexpected error while suggesting folder: {str(e)}")
             return self.get_or_create_uncategorized_folder(db)
 
+    async def enrich(self, db: Session, url: str, content, metadata: str, fetch_failed: bool = False,
+                     meta_info: dict = None) -> dict:
+        """Summary, tags and folder id of a favorite from a single LLM call.
+
+        fetch_failed marks a page that could not be fetched, content is ignored then.
+        Falls back to the separate summary, tags and folder prompts when the combined
+        response cannot be used. When the page's meta information passes the metadata
+        gate, summary and tags are taken from it and the result is marked with
+        needs_refinement.
+        """
+        if not fetch_failed:
+            enrichment = await self.enrich_from_metadata(db, url, metadata, meta_info)
+            if enrichment is not None:
+                return enrichment
+
+        if ENRICH_MODE == "combined":
+            folder_tree = folder_tree_cache.get(db)
+            query_text = f"{url}\n{metadata}" if fetch_failed else self.content_text(content) or metadata
+            # The site's usual folder or a confident shortlist match settles the folder,
+            # the prompt then leaves it out
+            folder_id = self.folder_from_affinity(folder_tree, url)
+            formatted_structure = ""
+            if folder_id is None:
+                shortlist = await asyncio.to_thread(folder_index.shortlist, db, query_text)
+                if shortlist is not None and shortlist.confident:
+                    folder_id = shortlist.best[0]
+                else:
+                    formatted_structure = shortlist.prompt_text if shortlist else folder_tree.prompt_text
+
+            # Tags voted on by similar favorites are left out of the prompt as well
+            tags = await self.suggest_tags_locally(query_text)
+
+            template = self.jinja_env.get_template("enrich_favorite.j2")
+            prompt = template.render(
+                url=url,
+                metadata=metadata,
+                content=None if fetch_failed else content,
+                formatted_structure=formatted_structure,
+                with_tags=tags is None,
+            )
+            response = await llm_service.agenerate(prompt)
+            try:
+                enrichment = self.parse_enrichment(response, with_tags=tags is None, with_folder=folder_id is None)
+                if folder_id is None:
+                    folder_id = self.resolve_folder_suggestion(db, folder_tree, enrichment["folder"])
+                return {
+                    "summary": enrichment["summary"],
+                    "tags": tags or enrichment["tags"],
+                    "folder_id": folder_id,
+                }
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                logger.warning(f"Unusable enrichment response for {url}, using separate prompts: {str(e)}")
+                llm_service.invalidate(prompt)
+
+        return await self.enrich_stepwise(db, url, content, metadata, fetch_failed)
+
+    @staticmethod
+    def content_text(content) -> str:
+        """The text of content as extract_page returns it, a (meta_text, content) tuple."""
+        if isinstance(content, (tuple, list)):
+            return "\n".join(part for part in content if part)
+        return content or ""
+
+    async def enrich_from_metadata(self, db: Session, url: str, metadata: str, meta_info: Optional[dict]) -> Optional[dict]:
+        """Summary and tags from the page's own description and keywords, None when they do not suffice."""
+        if not metadata_gate.ENABLED:
+            return None
+        summary = metadata_gate.summary_from_metadata(meta_info)
+        if summary is None:
+            return None
+        logger.info(f"Summarizing {url} from its metadata")
+        keywords = metadata_gate.tags_from_metadata(meta_info)
+        tags = self.format_tags(keywords) if keywords else await self.suggest_tags(summary, metadata)
+        folder_id = await self.suggest_folder(db, summary, metadata, url=url)
+        return {"summary": summary, "tags": tags, "folder_id": folder_id, "needs_refinement": True}
+
+    async def enrich_stepwise(self, db: Session, url: str, content, metadata: str, fetch_failed: bool = False) -> dict:
+        if fetch_failed:
+            summary = await self.generate_fallback_description(url, metadata)
+        else:
+            summary = await self.summarize_extracted_content(content, metadata)
+        tags = await self.suggest_tags(summary, metadata)
+        folder_id = await self.suggest_folder(db, summary, metadata, url=url)
+        return {"summary": summary, "tags": tags, "folder_id": folder_id}
+
+    async def enrich_url(self, db: Session, url: str, metadata: str) -> dict:
+        try:
+            meta_info, content = await self.content_extractor.extract(url)
+        except FetchError as e:
+            logger.error(f"Error fetching URL {url}: {str(e)}")
+            return await self.enrich(db, url, None, metadata, fetch_failed=True)
+        return await self.enrich(db, url, content, metadata, meta_info=meta_info)
+
+    def parse_enrichment(self, response: str, with_tags: bool = True, with_folder: bool = True) -> dict:
+        """Validate the JSON answer to enrich_favorite.j2, raises ValueError when unusable."""
+        start, end = response.find("{"), response.rfind("}")
+        if start == -1 or end < start:
+            raise ValueError("no JSON object in the response")
+        enrichment = json.loads(response[start:end + 1])
+        if not isinstance(enrichment, dict):
+            raise ValueError("the response is not a JSON object")
+
+        summary = enrichment.get("summary")
+        if not isinstance(summary, str) or not summary.strip():
+            raise ValueError("missing summary")
+        tags = enrichment.get("tags") or []
+        if isinstance(tags, str):
+            tags = tags.split(",")
+        if with_tags and (not isinstance(tags, list) or not tags):
+            raise ValueError("missing tags")
+        if with_folder and not isinstance(enrichment.get("folder"), dict):
+            raise ValueError("missing folder")
+
+        return {
+            "summary": summary.strip(),
+            "tags": self.format_tags(tags) if isinstance(tags, list) else [],
+            "folder": enrichment.get("folder"),
+        }
+
+    def resolve_folder_suggestion(self, db: Session, folder_tree: FolderTree, suggestion_json: dict) -> int:
+        """Turn a {"name", "id", "children": [...]} folder suggestion into a folder id."""
+        parent_folder_id = self.parse_folder_id(suggestion_json.get("id"))
+        suggested_folder = suggestion_json["children"][0]
+
+        if not folder_tree.exists(parent_folder_id):
+            logger.warning(f"Suggested parent folder ID {parent_folder_id} does not exist. Using root folder.")
+            parent_folder_id = folder_tree.root_id
+
+        if "id" in suggested_folder:
+            suggested_folder_id = self.parse_folder_id(suggested_folder["id"])
+            if folder_tree.exists(suggested_folder_id):
+                return suggested_folder_id
+            else:
+                logger.warning(f"Suggested folder ID {suggested_folder['id']} does not exist. Creating a new folder.")
+
+        return self.create_new_folder(db, parent_folder_id, suggested_folder["name"])
+
+    @staticmethod
+    def parse_folder_id(value) -> Optional[int]:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
 
     def create_new_folder(self, db: Session, parent_id: int, folder_name: str) -> int:
+        """Id of the folder named folder_name under parent_id, created unless it exists."""
         try:
-            db_folder = models.Folder(name=folder_name, parent_id=parent_id)
-            db.add(db_folder)
-            db.commit()
+            with self._folder_lock:
+                # Created meanwhile for another favorite given the same suggestion
+                existing_id = db.scalar(
+                    select(models.Folder.id)
+                    .where(models.Folder.parent_id == parent_id,
+                           func.lower(models.Folder.name) == folder_name.strip().lower())
+                    .order_by(models.Folder.id)
+                    .limit(1)
+                )
+                if existing_id is not None:
+                    return existing_id
+                db_folder = models.Folder(name=folder_name, parent_id=parent_id)
+                db.add(db_folder)
+                db.commit()
+            folder_tree_cache.invalidate()
             db.refresh(db_folder)
             logger.info(f"Created new folder: {db_folder.name} (ID: {db_folder.id})")
             return db_folder.id
@@ -718,6 +1128,7 @@ class NLPService:
                 uncategorized = models.Folder(name="Uncategorized", parent_id=None)
                 db.add(uncategorized)
                 db.commit()
+                folder_tree_cache.invalidate()
                 db.refresh(uncategorized)
                 logger.info(f"Created Uncategorized folder (ID: {uncategorized.id})")
             return uncategorized.id
@@ -733,3 +1144,9 @@ favorite_service = FavoriteService()
 folder_service = FolderService()
 tag_service = TagService()
 nlp_service = NLPService()
+
+task_queue.register("create_favorite", favorite_service.create_favorite_task)
+task_queue.register("delete_all_favorites", favorite_service.delete_all_favorites_task)
+task_queue.register("import_staged_favorites", favorite_service.import_staged_favorites_task)
+task_queue.register("process_remaining_favorites", favorite_service.process_remaining_favorites)
+task_queue.register("refine_favorites", favorite_service.refine_favorites_task)
@@ -0,0 +1,98 @@
+# tag_resolver.py
+import logging
+import threading
+from typing import Dict, Iterable, List
+
+from sqlalchemy import delete, event, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Names or favorite ids per IN (...) query
+QUERY_CHUNK_SIZE = 500
+
+
+class TagResolver:
+    """Process-wide tag name -> id cache with a bulk upsert of tag names.
+
+    The cache is warmed with one query. Tags inserted by a session only enter it
+    once that session commits, so a rollback cannot leave ids of tags that do not
+    exist. Renames and deletes go through invalidate, which drops the cache.
+    """
+
+    def __init__(self):
+        self._ids = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _warm(self, db: Session) -> Dict[str, int]:
+        with self._lock:
+            if self._ids is not None:
+                return self._ids
+            generation = self._generation
+        ids = dict(db.execute(select(models.Tag.name, models.Tag.id)).all())
+        with self._lock:
+            # An invalidate while loading makes this result stale
+            if generation == self._generation:
+                self._ids = ids
+        logger.info(f"Loaded {len(ids)} tag ids")
+        return ids
+
+    def resolve(self, db: Session, names: Iterable[str]) -> Dict[str, int]:
+        """Ids of the tags named names, inserting the missing ones in db's transaction."""
+        names = list(dict.fromkeys(names))
+        cached = self._warm(db)
+        ids = {name: cached[name] for name in names if name in cached}
+        missing = [name for name in names if name not in ids]
+        if not missing:
+            return ids
+
+        db.execute(sqlite_insert(models.Tag).on_conflict_do_nothing(index_elements=["name"]),
+                   [{"name": name} for name in missing])
+        for i in range(0, len(missing), QUERY_CHUNK_SIZE):
+            found = dict(db.execute(
+                select(models.Tag.name, models.Tag.id).where(models.Tag.name.in_(missing[i:i + QUERY_CHUNK_SIZE]))
+            ).all())
+            ids.update(found)
+            db.info.setdefault("resolved_tag_ids", {}).update(found)
+        return ids
+
+    def set_tags(self, db: Session, tag_names: Dict[int, List[str]]):
+        """Make the tags of each favorite id in tag_names the given names, with one executemany of links."""
+        ids = self.resolve(db, (name for names in tag_names.values() for name in names))
+        favorite_ids = list(tag_names)
+        for i in range(0, len(favorite_ids), QUERY_CHUNK_SIZE):
+            db.execute(delete(models.favorite_tags).where(
+                models.favorite_tags.c.favorite_id.in_(favorite_ids[i:i + QUERY_CHUNK_SIZE])
+            ))
+        links = [
+            {"favorite_id": favorite_id, "tag_id": ids[name]}
+            for favorite_id, names in tag_names.items()
+            for name in dict.fromkeys(names)
+        ]
+        if links:
+            db.execute(insert(models.favorite_tags), links)
+
+    def _after_commit(self, db: Session):
+        resolved = db.info.pop("resolved_tag_ids", None)
+        if resolved:
+            with self._lock:
+                if self._ids is not None:
+                    self._ids.update(resolved)
+
+    def _after_rollback(self, db: Session):
+        db.info.pop("resolved_tag_ids", None)
+
+    def invalidate(self):
+        with self._lock:
+            self._ids = None
+            self._generation += 1
+
+
+tag_resolver = TagResolver()
+event.listen(SessionLocal, "after_commit", tag_resolver._after_commit)
+event.listen(SessionLocal, "after_rollback", tag_resolver._after_rollback)
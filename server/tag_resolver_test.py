@@ -0,0 +1,58 @@
+import models
+from database import SessionLocal
+from tag_resolver import tag_resolver
+
+
+def tag_names(session, favorite_id):
+    return sorted(tag.name for tag in session.get(models.Favorite, favorite_id).tags)
+
+
+def test_set_tags_inserts_missing_tags_and_replaces_links(isolated_db):
+    with SessionLocal() as session:
+        session.add(models.Tag(name="Python"))
+        first = models.Favorite(url="https://one.example.com/")
+        second = models.Favorite(url="https://two.example.com/")
+        session.add_all([first, second])
+        session.flush()
+        tag_resolver.set_tags(session, {first.id: ["Python", "Async", "Python"], second.id: ["Async"]})
+        session.commit()
+        assert tag_names(session, first.id) == ["Async", "Python"]
+        assert tag_names(session, second.id) == ["Async"]
+
+        tag_resolver.set_tags(session, {first.id: ["Web"]})
+        session.commit()
+        session.expire_all()
+        assert tag_names(session, first.id) == ["Web"]
+        assert session.query(models.Tag).count() == 3
+
+        ids = dict(session.query(models.Tag.name, models.Tag.id).all())
+    # Tags committed by a session enter the cache
+    assert tag_resolver._ids == ids
+
+
+def test_rolled_back_tags_do_not_enter_the_cache(isolated_db):
+    with SessionLocal() as session:
+        tag_resolver.resolve(session, [])
+        resolved = tag_resolver.resolve(session, ["Draft"])
+        session.rollback()
+        assert "Draft" not in tag_resolver._ids
+
+        session.add(models.Tag(name="Other"))
+        session.commit()
+        again = tag_resolver.resolve(session, ["Draft"])
+        session.commit()
+        assert again["Draft"] == session.query(models.Tag.id).filter(models.Tag.name == "Draft").scalar()
+        assert again["Draft"] != resolved["Draft"]
+        assert tag_resolver._ids["Draft"] == again["Draft"]
+
+
+def test_invalidate_reloads_renamed_tags(isolated_db):
+    with SessionLocal() as session:
+        assert tag_resolver.resolve(session, ["Old"])
+        session.commit()
+        session.query(models.Tag).filter(models.Tag.name == "Old").update({"name": "New"})
+        session.commit()
+        tag_resolver.invalidate()
+        ids = tag_resolver.resolve(session, ["New"])
+        assert "Old" not in tag_resolver._ids
+        assert ids["New"] == tag_resolver._ids["New"]
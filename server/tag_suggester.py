@@ -0,0 +1,103 @@
+# tag_suggester.py
+import logging
+import os
+import threading
+from typing import List, Optional
+
+from sqlalchemy import select
+
+import models
+from database import SessionLocal
+from vector_store import vector_store
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('TAG_KNN_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Number of nearest favorites whose tags are voted on
+NEIGHBOURS = int(os.environ.get('TAG_KNN_NEIGHBOURS', '10'))
+# Below this many favorites in the collection the LLM is always asked
+MIN_CORPUS = int(os.environ.get('TAG_KNN_MIN_CORPUS', '200'))
+# Share of the neighbours' similarity a tag needs to be suggested
+MIN_SHARE = float(os.environ.get('TAG_KNN_MIN_SHARE', '0.35'))
+# Neighbours less similar than this do not vote
+MIN_SIMILARITY = float(os.environ.get('TAG_KNN_MIN_SIMILARITY', '0.5'))
+# Fewer tags passing the vote than this counts as a weak vote, more are cut off
+MIN_TAGS = 3
+MAX_TAGS = 5
+
+
+class TagSuggester:
+    """Suggests tags by letting the nearest tagged favorites vote.
+
+    Neighbours come from the favorites collection of the vector store and vote
+    with their cosine similarity for each of their tags. suggest returns None
+    when the corpus is too small or the vote too weak, the LLM is used then.
+    """
+
+    def __init__(self, store=vector_store, neighbours: int = NEIGHBOURS, min_corpus: int = MIN_CORPUS,
+                 min_share: float = MIN_SHARE, min_similarity: float = MIN_SIMILARITY):
+        self.store = store
+        self.neighbours = neighbours
+        self.min_corpus = min_corpus
+        self.min_share = min_share
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self.knn = 0
+        self.small_corpus = 0
+        self.weak_votes = 0
+
+    def _record(self, outcome: str):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def suggest(self, text: str, exclude_id: int = None) -> Optional[List[str]]:
+        if self.store.collection.count() < self.min_corpus:
+            self._record("small_corpus")
+            return None
+
+        result = self.store.collection.query(
+            query_texts=[text], n_results=self.neighbours + (1 if exclude_id is not None else 0),
+            include=["distances"],
+        )
+        # Squared L2 distance of normalized embeddings, 1 - d/2 is the cosine similarity
+        similarities = {}
+        for id, distance in zip(result["ids"][0], result["distances"][0]):
+            similarity = 1 - distance / 2
+            if int(id) != exclude_id and similarity >= self.min_similarity:
+                similarities[int(id)] = similarity
+        similarities = dict(list(similarities.items())[:self.neighbours])
+
+        votes = {}
+        if similarities:
+            with SessionLocal() as db:
+                rows = db.execute(
+                    select(models.favorite_tags.c.favorite_id, models.Tag.name)
+                    .join(models.Tag, models.Tag.id == models.favorite_tags.c.tag_id)
+                    .where(models.favorite_tags.c.favorite_id.in_(similarities))
+                ).all()
+            for favorite_id, tag_name in rows:
+                votes[tag_name] = votes.get(tag_name, 0.0) + similarities[favorite_id]
+
+        total = sum(similarities.values())
+        ranked = sorted(votes.items(), key=lambda vote: -vote[1])
+        tags = [tag for tag, weight in ranked if weight / total >= self.min_share][:MAX_TAGS] if total else []
+        if len(tags) < MIN_TAGS:
+            self._record("weak_votes")
+            return None
+        self._record("knn")
+        return tags
+
+    def stats(self):
+        suggestions = self.knn + self.small_corpus + self.weak_votes
+        return {
+            "knn": self.knn,
+            "llm_small_corpus": self.small_corpus,
+            "llm_weak_votes": self.weak_votes,
+            "llm_skip_rate": round(self.knn / suggestions, 3) if suggestions else 0.0,
+            "neighbours": self.neighbours,
+            "min_corpus": self.min_corpus,
+            "min_share": self.min_share,
+        }
+
+
+tag_suggester = TagSuggester() if ENABLED else None
@@ -1,15 +1,82 @@
-from sqlalchemy import Column, String, JSON, DateTime, inspect, text
+from sqlalchemy import Column, String, JSON, DateTime, inspect, text, func, select, update
 from sqlalchemy.orm import Session
-from database import Base, engine, SessionLocal
-from threading import Thread
+from database import Base, engine, SessionLocal, add_missing_columns
+from collections import deque
+import threading
 import asyncio
+import logging
+import os
+import time
 import uuid
 import json
 from datetime import datetime, timezone
 from models import Task
+from loop_local import aclose_loop_values
+from lanes import LANES, LANE_INTERACTIVE, LANE_BULK, LANE_MAINTENANCE, current_lane, lane_cap, parse_reserved
+
+logger = logging.getLogger(__name__)
+
+# Worker threads, each runs one task at a time on its own event loop
+WORKERS = int(os.environ.get('TASK_WORKERS', '4'))
+# Workers only the lanes above bulk and maintenance may use, so a save is not
+# queued behind long imports
+RESERVED_WORKERS = parse_reserved(os.environ.get('TASK_RESERVED_WORKERS', 'interactive=1,bulk=1'))
+# Seconds running tasks get to finish on shutdown, the ones that do not are run again on the next start
+DRAIN_SECONDS = float(os.environ.get('TASK_DRAIN_SECONDS', '30'))
+# Idle workers look for tasks this often besides being woken by add_task
+POLL_SECONDS = 5.0
+# Queue waits of the most recently started tasks kept for the stats
+WAIT_SAMPLES = 200
+# Progress of running tasks is kept in memory and written to the tasks table this often
+PROGRESS_FLUSH_SECONDS = float(os.environ.get('TASK_PROGRESS_FLUSH_SECONDS', '2'))
+
+# Queue order of the lanes, the priority column keeps it sortable
+LANE_PRIORITIES = {LANE_INTERACTIVE: 10, LANE_BULK: 0, LANE_MAINTENANCE: -10}
+
+
+def _now() -> datetime:
+    # Naive UTC, the way SQLite hands DateTime values back
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 
 class TaskQueue:
-    def __init__(self):
+    """Durable task queue in the tasks table, worked off by a fixed pool of threads.
+
+    A task names a function registered with register and carries its JSON
+    arguments, so tasks still pending when the server stops run once it starts
+    again. Every task belongs to a lane; workers take the pending task of the
+    highest lane, oldest first, and the lanes below interactive only get the
+    workers not reserved for the lanes above them. A task runs with its lane as
+    lanes.current_lane, which the fetch and LLM limiters order their calls by.
+
+    Running tasks live in memory as well. Their progress updates only change
+    the memory copy, a flusher thread writes the changed ones every
+    PROGRESS_FLUSH_SECONDS in one statement, and status changes are written
+    right away. Status reads of running tasks are answered from memory.
+    """
+
+    def __init__(self, workers: int = WORKERS, reserved: dict = None):
+        self.workers = workers
+        self.reserved = RESERVED_WORKERS if reserved is None else reserved
+        self._handlers = {}
+        self._names = {}
+        self._threads = []
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._busy = {lane: 0 for lane in LANES}
+        # Workers claiming a task, they count as busy for the lane caps
+        self._claiming = 0
+        # Counts the wakeups, so a worker notices the ones it missed while claiming
+        self._wakeups = 0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._live = {}
+        self._dirty = set()
+        self._live_lock = threading.Lock()
+        self._flusher = None
+        self._flush_stop = threading.Event()
+        self._progress_updates = 0
+        self._progress_flushes = 0
+        self._progress_rows = 0
         self.init_db()
 
     def init_db(self):
@@ -17,37 +84,259 @@ class TaskQueue:
         if not inspector.has_table("tasks"):
             Base.metadata.create_all(bind=engine)
         else:
-            # Check if created_at column exists
-            columns = [col['name'] for col in inspector.get_columns("tasks")]
-            if 'created_at' not in columns:
-                # Add created_at column
-                with engine.connect() as conn:
-                    conn.execute(text("ALTER TABLE tasks ADD COLUMN created_at DATETIME"))
-                    conn.commit()
+            add_missing_columns("tasks", {
+                "created_at": "DATETIME",
+                "handler": "VARCHAR",
+                "payload": "JSON",
+                "lane": f"VARCHAR NOT NULL DEFAULT '{LANE_BULK}'",
+                "priority": "INTEGER NOT NULL DEFAULT 0",
+                "started_at": "DATETIME",
+                "finished_at": "DATETIME",
+            })
+
+    def register(self, name, task_func):
+        """Make task_func, an async function taking the task id first, available to add_task under name."""
+        self._handlers[name] = task_func
+        self._names[task_func] = name
 
     def generate_task_id(self):
         return str(uuid.uuid4())
-    
-    def add_task(self, task_func, task_name, *args, **kwargs):
-        task_id = str(uuid.uuid4())
+
+    def add_task(self, task_func, task_name, *args, lane=LANE_BULK, **kwargs):
+        """Queue a call of the registered task_func with JSON serializable arguments, returns the task id."""
+        handler = self._names.get(task_func)
+        if handler is None:
+            raise ValueError(f"Task function {task_func} is not registered")
+        task_id = self.generate_task_id()
         with SessionLocal() as db:
-            db_task = Task(id=task_id, name=task_name, status="pending", progress="0", result=None, created_at=datetime.now(timezone.utc))
+            db_task = Task(id=task_id, name=task_name, status="pending", progress="0", result=None,
+                           handler=handler, payload={"args": list(args), "kwargs": kwargs},
+                           lane=lane, priority=LANE_PRIORITIES[lane], created_at=datetime.now(timezone.utc))
             db.add(db_task)
             db.commit()
 
-        Thread(target=self._run_task, args=(task_id, task_func, args, kwargs)).start()
+        self.start()
+        self._wake()
         return task_id
 
-    def _run_task(self, task_id, task_func, args, kwargs):
+    def requeue(self, task_id, task_func, *args, lane=LANE_BULK, **kwargs):
+        """Queue an existing task again, as a call of the registered task_func."""
+        with SessionLocal() as db:
+            db.query(Task).filter(Task.id == task_id).update({
+                Task.status: "pending", Task.progress: "0", Task.result: None,
+                Task.handler: self._names[task_func], Task.payload: {"args": list(args), "kwargs": kwargs},
+                Task.lane: lane, Task.priority: LANE_PRIORITIES[lane], Task.created_at: datetime.now(timezone.utc),
+                Task.started_at: None, Task.finished_at: None,
+            }, synchronize_session=False)
+            db.commit()
+        self.start()
+        self._wake()
+
+    def recover_interrupted_tasks(self):
+        """Queue the tasks a previous run of the server was running again.
+
+        Tasks from before the queue was durable have no handler to run them
+        with, those are marked failed. Returns (requeued, failed).
+        """
+        with SessionLocal() as db:
+            requeued = (
+                db.query(Task)
+                .filter(Task.status == "processing", Task.handler.isnot(None))
+                .update({Task.status: "pending", Task.started_at: None}, synchronize_session=False)
+            )
+            failed = (
+                db.query(Task)
+                .filter(Task.status.in_(("pending", "processing")), Task.handler.is_(None))
+                .update({Task.status: "failed", Task.result: "Interrupted by a server restart"},
+                        synchronize_session=False)
+            )
+            db.commit()
+        return requeued, failed
+
+    def has_unfinished(self, task_funcs) -> bool:
+        """Whether a call of one of task_funcs is pending or running."""
+        handlers = [self._names[task_func] for task_func in task_funcs]
+        with SessionLocal() as db:
+            return db.query(Task.id).filter(
+                Task.status.in_(("pending", "processing")), Task.handler.in_(handlers)
+            ).first() is not None
+
+    def start(self):
+        """Start the missing worker threads, also after a shutdown."""
+        with self._condition:
+            self._stopping = False
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for index in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._work, name=f"task-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flush_stop.clear()
+                self._flusher = threading.Thread(target=self._flush_periodically, name="task-progress", daemon=True)
+                self._flusher.start()
+
+    def shutdown(self, timeout: float = DRAIN_SECONDS):
+        """Stop taking tasks and wait up to timeout seconds for the running ones.
+
+        Tasks still running then stay in processing and are run again by
+        recover_interrupted_tasks on the next start.
+        """
+        with self._condition:
+            self._stopping = True
+            self._wakeups += 1
+            self._condition.notify_all()
+            threads = list(self._threads)
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        running = sum(1 for thread in threads if thread.is_alive())
+        if running:
+            logger.warning(f"{running} tasks still running after {timeout}s, they run again on the next start")
+        self._flush_stop.set()
+        if self._flusher is not None:
+            self._flusher.join(max(deadline - time.monotonic(), 0))
+        self.flush_progress()
+
+    def _work(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            result = loop.run_until_complete(task_func(task_id, *args, **kwargs))
+            while True:
+                task = self._next_task()
+                if task is None:
+                    return
+                try:
+                    self._run_task(loop, *task)
+                finally:
+                    with self._condition:
+                        self._busy[task.lane] -= 1
+                    # Workers held back by the lane caps may take a task now
+                    self._wake(all=True)
+        finally:
+            loop.run_until_complete(aclose_loop_values())
+            loop.close()
+
+    def _wake(self, all=False):
+        with self._condition:
+            self._wakeups += 1
+            if all:
+                self._condition.notify_all()
+            else:
+                self._condition.notify()
+
+    def _next_task(self):
+        while True:
+            # The lanes are picked under the condition, the claim runs outside
+            # it so add_task and other workers do not wait for the database
+            with self._condition:
+                if self._stopping:
+                    return None
+                wakeups = self._wakeups
+                busy = sum(self._busy.values()) + self._claiming
+                lanes = [lane for lane in LANES if busy < lane_cap(lane, self.workers, self.reserved)]
+                if lanes:
+                    self._claiming += 1
+            task = None
+            if lanes:
+                try:
+                    task = self._claim(lanes)
+                except Exception as e:
+                    logger.error(f"Error taking a task from the queue: {str(e)}")
+            with self._condition:
+                if lanes:
+                    self._claiming -= 1
+                if task is not None:
+                    self._busy[task.lane] += 1
+                    return task
+                # Nothing to take, unless a wakeup came in while claiming
+                if wakeups == self._wakeups and not self._stopping:
+                    self._condition.wait(POLL_SECONDS)
+
+    def _claim(self, lanes):
+        if not lanes:
+            return None
+        now = _now()
+        with SessionLocal() as db:
+            next_id = (
+                select(Task.id)
+                .where(Task.status == "pending", Task.handler.isnot(None), Task.lane.in_(lanes))
+                .order_by(Task.priority.desc(), Task.created_at)
+                .limit(1)
+                .scalar_subquery()
+            )
+            task = db.execute(
+                update(Task)
+                .where(Task.id == next_id, Task.status == "pending")
+                .values(status="processing", started_at=now)
+                .returning(Task.id, Task.name, Task.handler, Task.payload, Task.lane, Task.created_at)
+                .execution_options(synchronize_session=False)
+            ).first()
+            db.commit()
+        if task is None:
+            return None
+        with self._live_lock:
+            self._live[task.id] = {"id": task.id, "name": task.name, "status": "processing",
+                                   "progress": "0", "result": None}
+        if task.created_at is not None:
+            self._waits.append((now - task.created_at).total_seconds())
+        return task
+
+    def _run_task(self, loop, task_id, name, handler, payload, lane, created_at):
+        task_func = self._handlers.get(handler)
+        # Copied into the task's context when run_until_complete wraps the coroutine
+        token = current_lane.set(lane)
+        try:
+            if task_func is None:
+                raise ValueError(f"No task function registered as {handler}")
+            payload = payload or {}
+            result = loop.run_until_complete(task_func(task_id, *payload.get("args", []), **payload.get("kwargs", {})))
             self._update_task(task_id, "completed", "100", result)
         except Exception as e:
+            logger.error(f"Task {task_id} ({handler}) failed: {str(e)}")
             self._update_task(task_id, "failed", "0", str(e))
         finally:
-            loop.close()
+            current_lane.reset(token)
+
+    def update_progress(self, task_id, progress):
+        """Record the progress of a running task, written to the tasks table by the next flush."""
+        with self._live_lock:
+            task = self._live.get(task_id)
+            if task is not None:
+                task["progress"] = str(progress)
+                self._dirty.add(task_id)
+                self._progress_updates += 1
+                return
+        # Not run by this queue, nothing keeps it in memory
+        self._update_task(task_id, "processing", str(progress), None)
+
+    def flush_progress(self):
+        """Write the progress updates since the last flush, in one executemany."""
+        with self._live_lock:
+            values = [{"id": task_id, "progress": self._live[task_id]["progress"]}
+                      for task_id in self._dirty if task_id in self._live]
+            self._dirty.clear()
+        if not values:
+            return
+        try:
+            with SessionLocal() as db:
+                # A task that finished meanwhile keeps its final progress
+                db.execute(
+                    update(Task).where(Task.status == "processing").execution_options(synchronize_session=None),
+                    values,
+                )
+                db.commit()
+        except Exception as e:
+            logger.error(f"Error writing the progress of {len(values)} tasks: {str(e)}")
+            with self._live_lock:
+                self._dirty.update(value["id"] for value in values)
+            return
+        with self._live_lock:
+            self._progress_flushes += 1
+            self._progress_rows += len(values)
+
+    def _flush_periodically(self):
+        while not self._flush_stop.wait(PROGRESS_FLUSH_SECONDS):
+            self.flush_progress()
 
     def _update_task(self, task_id, status, progress, result):
         with SessionLocal() as db:
@@ -56,9 +345,55 @@ class TaskQueue:
                 task.status = status
                 task.progress = progress
                 task.result = result
+                if status in ("completed", "failed"):
+                    task.finished_at = datetime.now(timezone.utc)
                 db.commit()
+        if status != "processing":
+            # Written, reads of the task go to the table again
+            with self._live_lock:
+                self._live.pop(task_id, None)
+                self._dirty.discard(task_id)
+
+    def stats(self):
+        with SessionLocal() as db:
+            counts = dict(db.query(Task.status, func.count(Task.id)).group_by(Task.status).all())
+            pending = dict(
+                db.query(Task.lane, func.count(Task.id)).filter(Task.status == "pending").group_by(Task.lane).all()
+            )
+            oldest = db.scalar(select(func.min(Task.created_at)).where(Task.status == "pending"))
+        waits = list(self._waits)
+        with self._condition:
+            busy = dict(self._busy)
+        with self._live_lock:
+            progress = {
+                "running": len(self._live),
+                "updates": self._progress_updates,
+                "flushes": self._progress_flushes,
+                "rows_written": self._progress_rows,
+            }
+        return {
+            "workers": self.workers,
+            "busy": sum(busy.values()),
+            "depth": counts.get("pending", 0),
+            "lanes": {
+                lane: {
+                    "workers": lane_cap(lane, self.workers, self.reserved),
+                    "busy": busy[lane],
+                    "depth": pending.get(lane, 0),
+                } for lane in LANES
+            },
+            "oldest_pending_seconds": round((_now() - oldest).total_seconds(), 2) if oldest else 0.0,
+            "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "max_wait_seconds": round(max(waits), 3) if waits else 0.0,
+            "tasks": counts,
+            "progress": progress,
+        }
 
     def get_task_status(self, task_id):
+        with self._live_lock:
+            task = self._live.get(task_id)
+            if task is not None:
+                return dict(task)
         with SessionLocal() as db:
             task = db.query(Task).filter(Task.id == task_id).first()
         if task:
@@ -74,16 +409,19 @@ class TaskQueue:
     def get_all_tasks(self):
         with SessionLocal() as db:
             tasks = db.query(Task).order_by(Task.created_at.desc()).all()
+        with self._live_lock:
+            # Progress not flushed yet
+            live = {task_id: task["progress"] for task_id, task in self._live.items()}
         return [
             {
                 "id": task.id,
                 "name": task.name,
                 "status": task.status,
-                "progress": task.progress,
+                "progress": live.get(task.id, task.progress) if task.status == "processing" else task.progress,
                 "created_at": task.created_at.isoformat() if task.created_at else None
             } for task in tasks
         ]
-    
+
     def get_restartable_tasks(self):
         with SessionLocal() as db:
             tasks = db.query(Task).filter(Task.status == "restartable").all()
@@ -97,4 +435,4 @@ class TaskQueue:
             } for task in tasks
         ]
 
-task_queue = TaskQueue()
\ No newline at end of file
+task_queue = TaskQueue()
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+import database
+import task_queue as task_queue_module
+from database import SessionLocal
+from lanes import LANE_BULK, LANE_INTERACTIVE, current_lane
+from models import Task
+from task_queue import TaskQueue
+
+
+def wait_for(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def stored(task_id):
+    with SessionLocal() as db:
+        task = db.get(Task, task_id)
+        return task.status, task.progress
+
+
+@pytest.fixture
+def make_queue(isolated_db, monkeypatch):
+    monkeypatch.setattr(task_queue_module, "engine", isolated_db)
+    monkeypatch.setattr(database, "engine", isolated_db)
+    monkeypatch.setattr(task_queue_module, "PROGRESS_FLUSH_SECONDS", 0.05)
+    queues = []
+
+    def make(**kwargs):
+        queue = TaskQueue(**kwargs)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.shutdown(timeout=5)
+
+
+def test_workers_run_each_task_once(make_queue):
+    queue = make_queue(workers=4, reserved={})
+    runs = Counter()
+    lock = threading.Lock()
+
+    async def handler(task_id, index):
+        with lock:
+            runs[task_id] += 1
+        queue.update_progress(task_id, 50)
+        # The flusher writes the progress while the task is still running
+        while stored(task_id)[1] != "50":
+            await asyncio.sleep(0.01)
+        return f"done {index}"
+
+    queue.register("drain", handler)
+    task_ids = [queue.add_task(handler, f"Task {index}", index) for index in range(40)]
+    wait_for(lambda: all(stored(task_id)[0] == "completed" for task_id in task_ids))
+
+    assert runs == {task_id: 1 for task_id in task_ids}
+    assert all(stored(task_id) == ("completed", "100") for task_id in task_ids)
+    stats = queue.stats()
+    assert stats["busy"] == 0
+    assert stats["progress"]["running"] == 0
+    assert stats["progress"]["rows_written"] >= len(task_ids)
+
+
+def test_progress_is_kept_in_memory_until_flushed(make_queue, monkeypatch):
+    monkeypatch.setattr(task_queue_module, "PROGRESS_FLUSH_SECONDS", 60)
+    queue = make_queue(workers=1, reserved={})
+    updated, finish = threading.Event(), threading.Event()
+
+    async def handler(task_id):
+        queue.update_progress(task_id, 40)
+        updated.set()
+        await asyncio.to_thread(finish.wait, 10)
+        return "done"
+
+    queue.register("progress", handler)
+    task_id = queue.add_task(handler, "Progress")
+    assert updated.wait(10)
+
+    assert queue.get_task_status(task_id)["progress"] == "40"
+    assert stored(task_id) == ("processing", "0")
+    assert queue.get_all_tasks()[0]["progress"] == "40"
+    queue.flush_progress()
+    assert stored(task_id) == ("processing", "40")
+
+    finish.set()
+    wait_for(lambda: stored(task_id)[0] == "completed")
+    wait_for(lambda: queue.stats()["progress"]["running"] == 0)
+    assert queue.get_task_status(task_id)["progress"] == "100"
+
+
+def test_reserved_worker_runs_interactive_task_behind_bulk(make_queue):
+    queue = make_queue(workers=2, reserved={LANE_INTERACTIVE: 1})
+    lanes = {}
+    release = threading.Event()
+
+    async def handler(task_id, block):
+        lanes[task_id] = current_lane.get()
+        if block:
+            await asyncio.to_thread(release.wait, 10)
+        return "done"
+
+    queue.register("lanes", handler)
+    bulk = [queue.add_task(handler, f"Bulk {index}", True, lane=LANE_BULK) for index in range(2)]
+    wait_for(lambda: stored(bulk[0])[0] == "processing")
+    interactive = queue.add_task(handler, "Interactive", False, lane=LANE_INTERACTIVE)
+    wait_for(lambda: stored(interactive)[0] == "completed")
+
+    # Bulk tasks only get the worker not reserved for interactive ones
+    assert stored(bulk[1])[0] == "pending"
+    assert lanes[interactive] == LANE_INTERACTIVE
+    release.set()
+    wait_for(lambda: all(stored(task_id)[0] == "completed" for task_id in bulk))
+    assert lanes[bulk[1]] == LANE_BULK
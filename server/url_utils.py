@@ -0,0 +1,103 @@
+# url_utils.py
+import logging
+import os
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# Query parameters that track where a visitor came from, not what the page shows
+TRACKING_PREFIXES = ("utm_",)
+TRACKING_PARAMS = {
+    param.strip().lower()
+    for param in os.environ.get(
+        'URL_TRACKING_PARAMS',
+        'fbclid,gclid,dclid,msclkid,mc_cid,mc_eid,igshid,yclid,_ga,_gl,ref_src,si'
+    ).split(',')
+    if param.strip()
+}
+
+
+def canonical_url(url: str) -> str:
+    """The form of url that favorites are deduplicated on.
+
+    Lowercases scheme and host, drops default ports, fragments, tracking
+    parameters and trailing slashes of the path, and sorts the remaining query
+    parameters. URLs that cannot be parsed are returned stripped.
+    """
+    url = (url or "").strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").rstrip(".")
+    if not scheme or not host:
+        return url
+
+    netloc = host
+    if ":" in host:
+        netloc = f"[{host}]"
+    if parts.username or parts.password:
+        credentials = parts.username or ""
+        if parts.password:
+            credentials += f":{parts.password}"
+        netloc = f"{credentials}@{netloc}"
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc += f":{port}"
+
+    path = parts.path.rstrip("/")
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not is_tracking_param(key)
+    ))
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+def is_tracking_param(key: str) -> bool:
+    key = key.lower()
+    return key in TRACKING_PARAMS or key.startswith(TRACKING_PREFIXES)
+
+
+def backfill_canonical_urls(engine, batch_size: int = 1000):
+    """Fill canonical_url of favorites written before it existed and make sure it is indexed.
+
+    Of favorites that share a canonical URL only the oldest gets it, the others
+    keep NULL so the unique index can be created.
+    """
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT id, url FROM favorites WHERE canonical_url IS NULL ORDER BY id"
+        )).all()
+        taken = set()
+        if rows:
+            taken = {
+                row[0] for row in conn.execute(text("SELECT canonical_url FROM favorites WHERE canonical_url IS NOT NULL"))
+            }
+        updates, duplicates = [], 0
+        for favorite_id, url in rows:
+            canonical = canonical_url(url)
+            if canonical in taken:
+                duplicates += 1
+                continue
+            taken.add(canonical)
+            updates.append({"id": favorite_id, "canonical_url": canonical})
+        for i in range(0, len(updates), batch_size):
+            conn.execute(
+                text("UPDATE favorites SET canonical_url = :canonical_url WHERE id = :id"),
+                updates[i:i + batch_size]
+            )
+        conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_favorites_canonical_url ON favorites (canonical_url)"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_favorites_to_process_canonical_url ON favorites_to_process (canonical_url)"
+        ))
+        conn.commit()
+    if updates:
+        logger.info(f"Set the canonical URL of {len(updates)} favorites")
+    if duplicates:
+        logger.warning(f"{duplicates} favorites duplicate the canonical URL of an older favorite")
@@ -0,0 +1,54 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from url_utils import backfill_canonical_urls, canonical_url
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("HTTPS://Example.COM/Path", "https://example.com/Path"),
+    ("https://example.com:443/a", "https://example.com/a"),
+    ("http://example.com:80/a", "http://example.com/a"),
+    ("http://example.com:8080/a", "http://example.com:8080/a"),
+    ("https://example.com/a/", "https://example.com/a"),
+    ("https://example.com/", "https://example.com"),
+    ("https://example.com/a#section", "https://example.com/a"),
+    ("https://example.com/a?utm_source=feed&utm_medium=rss", "https://example.com/a"),
+    ("https://example.com/a?fbclid=abc&page=2", "https://example.com/a?page=2"),
+    ("https://example.com/a?b=2&a=1", "https://example.com/a?a=1&b=2"),
+    ("  https://example.com./a  ", "https://example.com/a"),
+    ("not a url", "not a url"),
+    ("https://example.com:bad/", "https://example.com:bad/"),
+])
+def test_canonical_url(url, expected):
+    assert canonical_url(url) == expected
+
+
+def test_backfill_canonical_urls_keeps_oldest_of_duplicates(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/favorites.db")
+    with engine.connect() as conn:
+        conn.execute(text("CREATE TABLE favorites (id INTEGER PRIMARY KEY, url TEXT, canonical_url TEXT)"))
+        conn.execute(text("CREATE TABLE favorites_to_process (id INTEGER PRIMARY KEY, canonical_url TEXT)"))
+        conn.execute(text("INSERT INTO favorites (id, url, canonical_url) VALUES (:id, :url, :canonical_url)"), [
+            {"id": 1, "url": "https://example.com/kept", "canonical_url": "https://example.com/kept"},
+            {"id": 2, "url": "https://Example.com/kept/#top", "canonical_url": None},
+            {"id": 3, "url": "https://example.com/a?utm_source=feed", "canonical_url": None},
+            {"id": 4, "url": "https://EXAMPLE.com/a/", "canonical_url": None},
+            {"id": 5, "url": "https://example.com/b", "canonical_url": None},
+        ])
+        conn.commit()
+
+    backfill_canonical_urls(engine, batch_size=1)
+    # A second run finds nothing to do
+    backfill_canonical_urls(engine)
+
+    with engine.connect() as conn:
+        rows = dict(conn.execute(text("SELECT id, canonical_url FROM favorites ORDER BY id")).all())
+        indexes = {row[1]: row[2] for row in conn.execute(text("PRAGMA index_list(favorites)"))}
+    assert rows == {
+        1: "https://example.com/kept",
+        2: None,
+        3: "https://example.com/a",
+        4: None,
+        5: "https://example.com/b",
+    }
+    assert indexes["ix_favorites_canonical_url"] == 1
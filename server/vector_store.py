@@ -1,6 +1,6 @@
 import chromadb
 from chromadb.utils import embedding_functions
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, text
 from sqlalchemy.orm import sessionmaker
 import os
 from tqdm import tqdm
@@ -11,12 +11,22 @@ builtins.print = rprint
 
 persist_directory = os.environ.get('CHROMA_DIR', './chroma_db')
 
+
+def _metadata(url, title, summary):
+    # Chroma rejects None metadata values, a favorite may have no title
+    return {"url": url, "title": title or "", "summary": summary or ""}
+
+
+def _document(title, summary):
+    return f"{title or ''} {summary or ''}".strip()
+
 class VectorStore:
     def __init__(self):
         self.chroma_client = chromadb.PersistentClient(path=persist_directory)
+        self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
         self.collection = self.chroma_client.get_or_create_collection(
             name="favorites_embeddings",
-            embedding_function=embedding_functions.DefaultEmbeddingFunction()
+            embedding_function=self.embedding_function
         )
         
         # Create SQLite engine and session
@@ -44,8 +54,8 @@ class VectorStore:
             
             # Prepare data for batch insertion
             ids = [str(favorite.id) for favorite in batch]
-            metadatas = [{"url": favorite.url, "title": favorite.title, "summary": favorite.summary} for favorite in batch]
-            documents = [f"{favorite.title} {favorite.summary}" for favorite in batch]
+            metadatas = [_metadata(favorite.url, favorite.title, favorite.summary) for favorite in batch]
+            documents = [_document(favorite.title, favorite.summary) for favorite in batch]
             
             # Add to ChromaDB
             self.collection.add(
@@ -55,42 +65,59 @@ class VectorStore:
             )
             
             # Add to full-text search index
-            with self.Session() as session:
-                for favorite in batch:
-                    session.execute(text("""
-                        INSERT OR REPLACE INTO favorites_fts (id, url, title, summary)
-                        VALUES (:id, :url, :title, :summary)
-                    """), {"id": favorite.id, "url": favorite.url, "title": favorite.title, "summary": favorite.summary})
-                session.commit()
+            self.index_texts([(favorite.id, favorite.url, favorite.title, favorite.summary) for favorite in batch])
 
     def add_favorite(self, id, url, title, summary):
         self.collection.add(
             ids=[str(id)],
-            metadatas={"url": url, "title": title, "summary": summary},
-            documents=[f"{title} {summary}"]
+            metadatas=_metadata(url, title, summary),
+            documents=[_document(title, summary)]
         )
         
         # Add to full-text search index
-        with self.Session() as session:
-            session.execute(text("""
-                INSERT OR REPLACE INTO favorites_fts (id, url, title, summary)
-                VALUES (:id, :url, :title, :summary)
-            """), {"id": id, "url": url, "title": title, "summary": summary})
-            session.commit()
+        self.index_text(id, url, title, summary)
+
+    def add_favorites(self, rows):
+        """Add or replace (id, url, title, summary) rows in the collection and the FTS index in one batch."""
+        if not rows:
+            return
+        self.collection.upsert(
+            ids=[str(id) for id, _, _, _ in rows],
+            metadatas=[_metadata(url, title, summary) for _, url, title, summary in rows],
+            documents=[_document(title, summary) for _, _, title, summary in rows]
+        )
+        self.index_texts(rows)
 
     def update_favorite(self, id, url, title, summary):
         self.collection.update(
             ids=[str(id)],
-            metadatas={"url": url, "title": title, "summary": summary},
-            documents=[f"{title} {summary}"]
+            metadatas=_metadata(url, title, summary),
+            documents=[_document(title, summary)]
         )
         
         # Update full-text search index
+        self.index_text(id, url, title, summary)
+
+    def index_text(self, id, url, title, summary):
+        self.index_texts([(id, url, title, summary)])
+
+    def index_texts(self, rows):
+        """Add or replace (id, url, title, summary) rows in the full-text search index only.
+
+        The FTS table has no key, existing rows of the same ids are deleted first,
+        with one statement per chunk as every delete scans the table.
+        """
         with self.Session() as session:
-            session.execute(text("""
-                INSERT OR REPLACE INTO favorites_fts (id, url, title, summary)
-                VALUES (:id, :url, :title, :summary)
-            """), {"id": id, "url": url, "title": title, "summary": summary})
+            for i in range(0, len(rows), 500):
+                chunk = rows[i:i + 500]
+                session.execute(
+                    text("DELETE FROM favorites_fts WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                    {"ids": [id for id, _, _, _ in chunk]}
+                )
+                session.execute(text("""
+                    INSERT INTO favorites_fts (id, url, title, summary)
+                    VALUES (:id, :url, :title, :summary)
+                """), [{"id": id, "url": url, "title": title, "summary": summary} for id, url, title, summary in chunk])
             session.commit()
 
     def delete_favorite(self, id):
@@ -101,6 +128,20 @@ class VectorStore:
             session.execute(text("DELETE FROM favorites_fts WHERE id = :id"), {"id": id})
             session.commit()
 
+    def embed(self, texts):
+        """Embed texts with the same model as the favorites collection."""
+        return self.embedding_function(texts)
+
+    def get_embeddings(self, ids, batch_size=500):
+        """Return {favorite id: embedding} for the ids present in the collection."""
+        embeddings = {}
+        ids = [str(id) for id in ids]
+        for i in range(0, len(ids), batch_size):
+            result = self.collection.get(ids=ids[i:i + batch_size], include=["embeddings"])
+            for id, embedding in zip(result["ids"], result["embeddings"]):
+                embeddings[int(id)] = embedding
+        return embeddings
+
     def search_favorites(self, query, limit=10):
         # Perform vector search
         vector_results = self.collection.query(